@@ -0,0 +1,109 @@
+# ============================================================================ #
+# Undoable OpenMaya edits
+#
+# Edits made through the API (MDGModifier, MAnimCurveChange) never reach
+# Maya's undo queue on their own. commit() pushes an undo/redo pair through a
+# tiny command plugin so the batch undoes like any other Maya command.
+#
+# Usage:
+#   change = oma.MAnimCurveChange()
+#   ... edit curves with change ...
+#   apiUndo.commit(change.undoIt, change.redoIt)
+
+import os
+import sys
+import types
+import tempfile
+
+from maya import cmds
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+COMMAND_NAME = 'utilsApiUndo'
+PLUGIN_NAME  = 'utilsApiUndo'
+SHARED_NAME  = '_utilsApiUndoShared' # sys.modules entry shared with the plugin
+
+_PLUGIN_SOURCE = '''\
+import sys
+import maya.api.OpenMaya as om
+
+def maya_useNewAPI():
+    pass
+
+class ApiUndoCommand(om.MPxCommand):
+    def doIt(self, args):
+        shared = sys.modules["{shared}"]
+        self.undo, self.redo = shared.pending
+        shared.pending = None
+
+    def undoIt(self):
+        self.undo()
+
+    def redoIt(self):
+        self.redo()
+
+    def isUndoable(self):
+        return True
+
+def initializePlugin(plugin):
+    om.MFnPlugin(plugin).registerCommand("{command}", ApiUndoCommand)
+
+def uninitializePlugin(plugin):
+    om.MFnPlugin(plugin).deregisterCommand("{command}")
+'''.format(shared=SHARED_NAME, command=COMMAND_NAME)
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _shared():
+    shared = sys.modules.get(SHARED_NAME)
+    if shared is None:
+        shared = types.ModuleType(SHARED_NAME)
+        shared.pending = None
+        sys.modules[SHARED_NAME] = shared
+    return shared
+
+def _install():
+    if cmds.pluginInfo(PLUGIN_NAME, q=True, loaded=True):
+        return
+    path = os.path.join(tempfile.gettempdir(), PLUGIN_NAME + '.py')
+    with open(path, 'w') as plugin_file:
+        plugin_file.write(_PLUGIN_SOURCE)
+    cmds.loadPlugin(path, quiet=True)
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def commit(undo, redo):
+    '''
+    Put an already-applied API edit on the undo queue.
+    undo: callable reverting the edit
+    redo: callable re-applying it
+    '''
+    _shared().pending = (undo, redo)
+    _install()
+    getattr(cmds, COMMAND_NAME)()
+
+
+def commit_all(*changes):
+    '''
+    Commit several MDGModifier/MAnimCurveChange objects as one undo step.
+    They are undone in reverse order.
+    '''
+    changes = [c for c in changes if c is not None]
+
+    def undo():
+        for change in reversed(changes):
+            change.undoIt()
+
+    def redo():
+        for change in changes:
+            if hasattr(change, 'redoIt'):
+                change.redoIt()
+            else: # MDGModifier
+                change.doIt()
+
+    commit(undo, redo)
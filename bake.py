@@ -1,78 +1,665 @@
 from maya import cmds, mel
-from functools import wraps
+from contextlib import contextmanager
+import traceback
+
+import numpy as np
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+import apiUndo
+import keyData
+import keyReduction
+import performance
+import rotationMath
+
+# Globals ============================================================ #
+
+ENGINES = ('bakeResults', 'matrix')
+BAKE_ATTRIBUTES = ("tx", "ty", "tz", "rx", "ry", "rz", "blendParent1")
+
+# Adaptive oversampling - speed in UI units per frame (cm, degrees) above which
+# a segment gets subframe samples
+OVERSAMPLE_THRESHOLDS = { 'translate' : 10.0
+                        , 'rotate'    : 30.0
+                        }
+TANGENT_SPILL = 2 # Neighbouring keys an edit can reach through auto tangents
+
+# Channels the matrix engine decomposes instead of sampling one by one
+TRANSFORM_CHANNELS = { 'tx' : ('translate', 0), 'translateX' : ('translate', 0)
+                     , 'ty' : ('translate', 1), 'translateY' : ('translate', 1)
+                     , 'tz' : ('translate', 2), 'translateZ' : ('translate', 2)
+                     , 'rx' : ('rotate', 0),    'rotateX'    : ('rotate', 0)
+                     , 'ry' : ('rotate', 1),    'rotateY'    : ('rotate', 1)
+                     , 'rz' : ('rotate', 2),    'rotateZ'    : ('rotate', 2)
+                     , 'sx' : ('scale', 0),     'scaleX'     : ('scale', 0)
+                     , 'sy' : ('scale', 1),     'scaleY'     : ('scale', 1)
+                     , 'sz' : ('scale', 2),     'scaleZ'     : ('scale', 2)
+                     }
 
 # Decorators ========================================================= #
 
 def viewport_off(func):
     """
     Decorator - turn off Maya display while func is running. if func fails, the error will be raised after.
+    Nests safely - see performance.Suspend for the other switches.
     """
-    @wraps(func)
-    def wrap( *args, **kwargs ):
-
-        parallel = False
-        if 'parallel' in cmds.evaluationManager(q=True, mode=True):
-            cmds.evaluationManager(mode='off')
-            parallel = True
-            print "Turning off Parallel evaluation..."
-        # Turn $gMainPane Off:
-        mel.eval("paneLayout -e -manage false $gMainPane")
-        cmds.refresh(suspend=True)
-        # Hide the timeslider
-        mel.eval("setTimeSliderVisible 0;")
-
-
-        # Decorator will try/except running the function.
-        # But it will always turn on the viewport at the end.
-        # In case the function failed, it will prevent leaving maya viewport off.
+    return performance.Suspend(func.__name__, viewport=True, parallel=True,
+                               time_slider=True)(func)
+
+
+# Channel discovery ================================================== #
+
+def _plugs(channels):
+    return ['{}.{}'.format(node, attr)
+            for node, attributes in sorted(channels.items())
+            for attr in attributes]
+
+def _is_driver(source_plug):
+    ''' Anything feeding a channel counts, except curves that never change. '''
+    source = source_plug.node()
+    if source.hasFn(om.MFn.kAnimCurve):
+        return not oma.MFnAnimCurve(source).isStatic
+    return True
+
+def _ik_joints():
+    ''' MObjectHandle hashCodes of every joint an ikHandle rotates. '''
+    joints = set()
+    for handle in cmds.ls(type='ikHandle') or []:
+        for joint in cmds.ikHandle(handle, q=True, jointList=True) or []:
+            try:
+                joints.add(om.MObjectHandle(keyData.get_node(joint)).hashCode())
+            except RuntimeError:
+                continue
+    return joints
+
+def discover_channels(nodes):
+    '''
+    {node: [attr, ...]} for every keyable plug on nodes, and their shapes
+    (keyed by full path), that is driven by animation, constraints,
+    pairBlends, expressions, driven keys...
+    Found with a single listConnections over the whole selection, so
+    undriven and static channels never get a curve. Joints in an ikHandle
+    chain get their rotates too, as IK drives them without a connection.
+    '''
+    shapes = cmds.listRelatives(nodes, shapes=True, fullPath=True) or []
+    targets = list(nodes) + shapes
+    # Connection results use their own naming, map back through the API
+    names = dict((om.MObjectHandle(keyData.get_node(n)).hashCode(), n)
+                 for n in targets)
+    pairs = cmds.listConnections( targets
+                                , source=True
+                                , destination=False
+                                , connections=True
+                                , plugs=True
+                                , skipConversionNodes=True
+                                ) or []
+
+    channels = {}
+    for destination, source in zip(pairs[::2], pairs[1::2]):
+        try:
+            plug = keyData.get_plug(destination)
+            source_plug = keyData.get_plug(source)
+        except RuntimeError:
+            continue
+        if not _is_driver(source_plug):
+            continue
+        # Compounds (translate, rotate...) connect as a whole
+        plugs = [plug.child(i) for i in range(plug.numChildren())] \
+            if plug.isCompound else [plug]
+        node = names.get(om.MObjectHandle(plug.node()).hashCode())
+        if node is None:
+            continue
+        for channel in plugs:
+            if not channel.isKeyable or channel.isLocked:
+                continue
+            attr = channel.partialName()
+            attributes = channels.setdefault(node, [])
+            if attr not in attributes:
+                attributes.append(attr)
+
+    # IK solves joint rotations without a connection to find
+    ik_joints = _ik_joints()
+    for key, node in names.items():
+        if key not in ik_joints:
+            continue
+        attributes = channels.setdefault(node, [])
+        for attr in ('rx', 'ry', 'rz'):
+            plug = keyData.get_plug('{}.{}'.format(node, attr))
+            if plug.isKeyable and not plug.isLocked and attr not in attributes:
+                attributes.append(attr)
+    return channels
+
+
+# Matrix engine ====================================================== #
+
+class _BakeTarget(object):
+    '''
+    Everything the matrix engine needs to know about one node.
+    Pivots and orients are read once - they are assumed not to be animated.
+    '''
+    def __init__(self, node_name, attributes):
+        self.name = node_name
+        self.node = keyData.get_node(node_name)
+        self.fn = om.MFnDependencyNode(self.node)
+        self.is_transform = self.node.hasFn(om.MFn.kTransform)
+        self.is_joint = self.node.hasFn(om.MFn.kJoint)
+
+        attributes = [a for a in attributes if self.fn.hasAttribute(a)]
+        self.transform_channels = [a for a in attributes
+                                   if self.is_transform
+                                   and a in TRANSFORM_CHANNELS]
+        self.scalar_plugs = [(a, self.fn.findPlug(a, False))
+                             for a in attributes
+                             if a not in self.transform_channels]
+
+        self.matrix_plug = None
+        self.inverse_scale_plug = None
+        if self.transform_channels:
+            self.matrix_plug = self.fn.findPlug('matrix', False)
+            if self.is_joint and self._plug('segmentScaleCompensate').asBool():
+                self.inverse_scale_plug = self._plug('inverseScale')
+
+        self.rotate_order = self._plug('rotateOrder').asShort() \
+            if self.is_transform else 0
+        self.rotate_axis = self._rotation('rotateAxis')
+        self.joint_orient = self._rotation('jointOrient')
+        self.scale_pivot = self._double3('scalePivot')
+        self.scale_pivot_translate = self._double3('scalePivotTranslate')
+        self.rotate_pivot = self._double3('rotatePivot')
+        self.rotate_pivot_translate = self._double3('rotatePivotTranslate')
+
+    def _plug(self, name):
+        return self.fn.findPlug(name, False)
+
+    def _double3(self, name):
+        if not self.is_transform or not self.fn.hasAttribute(name):
+            return np.zeros(3)
+        plug = self._plug(name)
+        return np.array([plug.child(i).asDouble() for i in range(3)])
+
+    def _rotation(self, name):
+        euler = self._double3(name)
+        return rotationMath.euler_to_matrix(euler, 'xyz')
+
+
+@contextmanager
+def _dg_context(frame, unit):
+    '''
+    Evaluate plugs at frame without moving the time slider.
+    Yields the extra args MPlug.as*() needs for this Maya version.
+    '''
+    context = om.MDGContext(om.MTime(frame, unit))
+    if hasattr(context, 'makeCurrent'): # 2019+
+        previous = context.makeCurrent()
         try:
-            return func( *args, **kwargs )
-        except Exception:
-            raise # will raise original error
+            yield ()
         finally:
-            cmds.refresh(suspend=False)
-            mel.eval("setTimeSliderVisible 1;")
-            if parallel:
-                cmds.evaluationManager(mode='parallel')
-                print "Turning on Parallel evaluation..."
-            mel.eval("paneLayout -e -manage true $gMainPane")
-            cmds.refresh()
+            previous.makeCurrent()
+    else:
+        yield (context,)
+
+def _sample_frames(start_frame, end_frame, sample):
+    count = int(np.floor((end_frame - start_frame) / float(sample) + 1e-6)) + 1
+    return start_frame + np.arange(count) * float(sample)
+
+def _sample_targets(targets, frames, unit):
+    '''
+    One pass over time. Every node's local matrix and scalar channels are
+    pulled in the same context so the graph is evaluated once per frame.
+    '''
+    matrices = np.zeros((len(frames), len(targets), 16))
+    matrices[..., ::5] = 1.0 # identity for nodes without transform channels
+    parent_scales = np.ones((len(frames), len(targets), 3))
+    scalars = dict(((n, attr), np.zeros(len(frames)))
+                   for n, target in enumerate(targets)
+                   for attr, _ in target.scalar_plugs)
+
+    for f, frame in enumerate(frames):
+        with _dg_context(frame, unit) as args:
+            for n, target in enumerate(targets):
+                if target.matrix_plug is not None:
+                    data = target.matrix_plug.asMObject(*args)
+                    matrices[f, n] = list(om.MFnMatrixData(data).matrix())
+                if target.inverse_scale_plug is not None:
+                    parent_scales[f, n] = \
+                        [target.inverse_scale_plug.child(i).asDouble(*args)
+                         for i in range(3)]
+                for attr, plug in target.scalar_plugs:
+                    scalars[n, attr][f] = plug.asDouble(*args)
+
+    return matrices.reshape(len(frames), len(targets), 4, 4), \
+           parent_scales, scalars
+
+def _decompose(targets, matrices, parent_scales):
+    '''
+    Split (frames, nodes, 4, 4) local matrices back into channel values.
+    Joints:     S * RA * R * JO * IS * T
+    Transforms: -Sp * S * Sp * St * -Rp * RA * R * Rp * Rt * T
+    Shear is ignored. Returns translate, rotate (radians), scale as
+    (frames, nodes, 3) arrays.
+    '''
+    rotate_axis  = np.array([t.rotate_axis for t in targets])
+    joint_orient = np.array([t.joint_orient for t in targets])
+    is_joint     = np.array([t.is_joint for t in targets])
+    orders       = np.array([t.rotate_order for t in targets])
+
+    # Undo segment scale compensate (IS) before pulling scale out
+    upper = matrices[..., :3, :3] * parent_scales[..., None, :]
+    scale, rotation = rotationMath.orthonormalize(upper)
+
+    # rotation = RA * R * JO
+    local = np.matmul(np.matmul(np.swapaxes(rotate_axis, -1, -2), rotation),
+                      np.swapaxes(joint_orient, -1, -2))
+    # Each frame takes the euler solution (and whole turns) closest to the
+    # frame before, so the middle axis passing 90 degrees doesn't flip the
+    # other two - minimizeRotation plus the euler filter
+    rotate = np.zeros(scale.shape)
+    for order in set(orders.tolist()):
+        columns = orders == order
+        rotate[:, columns] = rotationMath.filter_euler(
+            rotationMath.matrix_to_euler(local[:, columns], order), order)[0]
+
+    scale_pivot = np.array([t.scale_pivot for t in targets])
+    rotate_pivot = np.array([t.rotate_pivot for t in targets])
+    offset = (scale_pivot - scale_pivot * scale
+              + np.array([t.scale_pivot_translate for t in targets])
+              - rotate_pivot)
+    pivot_translate = np.einsum('fni,fnij->fnj', offset, rotation) \
+        + rotate_pivot \
+        + np.array([t.rotate_pivot_translate for t in targets])
+    translate = matrices[..., 3, :3] \
+        - np.where(is_joint[None, :, None], 0.0, pivot_translate)
+
+    return translate, rotate, scale
+
+def _fast_segments(targets, frames, translate, rotate, thresholds):
+    '''
+    (segments, nodes) bool - segments between samples moving faster than
+    thresholds. Linear speed for translate, fastest axis for rotate. Only
+    the channels actually baked count.
+    '''
+    gaps = np.diff(frames)[:, None]
+    linear = np.linalg.norm(np.diff(translate, axis=0), axis=-1) / gaps \
+        * keyData.ui_scale('translate')
+    angular = np.abs(np.diff(rotate, axis=0)).max(axis=-1) / gaps \
+        * keyData.ui_scale('rotate')
+    baked = dict((kind, np.array([any(TRANSFORM_CHANNELS[a][0] == kind
+                                      for a in t.transform_channels)
+                                  for t in targets], dtype=bool))
+                 for kind in ('translate', 'rotate'))
+    return ((linear > thresholds['translate']) & baked['translate']) \
+         | ((angular > thresholds['rotate']) & baked['rotate'])
+
+def _subframes(frames, fast, rate):
+    '''
+    Extra sample times splitting every fast segment rate ways.
+    Returns (extra,) frames and the (extra, nodes) mask of who needs them.
+    '''
+    steps = np.arange(1, rate) / float(rate)
+    extra = (frames[:-1, None] + np.diff(frames)[:, None] * steps).ravel()
+    mask = np.repeat(fast, rate - 1, axis=0)
+    used = mask.any(axis=1)
+    return extra[used], mask[used]
+
+def _channel_values(target, n, decomposed, scalars):
+    ''' [(attr, values), ...] for column n of the sampled arrays. '''
+    values = [(attr, decomposed[TRANSFORM_CHANNELS[attr][0]]
+                               [:, n, TRANSFORM_CHANNELS[attr][1]])
+              for attr in target.transform_channels]
+    values += [(attr, scalars[n, attr]) for attr, _ in target.scalar_plugs]
+    return values
+
+def _oversample(targets, frames, matrices, parent_scales, scalars,
+                decomposed, rate, thresholds, unit):
+    '''
+    Sample the fast segments again at subframes, for the nodes that need
+    it only. Returns {node index: (frames, [(attr, values), ...])}.
+    '''
+    fast = _fast_segments(targets, frames, decomposed['translate'],
+                          decomposed['rotate'], thresholds)
+    extra, mask = _subframes(frames, fast, rate)
+    nodes = np.flatnonzero(mask.any(axis=0))
+    if not len(nodes):
+        return {}
+
+    subset = [targets[n] for n in nodes]
+    extra_matrices, extra_scales, extra_scalars = \
+        _sample_targets(subset, extra, unit)
+
+    # Decompose whole and subframes together so rotations unwrap as one
+    order = np.argsort(np.concatenate([frames, extra]), kind='mergesort')
+    all_frames = np.concatenate([frames, extra])[order]
+    matrices = np.concatenate([matrices[:, nodes], extra_matrices])[order]
+    parent_scales = np.concatenate([parent_scales[:, nodes],
+                                    extra_scales])[order]
+    sub_decomposed = dict(zip(('translate', 'rotate', 'scale'),
+                              _decompose(subset, matrices, parent_scales)))
+    sub_scalars = dict(((i, attr), np.concatenate([scalars[n, attr],
+                                                   extra_scalars[i, attr]])[order])
+                       for i, n in enumerate(nodes)
+                       for attr, _ in targets[n].scalar_plugs)
+    keep = np.concatenate([np.ones((len(frames), len(nodes)), dtype=bool),
+                           mask[:, nodes]])[order]
+
+    oversampled = {}
+    for i, n in enumerate(nodes):
+        values = _channel_values(subset[i], i, sub_decomposed, sub_scalars)
+        oversampled[n] = (all_frames[keep[:, i]],
+                          [(attr, v[keep[:, i]]) for attr, v in values])
+    return oversampled
+
+def _clear_range(curve_fn, start_frame, end_frame, unit, change):
+    for index in reversed(range(curve_fn.numKeys)):
+        frame = curve_fn.input(index).asUnits(unit)
+        if start_frame - 1e-6 <= frame <= end_frame + 1e-6:
+            curve_fn.remove(index, change)
+
+def _bake_matrix(channels, start_frame, end_frame, sample, oversample=1,
+                 thresholds=None):
+    '''
+    Step time once, pull every node's matrix in that evaluation, decompose
+    all frames at once and write each channel with a single addKeys call.
+    Keys outside the range are kept. Undoes as one step.
+    oversample > 1 adds that many samples per step, but only to the
+    segments of the nodes moving faster than OVERSAMPLE_THRESHOLDS.
+    '''
+    unit = om.MTime.uiUnit()
+    frames = _sample_frames(start_frame, end_frame, sample)
+    targets = [_BakeTarget(node, attributes)
+               for node, attributes in sorted(channels.items())]
+
+    matrices, parent_scales, scalars = _sample_targets(targets, frames, unit)
+    decomposed = dict(zip(('translate', 'rotate', 'scale'),
+                          _decompose(targets, matrices, parent_scales)))
+
+    oversampled = {}
+    if oversample > 1 and len(frames) > 1:
+        limits = dict(OVERSAMPLE_THRESHOLDS)
+        limits.update(thresholds or {})
+        oversampled = _oversample(targets, frames, matrices, parent_scales,
+                                  scalars, decomposed, int(oversample),
+                                  limits, unit)
+
+    whole_times = keyData.time_array(frames, unit)
+    modifier = om.MDGModifier()
+    change = oma.MAnimCurveChange()
+    for n, target in enumerate(targets):
+        if n in oversampled:
+            node_frames, values = oversampled[n]
+            times = keyData.time_array(node_frames, unit)
+        else:
+            values = _channel_values(target, n, decomposed, scalars)
+            times = whole_times
+        for attr, channel_values in values:
+            plug = target.fn.findPlug(attr, False)
+            if plug.isLocked:
+                continue
+            curve_fn = keyData.curve_for_plug(plug, modifier)
+            _clear_range(curve_fn, start_frame, end_frame, unit, change)
+            curve_fn.addKeys( times
+                            , om.MDoubleArray(channel_values.tolist())
+                            , oma.MFnAnimCurve.kTangentGlobal
+                            , oma.MFnAnimCurve.kTangentGlobal
+                            , True # keep keys outside the range
+                            , change
+                            )
+    apiUndo.commit_all(modifier, change)
+
+
+# bakeResults engine ================================================ #
+
+def _bake_results(channels, start_frame, end_frame, sample):
+    ''' The original path - Maya's simulation bake. '''
+    cmds.bakeResults(
+        _plugs(channels),
+        simulation = True,
+        time = (start_frame, end_frame),
+        sampleBy = sample,
+        oversamplingRate = 1,
+        disableImplicitControl = True,
+        preserveOutsideKeys = True,
+        sparseAnimCurveBake = False,
+        removeBakedAttributeFromLayer = False,
+        removeBakedAnimFromLayer = False,
+        bakeOnOverrideLayer = False,
+        minimizeRotation = True,
+        controlPoints = False,
+        shape = False # shapes come in through channels
+        )
+
+
+# Post bake ========================================================== #
+
+def _reduce(channels, start_frame, end_frame, tolerances):
+    curves = cmds.keyframe(_plugs(channels), q=True, name=True) or []
+    if not isinstance(tolerances, dict):
+        tolerances = None
+    report = keyReduction.reduce_curves(curves, tolerances,
+                                        start_frame, end_frame)
+    print("Reduced {keys_in} -> {keys_out} keys".format(**report))
+    for channel, error in sorted(report['max_error'].items()):
+        print("    max {} error: {:.6f}".format(channel, error))
+    return report
+
+
+# Incremental bake cache ============================================= #
+
+def _changed_ranges(old, new):
+    '''
+    Frame ranges where two versions of a curve can evaluate differently.
+    Each changed key dirties its neighbours out to TANGENT_SPILL keys, as
+    auto/spline tangents pick up the edit. Returns None if the whole
+    timeline is affected (infinity changes, cycling curves).
+    '''
+    infinities = (old.pre_infinity, old.post_infinity,
+                  new.pre_infinity, new.post_infinity)
+    if infinities[:2] != infinities[2:] \
+            or any(i != 'constant' and i != 'linear' for i in infinities):
+        return None
+
+    all_times = np.union1d(old.times, new.times)
+    changed = np.setxor1d(old.times, new.times)
+    shared, old_index, new_index = np.intersect1d(old.times, new.times,
+                                                  return_indices=True)
+    differs = np.zeros(len(shared), dtype=bool)
+    for field in keyData.CurveKeys.ARRAYS[1:]:
+        differs |= getattr(old, field)[old_index] != getattr(new, field)[new_index]
+    changed = np.union1d(changed, shared[differs])
+
+    ranges = []
+    for time in changed:
+        index = np.searchsorted(all_times, time)
+        low = index - TANGENT_SPILL
+        high = index + TANGENT_SPILL
+        ranges.append((all_times[low] if low >= 0 else -np.inf,
+                       all_times[high] if high < len(all_times) else np.inf))
+    return ranges
+
+def _merge_ranges(ranges):
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return [tuple(r) for r in merged]
+
+def _ancestors(long_name):
+    return ['|'.join(long_name.split('|')[:i])
+            for i in range(2, long_name.count('|') + 1)]
+
+def _source_curves(node):
+    '''
+    Time curves upstream of node, minus the ones the bake writes to.
+    Parents are included as constraints read their world matrices - the
+    parents of every transform found upstream too (a constraint target's
+    parent control), and their history in turn, until nothing new shows up.
+    '''
+    long_name = (cmds.ls(node, long=True) or [node])[0]
+    visited = set()
+    pending = [long_name] + _ancestors(long_name)
+    history = set()
+    while pending:
+        visited.update(pending)
+        found = cmds.listHistory(pending) or []
+        history.update(found)
+        transforms = cmds.ls(found, type='transform', long=True) or []
+        pending = [parent for transform in transforms
+                   for parent in [transform] + _ancestors(transform)
+                   if parent not in visited]
+        pending = list(set(pending))
+    sources = set(cmds.ls(list(history), type=('animCurveTL', 'animCurveTA',
+                                               'animCurveTU', 'animCurveTT')) or [])
+
+    blends = cmds.listConnections(long_name, source=True, destination=False,
+                                  type='pairBlend') or []
+    baked = cmds.listConnections([long_name] + blends, source=True,
+                                 destination=False, type='animCurve') or []
+    return sorted(sources - set(baked))
+
+
+class BakeCache(object):
+    '''
+    Remembers the source curves that drove each baked node, so a re-bake
+    only re-samples the frames touched by edited keys.
+    Edits that don't go through keys (static attribute values, rig changes)
+    aren't seen - do a full bake after those.
+    '''
+    def __init__(self):
+        self.entries = {} # node: {'settings': (), 'sources': {curve: (hash, keys)}}
 
-    return wrap
+    def clear(self):
+        self.entries = {}
 
+    def _snapshot(self, node):
+        sources = {}
+        for curve in _source_curves(node):
+            keys = keyData.read_curve(curve)
+            sources[curve] = (keys.digest(), keys)
+        return sources
+
+    def store(self, nodes, start_frame, end_frame, sample):
+        for node in nodes:
+            self.entries[node] = { 'settings' : (start_frame, end_frame, sample)
+                                 , 'sources'  : self._snapshot(node)
+                                 }
+
+    def dirty_ranges(self, node, start_frame, end_frame, sample):
+        '''
+        Frame ranges of node that need baking again, snapped out to the
+        sample grid. [] when nothing changed.
+        '''
+        full = [(start_frame, end_frame)]
+        entry = self.entries.get(node)
+        if not entry or entry['settings'] != (start_frame, end_frame, sample):
+            return full
+
+        previous = entry['sources']
+        current = _source_curves(node)
+        if set(current) != set(previous):
+            return full
+
+        ranges = []
+        for curve in current:
+            keys = keyData.read_curve(curve)
+            old_hash, old_keys = previous[curve]
+            if keys.digest() == old_hash:
+                continue
+            changed = _changed_ranges(old_keys, keys)
+            if changed is None:
+                return full
+            ranges.extend(changed)
+
+        snapped = []
+        for low, high in _merge_ranges(ranges):
+            low = max(low, start_frame)
+            high = min(high, end_frame)
+            if low > high:
+                continue
+            low = start_frame + np.floor((low - start_frame) / sample) * sample
+            high = start_frame + np.ceil((high - start_frame) / sample) * sample
+            snapped.append((float(low), float(min(high, end_frame))))
+        return _merge_ranges(snapped)
+
+    def plan(self, nodes, start_frame, end_frame, sample):
+        ''' {(start, end): [nodes]} - nodes sharing dirty ranges bake together. '''
+        jobs = {}
+        for node in nodes:
+            for frame_range in self.dirty_ranges(node, start_frame,
+                                                 end_frame, sample):
+                jobs.setdefault(frame_range, []).append(node)
+        return jobs
+
+
+CACHE = BakeCache()
+
+
+# Public methods ===================================================== #
 
 @viewport_off
-def run(nodes_to_bake, start_frame=None, end_frame=None, sample = 1):
+def run(nodes_to_bake, start_frame=None, end_frame=None, sample = 1,
+        engine='bakeResults', reduce_keys=False, incremental=False,
+        attributes=None, oversample=1, oversample_thresholds=None):
     '''
     nodes: list
     start_frame: int
     end_frame: int
+    engine: 'bakeResults' - Maya's own simulation bake
+            'matrix'      - single pass matrix sampling, see _bake_matrix
+    reduce_keys: False, True or a tolerance dict - fit the baked range with
+                 keyReduction afterwards
+    incremental: only re-bake the frames whose source keys changed since
+                 the last incremental bake of the same nodes and range
+                 (see BakeCache)
+    attributes: channels to bake on every node. By default they are found
+                with discover_channels, BAKE_ATTRIBUTES is the old fixed set
+    oversample: matrix engine only - samples per step in the segments
+                faster than OVERSAMPLE_THRESHOLDS (or oversample_thresholds).
+                Speed is measured from the whole step samples, so only fast
+                segments pay for the extra evaluations
     '''
+    if engine not in ENGINES:
+        cmds.warning('Unknown bake engine "{}". Use one of {}'.format(engine, ENGINES))
+        return False
     if not start_frame:
         start_frame = cmds.playbackOptions(q=True, ast=True)
     if not end_frame:
         end_frame = cmds.playbackOptions(q=True, aet=True)
+    if oversample > 1 and engine != 'matrix':
+        cmds.warning('oversample needs the matrix engine, baking without it')
+    cmds.undoInfo(openChunk=True) # Every job undoes together
     try:
-        cmds.bakeResults(
-            nodes_to_bake,
-            simulation = True,
-            time = (start_frame, end_frame),
-            sampleBy = sample,
-            oversamplingRate = 1,
-            disableImplicitControl = True,
-            preserveOutsideKeys = True,
-            at = ("tx", "ty", "tz", "rx", "ry", "rz", "blendParent1"),
-            sparseAnimCurveBake = False,
-            removeBakedAttributeFromLayer = False,
-            removeBakedAnimFromLayer = False,
-            bakeOnOverrideLayer = False,
-            minimizeRotation = True,
-            controlPoints = False,
-            shape = True
-            )
+        if attributes is None:
+            channels = discover_channels(nodes_to_bake)
+        else:
+            channels = dict((node, [a for a in attributes
+                                    if cmds.attributeQuery(a, node=node,
+                                                           exists=True)])
+                            for node in nodes_to_bake)
+        targets = sorted(channels)
+
+        if incremental:
+            jobs = CACHE.plan(targets, start_frame, end_frame, sample)
+        else:
+            jobs = {(start_frame, end_frame): targets}
+        for (job_start, job_end), nodes in sorted(jobs.items()):
+            job = dict((node, channels[node]) for node in nodes)
+            if engine == 'matrix':
+                _bake_matrix(job, job_start, job_end, sample, oversample,
+                             oversample_thresholds)
+            else:
+                _bake_results(job, job_start, job_end, sample)
+            if reduce_keys:
+                _reduce(job, job_start, job_end, reduce_keys)
+        if incremental:
+            CACHE.store(targets, start_frame, end_frame, sample)
         return True
-    except:
+    except RuntimeError as error: # Maya command failed - missing node, locked channel...
+        traceback.print_exc()
+        cmds.warning('Bake failed: {}'.format(error))
         return False
+    finally:
+        cmds.undoInfo(closeChunk=True)
 
 
 # Developer section ================================================== #
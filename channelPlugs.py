@@ -0,0 +1,184 @@
+# ============================================================================ #
+# Selection + channel box -> plug list, cached
+#
+# The lock, mute and slice hotkeys all need the plugs behind the current
+# selection and channel box highlight. ChannelPlugResolver works them out in
+# one pass (shapes through the API, one listAnimatable call) and, once
+# installed, keeps the result until the selection or channel box changes.
+#
+#   channelPlugs.RESOLVER.install()
+#   plugs = channelPlugs.resolve()
+#   plugs.channel_box  # [(plug name, node full path), ...]
+#
+# Only names are cached. Keyed, locked and muted states are read fresh
+# because the tools using the plugs change them. The names are full DAG
+# paths, so renames, reparents and deletes drop the cache as well.
+
+from maya import cmds, mel
+import maya.api.OpenMaya as om
+
+import apiUndo
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+CHANNELBOX = mel.eval('$cbtemp=$gChannelBoxName')
+EVENTS = ('SelectionChanged', 'ChannelBoxLabelSelected', 'NameChanged')
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _shapes(objects):
+    ''' {object: [shape full paths]} through the API, no listRelatives per object. '''
+    shapes = {}
+    for obj in objects:
+        shapes[obj] = []
+        try:
+            dag_path = om.MSelectionList().add(obj).getDagPath(0)
+        except (RuntimeError, TypeError): # Not a dag node
+            continue
+        for i in range(dag_path.numberOfShapesDirectlyBelow()):
+            shapes[obj].append(om.MDagPath(dag_path).extendToShape(i).fullPathName())
+    return shapes
+
+def _node_path(node):
+    if node.hasFn(om.MFn.kDagNode):
+        return om.MDagPath.getAPathTo(node).fullPathName()
+    return om.MFnDependencyNode(node).name()
+
+def _existing(plug_names):
+    ''' [(plug name, node full path)] for the plugs that exist, once each. '''
+    plugs = []
+    seen = set()
+    for name in plug_names:
+        try:
+            plug = keyData.get_plug(name)
+        except RuntimeError: # Missing attribute
+            continue
+        path = _node_path(plug.node())
+        plug_id = (path, plug.partialName(useLongNames=True))
+        if plug_id not in seen:
+            seen.add(plug_id)
+            plugs.append((name, path))
+    return plugs
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class ChannelPlugs(object):
+    '''
+    objects:     selected nodes, full paths
+    shapes:      {object: [shape full paths]}
+    animatable:  [(plug name, node full path)] of objects and their shapes
+    by_node:     {node full path: [animatable plug names]}
+    channel_box: [(plug name, node full path)] highlighted in the channel
+                 box, on objects (main) and their shapes
+    '''
+    def __init__(self, objects, channel_attrs=(), shape_attrs=()):
+        self.objects = list(objects)
+        self.shapes = _shapes(self.objects)
+        shape_nodes = [s for obj in self.objects for s in self.shapes[obj]]
+        nodes = self.objects + shape_nodes
+        self.animatable = _existing(cmds.listAnimatable(nodes) or []) if nodes else []
+        self.channel_box = _existing(
+            [obj + '.' + attr for obj in self.objects for attr in channel_attrs]
+            + [shape + '.' + attr for shape in shape_nodes for attr in shape_attrs])
+        self.by_node = {}
+        for name, path in self.animatable:
+            self.by_node.setdefault(path, []).append(name)
+
+    def on_node(self, node):
+        ''' Animatable plug names of one node. '''
+        return self.by_node.get(node, [])
+
+    def object_plugs(self):
+        ''' Animatable plug names on the selected objects, not their shapes. '''
+        objects = set(self.objects)
+        return [name for name, path in self.animatable if path in objects]
+
+
+class ChannelPlugResolver(object):
+    '''
+    Caches one ChannelPlugs. Without callbacks every resolve() rebuilds it.
+    '''
+    def __init__(self):
+        self.plugs = None
+        self.callbacks = []
+        self.hits = 0
+        self.misses = 0
+
+    def install(self):
+        if not self.callbacks:
+            for event in EVENTS:
+                self.callbacks.append(
+                    om.MEventMessage.addEventCallback(event, self._changed))
+            # Cached full paths go stale when any node moves or is renamed
+            self.callbacks.append(
+                om.MDagMessage.addAllDagChangesCallback(self._changed))
+            self.callbacks.append(om.MNodeMessage.addNameChangedCallback(
+                om.MObject.kNullObj, self._changed))
+            self.callbacks.append(
+                om.MDGMessage.addNodeRemovedCallback(self._changed, 'dependNode'))
+        return self
+
+    def uninstall(self):
+        if self.callbacks:
+            om.MMessage.removeCallbacks(self.callbacks)
+        self.callbacks = []
+        self.plugs = None
+
+    def _changed(self, *args):
+        self.plugs = None
+
+    def resolve(self):
+        if self.plugs is not None and self.callbacks:
+            self.hits += 1
+            return self.plugs
+        self.misses += 1
+        self.plugs = ChannelPlugs( cmds.ls(sl=True, long=True) or []
+                                 , cmds.channelBox(CHANNELBOX, q=True, sma=True) or []
+                                 , cmds.channelBox(CHANNELBOX, q=True, ssa=True) or []
+                                 )
+        return self.plugs
+
+
+RESOLVER = ChannelPlugResolver()
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def resolve():
+    ''' ChannelPlugs for the current selection, from the shared RESOLVER. '''
+    return RESOLVER.resolve()
+
+def is_keyed(plug_name):
+    ''' Driven by an anim curve on time (not a driven key). '''
+    source = keyData.plug_source(keyData.get_plug(plug_name))
+    return source is not None and keyData.is_time_curve(source.node())
+
+def is_muted(plug_name):
+    source = keyData.plug_source(keyData.get_plug(plug_name))
+    return source is not None \
+        and om.MFnDependencyNode(source.node()).typeName == 'mute'
+
+def set_locked(plug_names, locked):
+    ''' Lock or unlock every plug through the API, as one undo step. '''
+    plugs = [keyData.get_plug(name) for name in plug_names]
+    before = [plug.isLocked for plug in plugs]
+
+    def redo():
+        for plug in plugs:
+            plug.isLocked = locked
+    def undo():
+        for plug, state in zip(plugs, before):
+            plug.isLocked = state
+    redo()
+    apiUndo.commit(undo, redo)
+
+def set_muted(plug_names, muted):
+    if plug_names:
+        cmds.mute(plug_names, disable=not muted)
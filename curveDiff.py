@@ -0,0 +1,269 @@
+# ============================================================================ #
+# What changed between two versions of some animation
+#
+# Compares two sets of curves - {curve name: CurveKeys} - and reports per
+# curve which keys were added, removed, moved or edited, plus how far the
+# curve drifted over the frame range. Both sides are sampled densely with
+# curveEvaluator, a chunk of curves at a time.
+#
+#   before = curveDiff.from_snapshot('blocking')
+#   after = curveDiff.from_scene()
+#   report = curveDiff.diff(before, after)
+#   curveDiff.show_changes(report) # Shade the changed frames in the GE
+#
+# Curve sets can also be written to and read from disk with export_curves
+# and load_curves, eg. to compare against an older scene.
+
+from __future__ import division
+
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+import curveEvaluator
+import curveSnapshots
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+TIME_TOLERANCE = 1e-4
+VALUE_TOLERANCE = 1e-4 # UI units (degrees, scene distance unit)
+CHUNK_SAMPLES = 2000000 # curves * frames evaluated per batch
+FILE_HEADER = b'curveDiff1'
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _match_times(times_a, times_b):
+    ''' Indices into a and b of the keys on the same time. '''
+    index = np.clip(np.searchsorted(times_b, times_a), 0, max(len(times_b) - 1, 0))
+    if not len(times_b):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    lower = np.clip(index - 1, 0, None)
+    nearest = np.where(np.abs(times_b[lower] - times_a) < np.abs(times_b[index] - times_a),
+                       lower, index)
+    same = np.abs(times_b[nearest] - times_a) < TIME_TOLERANCE
+    return np.flatnonzero(same), nearest[same]
+
+def _slopes(keys, indices, side):
+    x = getattr(keys, side + '_x')[indices]
+    y = getattr(keys, side + '_y')[indices]
+    return np.divide(y, x, out=np.zeros(len(y)), where=x != 0.0)
+
+def _pair_moved(a, b, removed, added, tolerance):
+    '''
+    (old time, new time) of removed and added keys with the same value.
+    Added keys are sorted by value once and every removed key searches its
+    value in them. Removed keys then claim, in time order, the closest free
+    added key at or above their value, else the lowest free one below,
+    within tolerance (earliest first on equal values).
+    '''
+    if not len(removed) or not len(added):
+        return []
+    order = np.argsort(b.values[added], kind='mergesort')
+    candidates = added[order]
+    values = b.values[candidates]
+    removed_values = a.values[removed]
+    low = np.searchsorted(values, removed_values - tolerance, side='right')
+    middle = np.searchsorted(values, removed_values, side='left')
+    high = np.searchsorted(values, removed_values + tolerance, side='left')
+
+    following = np.arange(len(candidates) + 1) # next free candidate
+    def free(n):
+        while following[n] != n:
+            following[n] = following[following[n]] # path halving
+            n = following[n]
+        return n
+
+    moved = []
+    for r in np.flatnonzero(low < high): # only keys with something in reach
+        n = free(middle[r])
+        if n >= high[r]:
+            n = free(low[r])
+        if n < high[r]:
+            following[n] = n + 1
+            moved.append((float(a.times[removed[r]]),
+                          float(b.times[candidates[n]])))
+    return moved
+
+def _key_changes(a, b, tolerance):
+    '''
+    added/removed: times of keys only on one side
+    moved:         (old time, new time) of removed/added keys with the
+                   same value, paired in time order
+    edited:        times of keys on both sides whose value or tangents
+                   differ
+    '''
+    ia, ib = _match_times(a.times, b.times)
+    removed = np.setdiff1d(np.arange(len(a)), ia)
+    added = np.setdiff1d(np.arange(len(b)), ib)
+
+    moved = _pair_moved(a, b, removed, added, tolerance)
+    moved_from = set(t for t, _ in moved)
+    moved_to = set(t for _, t in moved)
+
+    edited = np.abs(a.values[ia] - b.values[ib]) >= tolerance
+    for field in ('in_types', 'out_types'):
+        edited |= getattr(a, field)[ia] != getattr(b, field)[ib]
+    for side in ('in', 'out'):
+        edited |= np.abs(_slopes(a, ia, side) - _slopes(b, ib, side)) >= tolerance
+
+    return { 'added'   : [float(t) for t in b.times[added] if t not in moved_to]
+           , 'removed' : [float(t) for t in a.times[removed] if t not in moved_from]
+           , 'moved'   : moved
+           , 'edited'  : [float(t) for t in a.times[ia[edited]]]
+           }
+
+def _frame_ranges(frames):
+    ''' Sorted whole frames -> [[first, last], ...] runs. '''
+    frames = np.unique(np.floor(np.asarray(frames, dtype=np.float64)).astype(int))
+    if not len(frames):
+        return []
+    breaks = np.flatnonzero(np.diff(frames) > 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(frames) - 1]])
+    return [[int(frames[s]), int(frames[e])] for s, e in zip(starts, ends)]
+
+def _key_span(curve_sets):
+    times = [keys.times for curves in curve_sets for keys in curves.values()
+             if len(keys)]
+    if not times:
+        return None
+    return (min(t[0] for t in times), max(t[-1] for t in times))
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def from_scene(curves=None):
+    ''' Live curves, defaults to keyData.selected_curves. '''
+    if curves is None:
+        curves = keyData.selected_curves()
+    return OrderedDict((keys.name, keys) for keys in keyData.read_curves(curves))
+
+def from_snapshot(name, curves=None, store=None):
+    ''' A curveSnapshots slot. '''
+    return (store or curveSnapshots.STORE).curves(name, curves)
+
+def export_curves(path, curves):
+    ''' Write {curve name: CurveKeys} to path, compressed like snapshots. '''
+    with open(path, 'wb') as out_file:
+        out_file.write(FILE_HEADER)
+        for name, keys in curves.items():
+            encoded_name = name.encode('utf-8')
+            blob = curveSnapshots.encode(keys)
+            out_file.write(struct.pack('<II', len(encoded_name), len(blob)))
+            out_file.write(encoded_name)
+            out_file.write(blob)
+
+def load_curves(path):
+    ''' Read what export_curves wrote. Returns {curve name: CurveKeys}. '''
+    curves = OrderedDict()
+    with open(path, 'rb') as in_file:
+        data = in_file.read()
+    if not data.startswith(FILE_HEADER):
+        raise ValueError('{} is not a curveDiff file'.format(path))
+    offset = len(FILE_HEADER)
+    while offset < len(data):
+        name_size, blob_size = struct.unpack_from('<II', data, offset)
+        offset += 8
+        name = data[offset:offset + name_size].decode('utf-8')
+        offset += name_size
+        curves[name] = curveSnapshots.decode(name, data[offset:offset + blob_size])
+        offset += blob_size
+    return curves
+
+def diff(before, after, start_frame=None, end_frame=None, step=1.0):
+    '''
+    before, after: {curve name: CurveKeys}
+    start_frame,
+    end_frame:     range to sample, defaults to the span of every key
+    step:          sampling interval in frames
+    Returns an OrderedDict {curve name: entry} with entries like
+        { 'status'        : 'added', 'removed', 'changed' or 'same'
+        , 'added'         : [times]
+        , 'removed'       : [times]
+        , 'moved'         : [(old time, new time)]
+        , 'edited'        : [times]
+        , 'max_deviation' : largest value difference, UI units
+        , 'ranges'        : [[first, last], ...] whole frames that changed
+        }
+    '''
+    span = _key_span([before, after])
+    if span is None:
+        return OrderedDict()
+    start_frame = span[0] if start_frame is None else start_frame
+    end_frame = span[1] if end_frame is None else end_frame
+    frames = np.arange(start_frame, end_frame + step * 0.5, step)
+
+    report = OrderedDict()
+    names = list(before) + [name for name in after if name not in before]
+    common = []
+    for name in names:
+        a, b = before.get(name), after.get(name)
+        if a is None or b is None:
+            keys = a if b is None else b
+            report[name] = { 'status'        : 'added' if a is None else 'removed'
+                           , 'added'         : [] if b is None else [float(t) for t in b.times]
+                           , 'removed'       : [] if a is None else [float(t) for t in a.times]
+                           , 'moved'         : []
+                           , 'edited'        : []
+                           , 'max_deviation' : None
+                           , 'ranges'        : _frame_ranges(keys.times)
+                           }
+            continue
+        if a.digest() == b.digest(): # Untouched curves skip the sampling
+            report[name] = { 'status'        : 'same'
+                           , 'added'         : []
+                           , 'removed'       : []
+                           , 'moved'         : []
+                           , 'edited'        : []
+                           , 'max_deviation' : 0.0
+                           , 'ranges'        : []
+                           }
+            continue
+        common.append(name)
+
+    chunk = max(1, CHUNK_SAMPLES // max(len(frames), 1))
+    for first in range(0, len(common), chunk):
+        rows = common[first:first + chunk]
+        scales = np.array([keyData.ui_scale(before[name].channel_type) for name in rows])
+        values_a = curveEvaluator.evaluate_many([before[name] for name in rows], frames)
+        values_b = curveEvaluator.evaluate_many([after[name] for name in rows], frames)
+        deviation = np.abs(values_a - values_b) * scales[:, None]
+        for row, name in enumerate(rows):
+            a, b = before[name], after[name]
+            entry = _key_changes(a, b, VALUE_TOLERANCE / scales[row])
+            drifted = frames[deviation[row] >= VALUE_TOLERANCE]
+            key_frames = entry['added'] + entry['removed'] + entry['edited'] \
+                + [t for pair in entry['moved'] for t in pair]
+            entry['max_deviation'] = float(deviation[row].max()) if len(frames) else 0.0
+            entry['ranges'] = _frame_ranges(np.concatenate([drifted, key_frames]))
+            changed = entry['ranges'] or a.pre_infinity != b.pre_infinity \
+                or a.post_infinity != b.post_infinity
+            entry['status'] = 'changed' if changed else 'same'
+            report[name] = entry
+
+    return OrderedDict((name, report[name]) for name in names)
+
+def changed_ranges(report):
+    ''' Every changed frame of the report merged - GE_Overlay.set_frames input. '''
+    ranges = sorted(r for entry in report.values() for r in entry['ranges'])
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+def show_changes(report, overlay=None, color=(200, 90, 60, 60)):
+    ''' Shade the changed frames in the Graph Editor. Returns the overlay. '''
+    import graphEditor_overlay
+    if overlay is None:
+        overlay = graphEditor_overlay.GE_Overlay(active_color=color)
+    overlay.set_frames(changed_ranges(report))
+    return overlay
@@ -0,0 +1,251 @@
+# ============================================================================ #
+# Anim curve evaluation in numpy - no Maya required
+#
+# Reproduces Maya's animCurve evaluation from the arrays keyData.CurveKeys
+# holds (or anything with the same attributes): hermite segments on
+# non-weighted curves, bezier segments on weighted ones, step/stepnext and
+# every pre/post infinity mode. Tangent vectors are used as read, so spline,
+# linear, auto... all evaluate like fixed tangents with the same vectors.
+#
+#   values = curveEvaluator.evaluate_many(keyData.read_curves(names), frames)
+#
+# Times are frames, values internal units - same as CurveKeys.
+
+from __future__ import division
+
+import numpy as np
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+INFINITY_CODES = { 'constant'      : 0
+                 , 'linear'        : 1
+                 , 'cycle'         : 2
+                 , 'cycleRelative' : 3
+                 , 'oscillate'     : 4
+                 }
+BISECT_STEPS = 48 # Solving the weighted bezier for time, ~1e-14 of a segment
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _slopes(x, y):
+    return np.divide(y, x, out=np.zeros(len(y)), where=x != 0.0)
+
+class _Packed(object):
+    '''
+    Every curve's keys end to end in flat arrays, plus per curve lookups.
+    start/count index into the flat arrays. Curves need at least one key.
+    '''
+    def __init__(self, curves):
+        self.count = np.array([len(c.times) for c in curves], dtype=int)
+        self.start = np.concatenate([[0], np.cumsum(self.count)[:-1]]).astype(int)
+
+        def flat(field, dtype=np.float64):
+            return np.concatenate([np.asarray(getattr(c, field), dtype=dtype)
+                                   for c in curves])
+        self.times = flat('times')
+        self.values = flat('values')
+        self.in_x, self.in_y = flat('in_x'), flat('in_y')
+        self.out_x, self.out_y = flat('out_x'), flat('out_y')
+        self.out_types = flat('out_types', object)
+        self.in_slope = _slopes(self.in_x, self.in_y)
+        self.out_slope = _slopes(self.out_x, self.out_y)
+        self.weighted = np.array([bool(c.weighted) for c in curves], dtype=bool)
+        self.pre = np.array([INFINITY_CODES[c.pre_infinity] for c in curves])
+        self.post = np.array([INFINITY_CODES[c.post_infinity] for c in curves])
+
+        first = self.start
+        last = self.start + self.count - 1
+        self.first, self.last = self.times[first], self.times[last]
+        self.first_value, self.last_value = self.values[first], self.values[last]
+        self.first_slope = self.in_slope[first]   # linear pre infinity
+        self.last_slope = self.out_slope[last]    # linear post infinity
+
+def _wrap(packed, curve, frames):
+    '''
+    Map frames (curve ids in curve) onto the keyed range of their curve.
+    Returns local frames plus the value offset, value slope (linear
+    infinity), derivative sign and held mask (no keyed derivative) to apply
+    on top of the keyed evaluation.
+    '''
+    first, last = packed.first[curve], packed.last[curve]
+    span = last - first
+    local = frames.copy()
+    offset = np.zeros(frames.shape)
+    slope = np.zeros(frames.shape)
+    sign = np.ones(frames.shape)
+    held = np.zeros(frames.shape, dtype=bool)
+
+    for side, codes, edge, edge_slope in (
+            (frames < first, packed.pre[curve], first, packed.first_slope[curve]),
+            (frames > last, packed.post[curve], last, packed.last_slope[curve])):
+        codes = np.where(span > 0.0, codes, 0) # Cycling a single key is constant
+        clamp = side & (codes <= 1)
+        local[clamp] = edge[clamp]
+        held |= clamp
+        linear = side & (codes == 1)
+        offset[linear] = (frames[linear] - edge[linear]) * edge_slope[linear]
+        slope[linear] = edge_slope[linear]
+
+        cyclic = side & (codes > 1)
+        if not cyclic.any():
+            continue
+        c_span = span[cyclic]
+        c_first = first[cyclic]
+        cycles = np.floor((frames[cyclic] - c_first) / c_span)
+        remainder = (frames[cyclic] - c_first) - cycles * c_span
+        odd = (codes[cyclic] == 4) & (np.mod(cycles, 2.0) == 1.0)
+        local[cyclic] = np.where(odd, last[cyclic] - remainder,
+                                 c_first + remainder)
+        sign[cyclic] = np.where(odd, -1.0, 1.0)
+        relative = codes[cyclic] == 3
+        rows = curve[cyclic]
+        offset[cyclic] = np.where(relative, cycles * (packed.last_value[rows]
+                                                      - packed.first_value[rows]),
+                                  0.0)
+    return local, offset, slope, sign, held
+
+def _find_segments(packed, curve, local):
+    '''
+    Flat index of the key starting each frame's segment. Every curve is
+    moved to its own stretch of one sorted axis so a single searchsorted
+    covers them all.
+    '''
+    stride = np.max(packed.last - packed.first) + 1.0
+    key_curve = np.repeat(np.arange(len(packed.count)), packed.count)
+    key_axis = packed.times - packed.first[key_curve] + key_curve * stride
+    query_axis = local - packed.first[curve] + curve * stride
+    index = np.searchsorted(key_axis, query_axis, side='right') - 1
+    low = packed.start[curve]
+    high = low + np.maximum(packed.count[curve] - 2, 0)
+    return np.clip(index, low, high)
+
+def _hermite(s, dt, v0, v1, m0, m1, derivative):
+    s2 = s * s
+    s3 = s2 * s
+    if derivative:
+        return ( (6 * s2 - 6 * s) * (v0 - v1) / dt
+               + (3 * s2 - 4 * s + 1) * m0
+               + (3 * s2 - 2 * s) * m1
+               )
+    return ( (2 * s3 - 3 * s2 + 1) * v0
+           + (s3 - 2 * s2 + s) * dt * m0
+           + (-2 * s3 + 3 * s2) * v1
+           + (s3 - s2) * dt * m1
+           )
+
+def _bezier(p0, p1, p2, p3, u):
+    w = 1.0 - u
+    return w * w * w * p0 + 3 * w * w * u * p1 + 3 * w * u * u * p2 + u * u * u * p3
+
+def _bezier_slope(p0, p1, p2, p3, u):
+    w = 1.0 - u
+    return 3 * (w * w * (p1 - p0) + 2 * w * u * (p2 - p1) + u * u * (p3 - p2))
+
+def _weighted(local, t0, t1, v0, v1, out_x, out_y, in_x, in_y, derivative):
+    '''
+    Bezier segments with control points a third of the tangent vectors
+    away from the keys, solved for time by bisection (x is monotonic once
+    the control points are clamped into the segment).
+    '''
+    x1, y1, x2, y2 = control_points(t0, t1, v0, v1, out_x, out_y, in_x, in_y)
+    u = bezier_parameter(local, t0, x1, x2, t1)
+    if derivative:
+        dx = _bezier_slope(t0, x1, x2, t1, u)
+        dy = _bezier_slope(v0, y1, y2, v1, u)
+        return np.divide(dy, dx, out=np.zeros(u.shape), where=dx != 0.0)
+    return _bezier(v0, y1, y2, v1, u)
+
+def _evaluate_keyed(packed, curve, local, derivative):
+    ''' Evaluate frames already inside the keyed range of their curve. '''
+    single = packed.count[curve] < 2
+    i = _find_segments(packed, curve, local)
+    j = np.where(single, i, i + 1)
+    t0, t1 = packed.times[i], packed.times[j]
+    v0, v1 = packed.values[i], packed.values[j]
+    dt = np.where(single, 1.0, t1 - t0)
+    result = np.zeros(local.shape)
+
+    weighted = packed.weighted[curve] & ~single
+    if weighted.any():
+        w = weighted
+        result[w] = _weighted(local[w], t0[w], t1[w], v0[w], v1[w],
+                              packed.out_x[i[w]], packed.out_y[i[w]],
+                              packed.in_x[j[w]], packed.in_y[j[w]], derivative)
+    plain = ~weighted
+    if plain.any():
+        p = plain
+        s = np.clip((local[p] - t0[p]) / dt[p], 0.0, 1.0)
+        m0 = np.where(single[p], 0.0, packed.out_slope[i[p]])
+        m1 = np.where(single[p], 0.0, packed.in_slope[j[p]])
+        result[p] = _hermite(s, dt[p], v0[p], v1[p], m0, m1, derivative)
+
+    # Stepped segments hold a value from either end
+    out_types = packed.out_types[i]
+    step = (out_types == 'step') & (local < t1) & ~single
+    step_next = (out_types == 'stepnext') & (local > t0) & ~single
+    if derivative:
+        return np.where(step | step_next, 0.0, result)
+    result = np.where(step, v0, result)
+    return np.where(step_next, v1, result)
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def control_points(t0, t1, v0, v1, out_x, out_y, in_x, in_y):
+    '''
+    Inner bezier points (x1, y1, x2, y2) of a weighted segment, a third of
+    the tangent vectors away from the keys. x is clamped into the segment.
+    '''
+    x1 = np.clip(t0 + out_x / 3.0, t0, t1)
+    x2 = np.clip(t1 - in_x / 3.0, t0, t1)
+    return x1, v0 + out_y / 3.0, x2, v1 - in_y / 3.0
+
+def bezier_parameter(local, t0, x1, x2, t1):
+    ''' Bezier parameter u where the segment's time reaches local. '''
+    local = np.asarray(local, dtype=np.float64)
+    low = np.zeros(local.shape)
+    high = np.ones(local.shape)
+    for _ in range(BISECT_STEPS):
+        u = (low + high) * 0.5
+        below = _bezier(t0, x1, x2, t1, u) < local
+        low = np.where(below, u, low)
+        high = np.where(below, high, u)
+    return (low + high) * 0.5
+
+def evaluate_many(curves, frames, derivative=False):
+    '''
+    curves:     list of keyData.CurveKeys, or anything with the same
+                attributes
+    frames:     (frames,) shared by every curve, or (curves, frames)
+    derivative: return the slope (value per frame) instead of the value
+    Returns a (curves, frames) array - curves without keys evaluate to 0.
+    '''
+    frames = np.asarray(frames, dtype=np.float64)
+    if frames.ndim == 1:
+        frames = np.broadcast_to(frames, (len(curves), len(frames)))
+    result = np.zeros(frames.shape)
+    rows = np.array([r for r, c in enumerate(curves) if len(c.times)], dtype=int)
+    if not len(rows):
+        return result
+
+    packed = _Packed([curves[r] for r in rows])
+    curve = np.repeat(np.arange(len(rows)), frames.shape[1])
+    query = frames[rows].ravel()
+    local, offset, slope, sign, held = _wrap(packed, curve, query)
+    keyed = _evaluate_keyed(packed, curve, local, derivative)
+    if derivative:
+        values = np.where(held, slope, keyed * sign)
+    else:
+        values = keyed + offset
+    result[rows] = values.reshape(len(rows), frames.shape[1])
+    return result
+
+def evaluate(curve, frames, derivative=False):
+    ''' One curve, frames scalar or any shape. '''
+    frames = np.asarray(frames, dtype=np.float64)
+    values = evaluate_many([curve], np.atleast_1d(frames).ravel(), derivative)
+    return values[0].reshape(frames.shape)
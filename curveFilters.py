@@ -0,0 +1,123 @@
+# ============================================================================ #
+# Smoothing filters for dense curves - no Maya required
+#
+# Every filter takes a (curves, frames) array of evenly spaced samples (baked
+# keys) and filters along the frames of all curves at once. Ends are padded
+# with an odd reflection, like scipy's filtfilt, so the filtered curve
+# doesn't droop towards zero at the edges.
+
+from __future__ import division
+
+import numpy as np
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+FILTERS = ('butterworth', 'gaussian', 'savitzky_golay')
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _pad(values, width):
+    ''' Odd reflection about the end samples. '''
+    width = int(min(width, values.shape[1] - 1))
+    if width < 1:
+        return values, 0
+    head = 2 * values[:, :1] - values[:, width:0:-1]
+    tail = 2 * values[:, -1:] - values[:, -2:-width - 2:-1]
+    return np.concatenate([head, values, tail], axis=1), width
+
+def _frequency_filter(values, response, pad):
+    '''
+    Multiply the spectrum of every curve by response(frequencies), with
+    frequencies in cycles per sample. Zero phase.
+    '''
+    padded, width = _pad(values, pad)
+    count = padded.shape[1]
+    spectrum = np.fft.rfft(padded, axis=1)
+    spectrum *= response(np.fft.rfftfreq(count))[None, :]
+    filtered = np.fft.irfft(spectrum, n=count, axis=1)
+    return filtered[:, width:width + values.shape[1]]
+
+def _savitzky_golay_coefficients(window, order):
+    half = window // 2
+    offsets = np.arange(-half, half + 1, dtype=np.float64)
+    vandermonde = offsets[:, None] ** np.arange(order + 1)[None, :]
+    # Row 0 of the pseudo inverse is the fitted value at the window centre
+    return np.linalg.pinv(vandermonde)[0]
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def butterworth(values, cutoff, sample_rate=1.0, order=2):
+    '''
+    Low-pass with the response of a Butterworth filter run forwards and
+    backwards (filtfilt): 1 / (1 + (f / cutoff) ** (2 * order)), no phase
+    shift.
+    cutoff:      Hz, or cycles per sample with the default sample_rate
+    sample_rate: samples per second, eg. the scene fps for baked keys
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    cutoff = float(cutoff) / sample_rate
+    def response(frequencies):
+        return 1.0 / (1.0 + (frequencies / cutoff) ** (2 * order))
+    return _frequency_filter(values, response, pad=int(np.ceil(3.0 / cutoff)))
+
+def gaussian(values, sigma):
+    '''
+    Gaussian blur with sigma in samples, applied as its transfer function.
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    if sigma <= 0.0:
+        return values.copy()
+    def response(frequencies):
+        return np.exp(-2.0 * (np.pi * sigma * frequencies) ** 2)
+    return _frequency_filter(values, response, pad=int(np.ceil(4.0 * sigma)))
+
+def savitzky_golay(values, window=7, order=2):
+    '''
+    Local polynomial fit of order over window samples (odd). Keeps peaks
+    better than the other two for the same amount of smoothing.
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    window = int(window) | 1 # odd
+    if window > values.shape[1]: # Short curves get the widest odd window
+        window = values.shape[1] - 1 + values.shape[1] % 2
+    if window <= order + 1:
+        return values.copy()
+    coefficients = _savitzky_golay_coefficients(window, order)
+    padded, width = _pad(values, window // 2)
+    filtered = np.zeros(values.shape)
+    start = width - window // 2
+    for offset, weight in enumerate(coefficients):
+        filtered += weight * padded[:, start + offset:start + offset + values.shape[1]]
+    return filtered
+
+def pin_ends(original, filtered):
+    '''
+    Bend the filtered curves back onto the original first/last samples,
+    spreading the correction linearly so nothing pops.
+    '''
+    count = original.shape[1]
+    if count < 2:
+        return original.copy()
+    blend = np.linspace(0.0, 1.0, count)[None, :]
+    start = original[:, :1] - filtered[:, :1]
+    end = original[:, -1:] - filtered[:, -1:]
+    return filtered + start + (end - start) * blend
+
+def smooth(values, method='butterworth', preserve_ends=True, **settings):
+    '''
+    values:   (curves, frames)
+    method:   one of FILTERS, settings go to that function
+    Returns the filtered (curves, frames) array.
+    '''
+    if method not in FILTERS:
+        raise ValueError('Unknown filter "{}". Use one of {}'.format(method, FILTERS))
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    filtered = globals()[method](values, **settings)
+    if preserve_ends:
+        filtered = pin_ends(values, filtered)
+    return filtered
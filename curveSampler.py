@@ -0,0 +1,144 @@
+# ============================================================================ #
+# Bulk anim curve sampling inside Maya
+#
+# Samples many curves at many frames into one (curves, frames) array instead
+# of a cmds.keyframe(q=True, valueChange=True) call per frame. Each curve is
+# read once through keyData and evaluated with curveEvaluator. Key data and
+# samples are cached per curve; with install() the cache listens to curve
+# edits, so sampling unchanged curves again costs nothing. sample() installs
+# the shared SAMPLER on first use.
+#
+#   values = curveSampler.sample(curves, frames)
+#   values, slopes = curveSampler.sample(curves, frames, derivatives=True)
+
+from collections import OrderedDict
+
+import numpy as np
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+import curveEvaluator
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+SAMPLES_PER_CURVE = 8 # Frame arrays remembered per curve, oldest dropped
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class _Entry(object):
+    def __init__(self, handle, keys):
+        self.handle = handle
+        self.keys = keys
+        self.digest = keys.digest()
+        self.samples = OrderedDict() # (frames bytes, derivative): values
+
+
+class CurveSampler(object):
+    '''
+    Cache of CurveKeys and sampled arrays per anim curve, keyed on the
+    curve's key data hash. Without callbacks every sample re-reads the
+    curves and only reuses samples whose hash still matches.
+    '''
+    def __init__(self):
+        self.entries = {} # MObjectHandle hashCode: _Entry
+        self.dirty = set()
+        self.callbacks = []
+        self.hits = 0
+        self.misses = 0
+
+    def install(self):
+        if not self.callbacks:
+            self.callbacks.append(
+                oma.MAnimMessage.addAnimCurveEditedCallback(self._edited))
+        return self
+
+    def uninstall(self):
+        if self.callbacks:
+            om.MMessage.removeCallbacks(self.callbacks)
+        self.callbacks = []
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty.clear()
+
+    def _edited(self, curves, *args):
+        for i in range(len(curves)):
+            self.dirty.add(om.MObjectHandle(curves[i]).hashCode())
+
+    def _entry(self, curve_name):
+        handle = om.MObjectHandle(keyData.get_node(curve_name))
+        key = handle.hashCode()
+        entry = self.entries.get(key)
+        fresh = entry is not None and entry.handle.isValid() \
+            and self.callbacks and key not in self.dirty
+        if fresh:
+            return entry
+
+        keys = keyData.read_curve(curve_name)
+        if entry is not None and entry.handle.isValid() \
+                and entry.digest == keys.digest():
+            entry.keys = keys # Same shape, the samples still hold
+        else:
+            entry = self.entries[key] = _Entry(handle, keys)
+        self.dirty.discard(key)
+        return entry
+
+    def curve_keys(self, curve_name):
+        return self._entry(curve_name).keys
+
+    def _sample(self, entries, frames, derivative):
+        sample_key = (frames.tobytes(), derivative)
+        result = np.zeros((len(entries), len(frames)))
+        missing = []
+        for row, entry in enumerate(entries):
+            values = entry.samples.get(sample_key)
+            if values is None:
+                missing.append(row)
+            else:
+                result[row] = values
+        self.hits += len(entries) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            result[missing] = curveEvaluator.evaluate_many(
+                [entries[row].keys for row in missing], frames, derivative)
+            for row in missing:
+                samples = entries[row].samples
+                samples[sample_key] = result[row].copy()
+                while len(samples) > SAMPLES_PER_CURVE:
+                    samples.popitem(last=False)
+        return result
+
+    def sample(self, curves=None, frames=None, derivatives=False):
+        '''
+        curves:      anim curve names, defaults to keyData.selected_curves
+        frames:      array of frames in the UI time unit, defaults to the
+                     current frame
+        derivatives: also return the slopes (value per frame)
+        Returns (curves, frames) values, or (values, slopes).
+        '''
+        if curves is None:
+            curves = keyData.selected_curves()
+        if frames is None:
+            frames = [oma.MAnimControl.currentTime().asUnits(om.MTime.uiUnit())]
+        frames = np.ascontiguousarray(frames, dtype=np.float64).ravel()
+        entries = [self._entry(name) for name in curves]
+        values = self._sample(entries, frames, False)
+        if not derivatives:
+            return values
+        return values, self._sample(entries, frames, True)
+
+
+SAMPLER = CurveSampler()
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def sample(curves=None, frames=None, derivatives=False):
+    ''' See CurveSampler.sample. Uses the shared SAMPLER, installed on first use. '''
+    return SAMPLER.install().sample(curves, frames, derivatives)
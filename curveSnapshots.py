@@ -0,0 +1,237 @@
+# ============================================================================ #
+# Named curve snapshots - more than one buffer curve
+#
+# Captures the key arrays of curves into memory under a name, restores any
+# slot later with one batched write (one undo step). Nothing goes through
+# Maya's undo queue or the buffer curves while capturing.
+#
+# Storage is compact:
+#   - curves are stored once per shape (CurveKeys.digest), so slots share
+#     every curve that didn't change between them
+#   - times and values are delta encoded (exact, on their bit patterns)
+#     before zlib, tangent vectors are quantized to float32, tangent types
+#     to bytes and flags to bits
+#   - the store has a memory cap and a slot count; the least recently used
+#     slots go first
+#
+#   curveSnapshots.capture('blocking')
+#   curveSnapshots.capture('polish')
+#   curveSnapshots.restore('blocking')
+
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+MEMORY_CAP = 64 * 1024 * 1024 # bytes of compressed curve data
+MAX_SLOTS = 32
+COMPRESSION = 6
+
+TYPE_NAMES = sorted(keyData.TANGENT_TYPES)
+TYPE_CODES = dict((name, code) for code, name in enumerate(TYPE_NAMES))
+FLAGS = ('tangents_locked', 'weights_locked', 'breakdowns')
+TANGENTS = ('in_x', 'in_y', 'out_x', 'out_y')
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _delta(values):
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    return np.diff(bits, prepend=np.uint64(0)) # wraps, still exact
+
+def _undelta(deltas):
+    return np.cumsum(deltas, dtype=np.uint64).view(np.float64)
+
+def encode(keys):
+    ''' CurveKeys -> compressed bytes. Tangent vectors lose float64 precision. '''
+    count = len(keys)
+    header = '{}|{}|{}|{}|{}'.format(count, keys.channel_type, int(keys.weighted),
+                                     keys.pre_infinity, keys.post_infinity)
+    chunks = [_delta(keys.times), _delta(keys.values)]
+    chunks += [np.asarray(getattr(keys, field), dtype=np.float32) for field in TANGENTS]
+    chunks += [np.array([TYPE_CODES[t] for t in getattr(keys, field)], dtype=np.uint8)
+               for field in ('in_types', 'out_types')]
+    chunks += [np.packbits(np.asarray(getattr(keys, field), dtype=bool))
+               for field in FLAGS]
+    payload = b''.join(np.ascontiguousarray(chunk).tobytes() for chunk in chunks)
+    return zlib.compress(header.encode('utf-8') + b'\n' + payload, COMPRESSION)
+
+def decode(name, blob):
+    ''' Compressed bytes -> CurveKeys named name. '''
+    raw = zlib.decompress(blob)
+    split = raw.index(b'\n')
+    count, channel_type, weighted, pre, post = raw[:split].decode('utf-8').split('|')
+    count = int(count)
+    payload = raw[split + 1:]
+
+    keys = keyData.CurveKeys(name, count)
+    keys.channel_type = channel_type
+    keys.weighted = bool(int(weighted))
+    keys.pre_infinity = pre
+    keys.post_infinity = post
+
+    offset = [0]
+    def take(dtype, length):
+        size = np.dtype(dtype).itemsize * length
+        chunk = np.frombuffer(payload[offset[0]:offset[0] + size], dtype=dtype)
+        offset[0] += size
+        return chunk
+    keys.times = _undelta(take(np.uint64, count))
+    keys.values = _undelta(take(np.uint64, count))
+    for field in TANGENTS:
+        setattr(keys, field, take(np.float32, count).astype(np.float64))
+    for field in ('in_types', 'out_types'):
+        codes = take(np.uint8, count)
+        setattr(keys, field, np.array([TYPE_NAMES[c] for c in codes], dtype=object))
+    for field in FLAGS:
+        bits = np.unpackbits(take(np.uint8, (count + 7) // 8))[:count]
+        setattr(keys, field, bits.astype(bool))
+    return keys
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class Slot(object):
+    def __init__(self, name, curves):
+        self.name = name
+        self.curves = curves # {curve name: digest}
+        self.created = time.time()
+
+
+class SnapshotStore(object):
+    '''
+    slots: OrderedDict of Slot, least recently used first
+    blobs: {digest: [compressed bytes, slots using it]}
+    '''
+    def __init__(self, memory_cap=MEMORY_CAP, max_slots=MAX_SLOTS):
+        self.memory_cap = memory_cap
+        self.max_slots = max_slots
+        self.slots = OrderedDict()
+        self.blobs = {}
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def names(self):
+        ''' Slot names, oldest use first. '''
+        return list(self.slots)
+
+    def _add_blob(self, keys):
+        digest = keys.digest()
+        entry = self.blobs.get(digest)
+        if entry is None:
+            blob = encode(keys)
+            entry = self.blobs[digest] = [blob, 0]
+            self.nbytes += len(blob)
+        entry[1] += 1
+        return digest
+
+    def _drop_blob(self, digest):
+        entry = self.blobs[digest]
+        entry[1] -= 1
+        if not entry[1]:
+            self.nbytes -= len(entry[0])
+            del self.blobs[digest]
+
+    def _touch(self, name):
+        slot = self.slots.pop(name)
+        self.slots[name] = slot
+        return slot
+
+    def _evict(self, keep):
+        while len(self.slots) > 1 and (len(self.slots) > self.max_slots
+                                       or self.nbytes > self.memory_cap):
+            oldest = next(iter(self.slots))
+            if oldest == keep:
+                break
+            self.remove(oldest)
+
+    def capture_keys(self, name, curves):
+        ''' Store a list of CurveKeys as slot name, replacing any slot with that name. '''
+        # Add before removing so curves shared with the old slot stay encoded
+        slot = Slot(name, OrderedDict((keys.name, self._add_blob(keys))
+                                      for keys in curves))
+        if name in self.slots:
+            self.remove(name)
+        self.slots[name] = slot
+        self._evict(keep=name)
+        return name
+
+    def capture(self, name=None, curves=None):
+        '''
+        name:   slot name, defaults to a time stamp
+        curves: anim curve names, defaults to keyData.selected_curves
+        Returns the slot name, or None without curves.
+        '''
+        if curves is None:
+            curves = keyData.selected_curves()
+        if not curves:
+            return None
+        if name is None:
+            name = time.strftime('%H:%M:%S')
+        return self.capture_keys(name, keyData.read_curves(curves))
+
+    def curves(self, name, curves=None):
+        ''' {curve name: CurveKeys} held by slot name, optionally only curves. '''
+        slot = self._touch(name)
+        wanted = slot.curves if curves is None else \
+            [curve for curve in curves if curve in slot.curves]
+        return OrderedDict((curve, decode(curve, self.blobs[slot.curves[curve]][0]))
+                           for curve in wanted)
+
+    def restore(self, name, curves=None):
+        '''
+        Write slot name back onto its curves (or only curves) as one undo
+        step. Curves deleted since the capture are skipped.
+        Returns the restored curve names.
+        '''
+        restored = []
+        for curve, keys in self.curves(name, curves).items():
+            try:
+                keyData.get_node(curve)
+            except RuntimeError:
+                continue
+            restored.append(keys)
+        if restored:
+            keyData.write_curves(restored)
+        return [keys.name for keys in restored]
+
+    def remove(self, name):
+        slot = self.slots.pop(name)
+        for digest in slot.curves.values():
+            self._drop_blob(digest)
+
+    def clear(self):
+        self.slots.clear()
+        self.blobs.clear()
+        self.nbytes = 0
+
+
+STORE = SnapshotStore()
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def capture(name=None, curves=None):
+    ''' See SnapshotStore.capture. Uses the shared STORE. '''
+    return STORE.capture(name, curves)
+
+def restore(name, curves=None):
+    ''' See SnapshotStore.restore. Uses the shared STORE. '''
+    return STORE.restore(name, curves)
+
+def names():
+    return STORE.names()
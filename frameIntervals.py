@@ -0,0 +1,101 @@
+# ============================================================================ #
+# Sorted, merged frame spans for the overlays
+#
+# Marks are kept as half open [start, end) spans - a whole frame f is
+# [f, f + 1) - so a 100k frame range is one entry and subframes just work.
+# Spans never overlap or touch; add and remove merge and split them, and
+# overlapping() bisects out only the spans inside a window.
+
+from bisect import bisect_left, bisect_right
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class FrameIntervals(object):
+    def __init__(self, spans=()):
+        self.starts = []
+        self.ends = []
+        for start, end in spans:
+            self.add(start, end)
+
+    @classmethod
+    def from_frames(cls, frames):
+        '''
+        Overlay style input: frames and [first, last] lists, both ends
+        included. For example, [[-10,20],25,39,[50,100]] or [12.5, [3, 4.25]]
+        '''
+        intervals = cls()
+        if not isinstance(frames, (list, tuple)): frames = [frames]
+        for frame in frames:
+            if isinstance(frame, (list, tuple)):
+                first, last = min(frame), max(frame)
+            else:
+                first = last = frame
+            intervals.add(first, last + 1)
+        return intervals
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def __eq__(self, other):
+        return isinstance(other, FrameIntervals) \
+            and self.starts == other.starts and self.ends == other.ends
+
+    def __ne__(self, other):
+        return not self == other
+
+    def spans(self):
+        return list(zip(self.starts, self.ends))
+
+    def add(self, start, end):
+        ''' Mark [start, end), merging with any span it overlaps or touches. '''
+        if end <= start:
+            return
+        i = bisect_left(self.ends, start)
+        j = bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def remove(self, start, end):
+        ''' Unmark [start, end), splitting spans that stick out either side. '''
+        if end <= start:
+            return
+        i = bisect_right(self.ends, start)
+        j = bisect_left(self.starts, end)
+        if i >= j:
+            return
+        starts, ends = [], []
+        if self.starts[i] < start:
+            starts.append(self.starts[i])
+            ends.append(start)
+        if self.ends[j - 1] > end:
+            starts.append(end)
+            ends.append(self.ends[j - 1])
+        self.starts[i:j] = starts
+        self.ends[i:j] = ends
+
+    def clear(self):
+        self.starts = []
+        self.ends = []
+
+    def contains(self, frame):
+        i = bisect_right(self.starts, frame) - 1
+        return i >= 0 and frame < self.ends[i]
+
+    def overlapping(self, start, end):
+        ''' Spans that intersect [start, end), unclipped. '''
+        i = bisect_right(self.ends, start)
+        j = bisect_left(self.starts, end)
+        return list(zip(self.starts[i:j], self.ends[i:j]))
+
+    def bounds(self):
+        ''' (first start, last end), or None when empty. '''
+        if not self.starts:
+            return None
+        return self.starts[0], self.ends[-1]
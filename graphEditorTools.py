@@ -4,6 +4,19 @@
 from maya import cmds, mel
 from functools import wraps
 
+import numpy as np
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+import apiUndo
+import channelPlugs
+import curveEvaluator
+import curveFilters
+import keyData
+import performance
+import rotationMath
+import sceneState
+
 # ============================================================================ #
 # Data handlers ============================================================== #
 
@@ -22,10 +35,14 @@ BACKGROUND_COLOR = (0x32A14B)
 FONT_COLOR = 'white'
 FONT = 'Roboto'
 
-START_FRAME = cmds.playbackOptions(q=True, minTime=True)
-END_FRAME = cmds.playbackOptions(q=True, maxTime=True)
-NON_CYCLING_CURVES = []
 TOLERANCE = 0.0000000001
+TIME_TOLERANCE = 1e-6 # frames
+SMOOTH_WINDOW = 7 # frames, savitzky_golay smoothing without a window
+ROTATE_ATTRS = ('rotateX', 'rotateY', 'rotateZ')
+ROTATE_AXES = { 'rotateX' : 0, 'rx' : 0
+              , 'rotateY' : 1, 'ry' : 1
+              , 'rotateZ' : 2, 'rz' : 2
+              }
 
 IN_TANGENT_TYPES  = [ "spline"
                     , "linear"
@@ -71,7 +88,7 @@ VALID_ATTRS       = [ 'translateX'
                     , 'sz'
                     ]
 
-SELECTED_KEYS = Vividict()
+SELECTED_KEYS = keyData.KeySnapshot() # see get_anim_data
 
 # ============================================================================ #
 # Wrappers =================================================================== #
@@ -102,12 +119,8 @@ def restore_ge_selection(func):
     '''
     @wraps(func)
     def wrap(*args, **kwargs):
-        # Capture GE selection
-        selection_data = {}
-        selected_curve_names = cmds.keyframe(q=True, selected=True, name=True) or []
-        for curve_name in selected_curve_names:
-            keys = cmds.keyframe(curve_name, q=True, selected=True, indexValue=True)
-            selection_data[curve_name] = [int(x) for x in keys]
+        # Capture GE selection - see keyData.KeySelection
+        selection = keyData.KeySelection.capture()
 
         try: # Do the original function
             return func(*args, **kwargs)
@@ -116,11 +129,7 @@ def restore_ge_selection(func):
 
         finally:
             # This one assumes the selection changed because of the function.
-            cmds.selectKey(clear=True)
-            # Restore selection
-            for curve, keys in selection_data.items():
-                for k in keys:
-                    cmds.selectKey(curve, add=True, index=(k,))
+            selection.restore()
     return wrap
 
 
@@ -174,8 +183,8 @@ def do_viewport_isolate(currentPanel):
         cmds.isolateSelect(currentPanel, addSelected=True)
         cmds.isolateSelect(currentPanel, update=True)
 
-# @restore_ge_selection # Broken in 2018
 @undo
+@restore_ge_selection
 def do_ge_isolate():
     # GE isolating acts differently. There is a job number for it so just toggle it.
     gUnisolateJobNum = mel.eval('global int $gUnisolateJobNum; $isotemp=$gUnisolateJobNum;')
@@ -188,33 +197,297 @@ def do_ge_isolate():
 @undo
 @restore_ge_selection
 def filter_curve():
-    # Do filter
-    mel.eval('filterCurve')
+    '''
+    Euler filter the rotate curves of the selected (or shown) curves.
+    X/Y/Z are filtered together as whole tracks - see rotationMath.filter_euler.
+    Nodes with the same rotate order and key times go through one call,
+    and everything is written back in one batch.
+    '''
+    batches = {}
+    for track in _rotation_tracks(_rotation_groups(keyData.selected_curves())):
+        node, order, keys, times = track
+        batches.setdefault((order, times.tobytes()), []).append(track)
+    to_write = []
+    for batch in batches.values():
+        to_write.extend(_filter_rotations(batch))
+    if to_write:
+        keyData.write_curves(to_write)
+    return len(to_write)
+
+def _rotation_groups(curves):
+    ''' {node: [curve name or None per axis]} for curves keying rotate directly. '''
+    groups = {}
+    if not curves:
+        return groups
+    pairs = cmds.listConnections( curves, source=False, destination=True
+                                , plugs=True, connections=True
+                                ) or []
+    for source, destination in zip(pairs[::2], pairs[1::2]):
+        node, attr = destination.rsplit('.', 1)
+        if attr not in ROTATE_AXES:
+            continue
+        groups.setdefault(node, [None, None, None])[ROTATE_AXES[attr]] = \
+            source.split('.', 1)[0]
+    return groups
+
+def _rotation_tracks(groups):
+    ''' (node, rotate order, [CurveKeys or None per axis], union of key times) per node. '''
+    names = [c for curves in groups.values() for c in curves if c]
+    read = dict(zip(names, keyData.read_curves(names)))
+    tracks = []
+    for node, curves in groups.items():
+        keys = [read[c] if c else None for c in curves]
+        times = np.unique(np.concatenate([k.times for k in keys if k is not None]))
+        tracks.append((node, cmds.getAttr(node + '.rotateOrder'), keys, times))
+    return tracks
+
+def _filter_rotations(batch):
+    '''
+    Filter the rotate curves of nodes sharing a rotate order and key times
+    as one (frames, nodes, 3) track. Returns the CurveKeys that changed.
+    When frames switch to the other euler solution every axis is keyed on
+    the union of times first (shape preserving inserts), so no axis
+    interpolates across a switched key of another, and the middle axis
+    tangents of the switched keys are mirrored. Nodes with an axis that
+    isn't animated, or doesn't span the union, keep their solutions -
+    switching only some axes would change the rotation.
+    '''
+    order, times = batch[0][1], batch[0][3]
+    middle = rotationMath.AXIS_INDEX[rotationMath.ROTATE_ORDERS[order][1]]
+    track = np.empty((len(times), len(batch), 3))
+    for n, (node, _, keys, _) in enumerate(batch):
+        for axis, axis_keys in enumerate(keys):
+            if axis_keys is not None:
+                track[:, n, axis] = curveEvaluator.evaluate(axis_keys, times)
+            else: # Not keyed - hold the current value
+                track[:, n, axis] = cmds.getAttr('{}.{}'.format(node, ROTATE_ATTRS[axis])) \
+                                    / keyData.ui_scale('rotate')
+    filtered, switched = rotationMath.filter_euler(track, order)
+
+    changed = []
+    for n, (node, _, keys, _) in enumerate(batch):
+        flips = switched[:, n]
+        if flips.any() and not all(k is not None and k.times[0] == times[0]
+                                   and k.times[-1] == times[-1] for k in keys):
+            filtered[flips, n] = track[flips, n]
+            flips = np.zeros(len(times), dtype=bool)
+
+        for axis, axis_keys in enumerate(keys):
+            if axis_keys is None:
+                continue
+            edited = _insert_keys(axis_keys, times) if flips.any() else axis_keys
+            rows = np.searchsorted(times, edited.times)
+            flip = flips[rows] if axis == middle else np.zeros(len(rows), dtype=bool)
+            values = filtered[rows, n, axis]
+            if edited is axis_keys and not flip.any() \
+                    and np.allclose(values, edited.values, rtol=0.0, atol=1e-9):
+                continue
+            edited = edited.copy()
+            edited.values = values
+            edited.in_y[flip] *= -1.0
+            edited.out_y[flip] *= -1.0
+            changed.append(edited)
+    return changed
+
+
+# ---------------------------------------------------------------------------- #
+# Smoothing - see curveFilters
+
+@undo
+@restore_ge_selection
+def smooth_curves(method='butterworth', preview=False, start_frame=None,
+                  end_frame=None, **settings):
+    '''
+    Filter the selected (or shown) curves with curveFilters.smooth.
+    The range defaults to the span of the selected keys, else the whole
+    curve. First/last keys of the range stay put.
+    preview: show the result as the buffer curve and leave the curves
+             alone - buffer_curve_swap applies it
+    eg. smooth_curves('butterworth', cutoff=4.0)   # Hz
+        smooth_curves('gaussian', sigma=2.0)       # frames
+        smooth_curves('savitzky_golay', window=9, order=3) # frames
+    Keys don't need to be evenly spaced, uneven ones are filtered as a
+    curve sampled every frame.
+    '''
+    curves = keyData.selected_curves()
+    if not curves: print("Only works on selected keys/curves"); return None
+    if start_frame is None and end_frame is None:
+        selected = cmds.keyframe(q=True, selected=True) or []
+        if len(selected) > 1:
+            start_frame, end_frame = min(selected), max(selected)
+    if method == 'butterworth':
+        settings.setdefault('sample_rate', sceneState.STATE.fps)
+
+    originals = keyData.read_curves(curves)
+    smoothed = _smooth_keys(originals, method, start_frame, end_frame, settings)
+    if not smoothed:
+        return 0
+    if preview:
+        _preview_in_buffer(originals, smoothed)
+    else:
+        keyData.write_curves(smoothed)
+    return len(smoothed)
+
+def _smooth_keys(curve_keys, method, start_frame, end_frame, settings):
+    '''
+    Curves sharing the same key times in range are filtered as one
+    (curves, samples) array. Evenly spaced keys are filtered as they are,
+    uneven ones are sampled every frame first and the result read back at
+    the key times. Settings are scaled to the sample step - see
+    _step_settings. Returns the edited CurveKeys.
+    '''
+    groups = {}
+    for keys in curve_keys:
+        mask = np.ones(len(keys), dtype=bool)
+        if start_frame is not None:
+            mask &= keys.times >= start_frame - TIME_TOLERANCE
+        if end_frame is not None:
+            mask &= keys.times <= end_frame + TIME_TOLERANCE
+        if mask.sum() < 3:
+            continue
+        groups.setdefault(keys.times[mask].tobytes(), []).append((keys, mask))
+
+    smoothed = []
+    for members in groups.values():
+        times = members[0][0].times[members[0][1]]
+        gaps = np.diff(times)
+        even = np.allclose(gaps, gaps[0], rtol=0.0, atol=TIME_TOLERANCE)
+        if even:
+            samples = times
+            values = np.array([keys.values[mask] for keys, mask in members])
+        else: # Every frame, or finer for subframe keys
+            count = int(np.ceil((times[-1] - times[0]) / min(1.0, gaps.min())
+                                - TIME_TOLERANCE))
+            samples = np.linspace(times[0], times[-1], count + 1)
+            values = curveEvaluator.evaluate_many([keys for keys, _ in members],
+                                                  samples)
+        step = samples[1] - samples[0]
+        filtered = curveFilters.smooth(values, method,
+                                       **_step_settings(method, settings, step))
+        if not even:
+            filtered = [np.interp(times, samples, row) for row in filtered]
+        for (keys, mask), row in zip(members, filtered):
+            edited = keys.copy()
+            edited.values[mask] = row
+            # Fixed vectors were drawn for the old values - let Maya redo them
+            for types in (edited.in_types, edited.out_types):
+                types[mask & (types == 'fixed')] = 'auto'
+            smoothed.append(edited)
+    return smoothed
+
+def _step_settings(method, settings, step):
+    '''
+    Filter settings are in frames (sigma, window) and Hz at sample_rate
+    frames per second - convert them to samples step frames apart.
+    '''
+    settings = dict(settings)
+    if method == 'butterworth':
+        settings['sample_rate'] = settings.get('sample_rate', 1.0) / step
+    elif method == 'gaussian' and 'sigma' in settings:
+        settings['sigma'] = settings['sigma'] / step
+    elif method == 'savitzky_golay':
+        window = settings.get('window', SMOOTH_WINDOW)
+        settings['window'] = max(3, int(round(window / step)))
+    return settings
+
+def _preview_in_buffer(originals, smoothed):
+    '''
+    Push the smoothed keys into the buffer curves and put the originals
+    back, all outside the undo queue.
+    '''
+    by_name = dict((keys.name, keys) for keys in originals)
+    with performance.Suspend('smooth_preview', viewport=False, parallel=False,
+                             time_slider=False, undo=True):
+        for keys in smoothed:
+            keyData.write_curve(keys)
+        cmds.bufferCurve([keys.name for keys in smoothed], animation='objects',
+                         overwrite=True)
+        for keys in smoothed:
+            keyData.write_curve(by_name[keys.name])
+    cmds.animCurveEditor(ANIM_CURVE_EDITOR, e=True, showBufferCurves='on')
 
 
 # ---------------------------------------------------------------------------- #
 # Swap keys
 @undo
-def reverse_keys_horizontal():
+def reverse_keys_horizontal(cycle=False):
+    '''
+    Mirror the selected keys (or every shown key) in time between the first
+    and last of them, on key arrays - one write per curve.
+    cycle: also match the value and tangents of the two ends so the loop
+           seam stays continuous
+    '''
     if cmds.scaleKey(attribute=True): # Is a key/curve selected?
         keys = cmds.keyframe(query=True, selected=True, timeChange=True) or []
         curve_names = cmds.keyframe(query=True, selected=True, name=True) or []
     else:
         keys = cmds.keyframe(query=True, timeChange=True) or []
         curve_names = cmds.keyframe(query=True, name=True) or []
+    if not keys:
+        return None
 
     first_key = min(keys)
     last_key = max(keys)
-    mid_pivot = (first_key + last_key) / 2
-    for curve in curve_names:
-        cmds.scaleKey(curve, time=(first_key, last_key), timeScale=-1.0, timePivot=mid_pivot)
-
-    do_snap_keys(first_key, last_key)
-
-@restore_ge_selection
-def do_snap_keys(first_key, last_key):
-    cmds.selectKey(clear=True) # Must clear the selection to use the -time flag
-    cmds.snapKey(time=(first_key, last_key), timeMultiple=1)
+    selection = keyData.KeySelection.capture()
+    reversed_curves = []
+    for curve_keys in keyData.read_curves(curve_names):
+        reversed_keys = _reverse_keys(curve_keys, first_key, last_key, cycle)
+        if reversed_keys is not curve_keys: # Fewer than 2 keys in range
+            reversed_curves.append(reversed_keys)
+    if reversed_curves:
+        keyData.write_curves(reversed_curves)
+    selection.mirror(first_key, last_key)
+    selection.restore()
+
+def _reverse_keys(keys, first_key, last_key, cycle=False):
+    '''
+    Mirror the keys between first_key and last_key. In and out tangents
+    swap sides and flip slope (weights go with them), steps hold from the
+    other end. Keys outside the range are untouched.
+    '''
+    mask = (keys.times >= first_key - TIME_TOLERANCE) \
+         & (keys.times <= last_key + TIME_TOLERANCE)
+    if mask.sum() < 2:
+        return keys
+    inside = keys.take(mask)
+    mirrored = inside.take(slice(None, None, -1))
+    mirrored.times = first_key + last_key - mirrored.times
+    snapped = np.round(mirrored.times)
+    close = np.abs(mirrored.times - snapped) < TIME_TOLERANCE
+    mirrored.times[close] = snapped[close]
+
+    mirrored.in_x, mirrored.out_x = mirrored.out_x, mirrored.in_x
+    mirrored.in_y, mirrored.out_y = -mirrored.out_y, -mirrored.in_y
+    mirrored.in_types, mirrored.out_types = mirrored.out_types, mirrored.in_types
+    # A step belongs to its segment's left key - which is now the other end.
+    # Steps that only came across from in tangents become fixed.
+    segment_types = inside.out_types[:-1][::-1]
+    stepped = np.isin(segment_types, keyData.STEPPED)
+    out_types = mirrored.out_types[:-1]
+    out_types[np.isin(out_types, keyData.STEPPED)] = 'fixed'
+    out_types[stepped] = np.where(segment_types[stepped] == 'step',
+                                  'stepnext', 'step')
+    mirrored.in_types[np.isin(mirrored.in_types, keyData.STEPPED)] = 'fixed'
+
+    if cycle:
+        _match_seam(mirrored)
+    return keyData.CurveKeys.concatenate(keys.name,
+                                         [keys.take(~mask), mirrored])
+
+def _match_seam(keys):
+    ''' Same value and slope on both ends, like matchKeys('both'). '''
+    value = (keys.values[0] + keys.values[-1]) * 0.5
+    slopes = []
+    for x, y in ((keys.in_x, keys.in_y), (keys.out_x, keys.out_y)):
+        ends = [y[k] / x[k] if x[k] else 0.0 for k in (0, -1)]
+        slopes.append(sum(ends) * 0.5)
+    for k in (0, -1):
+        keys.values[k] = value
+        keys.in_y[k] = slopes[0] * keys.in_x[k]
+        keys.out_y[k] = slopes[1] * keys.out_x[k]
+        for types in (keys.in_types, keys.out_types):
+            if types[k] not in keyData.STEPPED:
+                types[k] = 'fixed'
 
 
 # ---------------------------------------------------------------------------- #
@@ -354,41 +627,18 @@ def deselect_outside_keys():
 
 @undo
 def scale_tangent_to_value(value):
-    current_channels = cmds.keyframe(q=True, selected=True, name=True)
-    if not current_channels: print("Only works on selected keys/curves"); return
-    keys_selected = Vividict()
-    for channel in current_channels:
-        keys = cmds.keyframe(channel, q=True, selected=True, indexValue=True)
-        for key in keys:
-            tangent_type = cmds.keyTangent(channel, index=(float(key),), q=True, itt=True, ott=True)
-            keys_selected[channel][float(key)]['tangent_types']   = tangent_type
-            keys_selected[channel][float(key)]['tangent_angles']  = cmds.keyTangent(channel, index=(float(key),), q=True, inAngle=True, outAngle=True)
-            keys_selected[channel][float(key)]['tangent_weights'] = cmds.keyTangent(channel, index=(float(key),), q=True, inWeight=True, outWeight=True)
-            keys_selected[channel][float(key)]['lock']            = cmds.keyTangent(channel, index=(float(key),), q=True, lock=True)
-
-            cmds.keyTangent(channel, index=(float(key),), itt=IN_TANGENT_TYPES[IN_TANGENT_TYPES.index(tangent_type[0])-1], ott=OUT_TANGENT_TYPES[OUT_TANGENT_TYPES.index(tangent_type[-1])-1]) # This breaks in 2020
-            # cmds.keyTangent(itt=IN_TANGENT_TYPES[IN_TANGENT_TYPES.index(tangent_type[0])-1], ott=OUT_TANGENT_TYPES[OUT_TANGENT_TYPES.index(tangent_type[-1])-1])
-
-    keys_modified = Vividict()
-    for channel in current_channels:
-        keys = cmds.keyframe(channel, q=True, selected=True, indexValue=True)
-        for key in keys:
-            keys_modified[channel][float(key)]['tangent_types'] = cmds.keyTangent(channel, index=(float(key),), q=True, itt=True, ott=True)
-
-    for channel, keys in keys_modified.items():
-        for key in keys:
-            cmds.keyTangent(channel, index=(key ,), lock=False)
-            if keys_modified[channel][key]['tangent_types'][0] != keys_selected[channel][key]['tangent_types'][0]:
-                cmds.keyTangent(channel, index=(key ,), itt=keys_selected[channel][key]['tangent_types'][0])
-                cmds.keyTangent(channel, index=(key ,), inAngle=keys_selected[channel][key]['tangent_angles'][0])
-                cmds.keyTangent(channel, index=(key ,), inWeight=keys_selected[channel][key]['tangent_weights'][0])
-                cmds.keyTangent(channel, index=(key ,), inWeight=value)
-            if keys_modified[channel][key]['tangent_types'][-1] != keys_selected[channel][key]['tangent_types'][-1]:
-                cmds.keyTangent(channel, index=(key ,), ott=keys_selected[channel][key]['tangent_types'][-1])
-                cmds.keyTangent(channel, index=(key ,), outAngle=keys_selected[channel][key]['tangent_angles'][-1])
-                cmds.keyTangent(channel, index=(key ,), outWeight=keys_selected[channel][key]['tangent_weights'][-1])
-                cmds.keyTangent(channel, index=(key ,), outWeight=value)
-            cmds.keyTangent(channel, index=(key ,), lock=keys_selected[channel][key]['lock'][0])
+    snapshot = keyData.KeySnapshot.from_selection()
+    if not len(snapshot): print("Only works on selected keys/curves"); return
+    snapshot.in_weight[snapshot.in_selected] = value
+    snapshot.out_weight[snapshot.out_selected] = value
+    # Weights only stick on fixed handles - Maya recomputes the rest
+    for field, sides in (('in_types', snapshot.in_selected),
+                         ('out_types', snapshot.out_selected)):
+        types = getattr(snapshot, field)
+        types[sides & ~np.isin(types, keyData.STEPPED)] = 'fixed'
+    change = oma.MAnimCurveChange()
+    snapshot.write(change=change)
+    apiUndo.commit(change.undoIt, change.redoIt)
 
 
 # ---------------------------------------------------------------------------- #
@@ -405,72 +655,37 @@ def map_from_to(value, leftMin, leftMax, rightMin, rightMax):
 
 def get_anim_data():
     global SELECTED_KEYS
-    keys_selected = Vividict()
-
-    current_channels = cmds.keyframe(q=True, selected=True, name=True) or []
-    if not current_channels: print("Only works on selected keys/curves"); return
-    for channel in current_channels:
-        keys = cmds.keyframe(channel, q=True, selected=True, indexValue=True)
-        for key in keys:
-            key = float(key)
-            tangent_types = cmds.keyTangent(channel, index=(key,), q=True, inTangentType=True, outTangentType=True)
-            keys_selected[channel][key]['tangent_types']    = tangent_types
-            keys_selected[channel][key]['tangent_angles']   = cmds.keyTangent(channel, index=(key,), q=True, inAngle=True, outAngle=True)
-            keys_selected[channel][key]['tangent_weights']  = cmds.keyTangent(channel, index=(key,), q=True, inWeight=True, outWeight=True)
-            keys_selected[channel][key]['tangent_selected'] = [0, 0]
-            keys_selected[channel][key]['lock']             = cmds.keyTangent(channel, index=(key,), q=True, lock=True)
-
-            current_value = cmds.keyframe(channel, index=(key,), q=True, valueChange=True)
-            next_value = cmds.keyframe(channel, index=(key+1,), q=True, valueChange=True) # TODO - Will break at the end. No more last key.
-            if next_value >= current_value:
-                keys_selected[channel][key]['tangent_direction_up'] = True
-            else:
-                keys_selected[channel][key]['tangent_direction_up'] = False
-
-            in_tangent_index  = IN_TANGENT_TYPES.index(tangent_types[0])
-            out_tangent_index = OUT_TANGENT_TYPES.index(tangent_types[-1])
-            cmds.keyTangent( channel
-                           , index=(key,)
-                           , inTangentType=IN_TANGENT_TYPES[in_tangent_index-1]
-                           , outTangentType=OUT_TANGENT_TYPES[out_tangent_index-1]
-                           )
-            modified_tangent_types = cmds.keyTangent(channel, index=(key,), q=True, inTangentType=True, outTangentType=True)
-
-            if modified_tangent_types[0] != keys_selected[channel][key]['tangent_types'][0]:
-                keys_selected[channel][key]['tangent_selected'][0] = 1
-            if modified_tangent_types[-1] != keys_selected[channel][key]['tangent_types'][-1]:
-                keys_selected[channel][key]['tangent_selected'][-1] = 1
-
-            cmds.keyTangent(channel, index=(key,), lock=False)
-            if keys_selected[channel][key]['tangent_selected'][0]:
-                cmds.keyTangent(channel, index=(key,), inTangentType=keys_selected[channel][key]['tangent_types'][0])
-                cmds.keyTangent(channel, index=(key,), inWeight=keys_selected[channel][key]['tangent_weights'][0])
-                cmds.keyTangent(channel, index=(key,), inAngle=keys_selected[channel][key]['tangent_angles'][0])
-            if keys_selected[channel][key]['tangent_selected'][-1]:
-                cmds.keyTangent(channel, index=(key,), outTangentType=keys_selected[channel][key]['tangent_types'][-1])
-                cmds.keyTangent(channel, index=(key,), outWeight=keys_selected[channel][key]['tangent_weights'][-1])
-                cmds.keyTangent(channel, index=(key,), outAngle=keys_selected[channel][key]['tangent_angles'][-1])
-            cmds.keyTangent(channel, index=(key,), lock=keys_selected[channel][key]['lock'][0])
-
-    SELECTED_KEYS = keys_selected
+    SELECTED_KEYS = keyData.KeySnapshot.from_selection()
+    if not len(SELECTED_KEYS): print("Only works on selected keys/curves"); return
+    return SELECTED_KEYS
+
+def angled_keys(keys, value):
+    '''
+    Copy of a KeySnapshot with both tangents swung from the captured angle
+    towards straight up/down - value 0 keeps them, 90 is vertical.
+    '''
+    limit = np.where(keys.direction_up, 90.0, -90.0)
+    angles = map_from_to(value, 0.0, 90.0, keys.in_angle, limit)
+    edited = keys.copy()
+    edited.in_angle = angles
+    edited.out_angle = angles.copy()
+    for field in ('in_types', 'out_types'): # Angles only stick on fixed
+        types = getattr(keys, field)
+        setattr(edited, field, np.where(np.isin(types, keyData.STEPPED),
+                                        types, 'fixed').astype(object))
+    return edited
 
 def angle_tangent_to_value(value):
-    for channel, keys in keys_selected.items():
-        for key in keys:
-            in_angle, out_angle = keys_selected[channel][key]['tangent_angles']
-            if keys_selected[channel][float(key)]['tangent_direction_up'] == True:
-                new_value = map_from_to(value, 0.0, 90.0, in_angle, 90.0)
-            elif keys_selected[channel][float(key)]['tangent_direction_up'] == False:
-                new_value = map_from_to(value, 0.0, 90.0, in_angle, -90.0)
-            cmds.keyTangent(channel, index=(key,), inAngle=new_value, outAngle=new_value)
-
-'''
-get_anim_data()
-cmds.window()
-cmds.columnLayout(adjustableColumn=True)
-cmds.floatSlider(min=-90, max=90, value=0, step=1, width=500, dragCommand=angle_tangent_to_value)
-cmds.showWindow()
-'''
+    '''
+    One off edit of the keys captured by get_anim_data.
+    For dragging use ui_tangentAngleSlider.
+    '''
+    if not len(SELECTED_KEYS): return
+    change = oma.MAnimCurveChange()
+    angled_keys(SELECTED_KEYS, value).write(change=change,
+                                            in_sides=True, out_sides=True)
+    apiUndo.commit(change.undoIt, change.redoIt)
+
 
 
 # ---------------------------------------------------------------------------- #
@@ -496,204 +711,253 @@ def toggle_channels(channels):
 
 
 # --------------------------------------------------------------------------- #
-# Crop selected curves to frame range, cutting/pasting from outside to inside
-def crop_cycle():
-    global NON_CYCLING_CURVES
-    NON_CYCLING_CURVES  = []
-    global START_FRAME
-    START_FRAME = cmds.playbackOptions(q=True, minTime=True)
-    global END_FRAME
-    END_FRAME = cmds.playbackOptions(q=True, maxTime=True)
+# Crop selected curves to frame range, wrapping keys from outside to inside.
+# Everything happens on keyData.CurveKeys arrays, each curve is written once
+# and the whole crop undoes as one step.
+def crop_cycle(start_frame=None, end_frame=None):
+    '''
+    Returns a report - one dict per curve that doesn't cycle:
+    {'curve', 'reason', 'start_value', 'end_value', 'delta'}
+    '''
+    min_time, max_time = sceneState.STATE.playback_range()
+    if start_frame is None:
+        start_frame = min_time
+    if end_frame is None:
+        end_frame = max_time
 
     ctrls = cmds.ls(sl=True)
     if not ctrls:
         print("No controls selected!")
-        return
-
-    curves_to_process = []
-    for ctrl in ctrls:
-        curves = []
-        curves = cmds.keyframe(ctrl, selected=True, q=True, name=True) or []
-        curves_to_process.extend(curves)
+        return None
 
+    curves_to_process = cmds.keyframe(ctrls, selected=True, q=True, name=True) or []
     if not curves_to_process:
         print("No curves selected!")
-        return
+        return None
 
-    for curve in curves_to_process:
-        _normalize_cycle(curve)
-
-    if NON_CYCLING_CURVES:
+    report = []
+    to_write = []
+    for keys in keyData.read_curves(curves_to_process):
+        if not len(keys):
+            continue
+        cropped, reason = _crop_cycle_keys(keys, start_frame, end_frame)
+        if cropped is not keys:
+            to_write.append(cropped)
+        start_value, end_value = _values_at(cropped, (start_frame, end_frame))
+        if start_value is None or end_value is None:
+            reason = reason or 'no keys on the range ends'
+            delta = None
+        else:
+            delta = end_value - start_value
+        if reason or abs(delta) > TOLERANCE: # Because of floating point numbers
+            report.append({ 'curve'       : keys.name
+                          , 'reason'      : reason or 'not cycling'
+                          , 'start_value' : start_value
+                          , 'end_value'   : end_value
+                          , 'delta'       : delta
+                          })
+    if to_write:
+        keyData.write_curves(to_write)
+
+    if report:
         cmds.warning("Non cycling curves detected!")
-        print(NON_CYCLING_CURVES)
+        for entry in report:
+            print("{curve}: {reason}, delta {delta}".format(**entry))
         result = cmds.confirmDialog( title='Warning', message='Select non-cycling controls?', button=['Yes','No'], defaultButton='Yes', cancelButton='No', dismissString='No' )
         if result == 'Yes':
-            cmds.select(NON_CYCLING_CURVES)
+            cmds.select([entry['curve'] for entry in report])
     else:
         print("Success probably!")
+    return report
 
 # --------------------------------------------------------------------------- #
 # The process that does the work
-def _normalize_cycle(curve):
-    # prime the pump
-    global NON_CYCLING_CURVES
-
-    keys = cmds.keyframe(curve, q=True)
-    last_key = keys[-1]
-    first_key = keys[0]
-
-    if first_key >= START_FRAME and last_key > END_FRAME:
-        # Normalize post-end-frame
-        cmds.setKeyframe(curve, time=(END_FRAME,), insert=True)
-
-        # Save tangent info
-        tangent_data = _save_tangent_data(curve, last_key)
-        # Apply tangent info
-        cmds.keyTangent(curve, e=True, time=(first_key,), lock=False)
-        cmds.keyTangent(curve, e=True, time=(first_key,), ott='fixed')
-        cmds.keyTangent(curve, e=True, time=(first_key,), itt='fixed')
-        cmds.keyTangent(curve, e=True, time=(first_key,), inAngle=tangent_data[curve, last_key]['in_angle'][0])
-        if tangent_data[curve, last_key]['weighted'][0]:
-            cmds.keyTangent(curve, e=True, time=(first_key,), inWeight=tangent_data[curve, last_key]['in_weight'][0])
-
-        # Save tangent info
-        tangent_data = _save_tangent_data(curve, first_key)
-        # Apply tangent info
-        cmds.keyTangent(curve, e=True, time=(last_key,), lock=False)
-        cmds.keyTangent(curve, e=True, time=(last_key,), ott='fixed')
-        cmds.keyTangent(curve, e=True, time=(last_key,), itt='fixed')
-        cmds.keyTangent(curve, e=True, time=(last_key,), outAngle=tangent_data[curve, first_key]['out_angle'][0])
-        if tangent_data[curve, first_key]['weighted'][0]:
-            cmds.keyTangent(curve, e=True, time=(last_key,), outWeight=tangent_data[curve, first_key]['out_weight'][0])
-
-        cmds.copyKey(curve, time=(END_FRAME, last_key))
-        cmds.pasteKey(curve, time=(START_FRAME,), option="merge")
-        cmds.cutKey(curve, time=(last_key, END_FRAME+1))
-
-    elif first_key < START_FRAME and last_key <= END_FRAME:
-        # Normalize pre-start-frame
-        cmds.copyKey(curve, time=(last_key,))
-        cmds.pasteKey(curve, time=(first_key,), option="merge")
-        cmds.setKeyframe(curve, time=(START_FRAME,), insert=True)
-        cmds.copyKey(curve, time=(first_key, START_FRAME))
-        cmds.pasteKey(curve, time=(last_key,), option="merge")
-        cmds.cutKey(curve, time=(first_key, START_FRAME-1))
-
-    elif first_key < START_FRAME and last_key > END_FRAME:
+def _crop_cycle_keys(keys, start_frame, end_frame):
+    '''
+    Wrap the keys of one curve into start/end by the range length.
+    Returns (CurveKeys, None), the same keys if there is nothing to do, or
+    the same keys and 'already keyed' when every key is inside the range.
+    '''
+    period = end_frame - start_frame
+    first_key = keys.times[0]
+    last_key = keys.times[-1]
+
+    if first_key > end_frame or last_key < start_frame:
+        # Nothing to wrap - the range only sees the curve's infinity
+        return _range_keys(keys, start_frame, end_frame), None
+
+    if first_key >= start_frame and last_key > end_frame:
+        # Normalize post-end-frame - the end key and everything after it
+        # moves to the start
+        keys = _insert_keys(keys, (end_frame,))
+        wrapped = keys.take(keys.times >= end_frame - TIME_TOLERANCE)
+        wrapped.times -= period
+    elif first_key < start_frame and last_key <= end_frame:
+        # Normalize pre-start-frame - everything up to the start key moves
+        # to the end
+        keys = _insert_keys(keys, (start_frame,))
+        wrapped = keys.take(keys.times <= start_frame + TIME_TOLERANCE)
+        wrapped.times += period
+    elif first_key < start_frame and last_key > end_frame:
         # Assume the cycle is already good and just trim the outside edges
-        cmds.setKeyframe(curve, time=(START_FRAME,), insert=True)
-        cmds.setKeyframe(curve, time=(END_FRAME,), insert=True)
-        cmds.keyTangent(curve, e=True, time=(END_FRAME,), itt="fixed", ott="fixed")
-        cmds.keyTangent(curve, e=True, time=(START_FRAME,), itt="fixed", ott="fixed")
-        cmds.cutKey(curve, time=(first_key, START_FRAME-1))
-        cmds.cutKey(curve, time=(END_FRAME+1, last_key))
-    elif first_key == START_FRAME and last_key == END_FRAME:
+        keys = _insert_keys(keys, (start_frame, end_frame))
+        wrapped = keys.take(slice(0, 0))
+    elif first_key == start_frame and last_key == end_frame:
         # Curve is already the proper length and within the bounds
-        pass
+        return keys, None
     else:
-        NON_CYCLING_CURVES.append(curve)
-        print("%s not a valid curve." % curve)
-
-    # Then check the curve and add it to the list if it doesn't cycle
-    value_start = cmds.keyframe(curve, q=True, time=(START_FRAME,), valueChange=True)
-    value_end = cmds.keyframe(curve, q=True, time=(END_FRAME,), valueChange=True)
-
-    if abs(value_start[0] - value_end[0]) > TOLERANCE: # Because of floating point numbers
-        NON_CYCLING_CURVES.append(curve)
-
-def _save_tangent_data(curve, time):
-    weighted = cmds.keyTangent(curve, q=True, time=(time,), weightedTangents=True)
-    if weighted:
-        out_weight = cmds.keyTangent(curve, q=True, time=(time,), outWeight=True)
-        in_weight = cmds.keyTangent(curve, q=True, time=(time,), inWeight=True)
-    out_angle = cmds.keyTangent(curve, q=True, time=(time,), outAngle=True)
-    in_angle = cmds.keyTangent(curve, q=True, time=(time,), inAngle=True)
-    tangent_data = {}
-    tangent_data[curve, time] = { "weighted" : weighted
-                                , "out_angle" : out_angle
-                                , "in_angle" : in_angle
-                                , "out_weight" : out_weight
-                                , "in_weight" : in_weight
-                                }
-    return tangent_data
+        # Every key already sits inside the range, nothing to wrap
+        print("%s is already keyed inside the range." % keys.name)
+        return keys, 'already keyed'
+
+    # Wrapped keys win where they land on an existing key
+    inside = (keys.times >= start_frame - TIME_TOLERANCE) \
+           & (keys.times <= end_frame + TIME_TOLERANCE)
+    landed = np.abs(keys.times[:, None] - wrapped.times[None, :]) < TIME_TOLERANCE
+    inside &= ~landed.any(axis=1)
+    cropped = keyData.CurveKeys.concatenate(keys.name,
+                                            [keys.take(inside), wrapped])
+    return cropped.take((cropped.times >= start_frame - TIME_TOLERANCE)
+                        & (cropped.times <= end_frame + TIME_TOLERANCE)), None
+
+def _range_keys(keys, start_frame, end_frame):
+    ''' Keys on start_frame and end_frame only, evaluated from keys. '''
+    frames = np.array([start_frame, end_frame], dtype=np.float64)
+    edges = keys.take(np.zeros(2, dtype=int)) # Curve settings of keys
+    edges.times[:] = frames
+    edges.values[:] = curveEvaluator.evaluate(keys, frames)
+    slopes = curveEvaluator.evaluate(keys, frames, derivative=True)
+    edges.in_x[:] = edges.out_x[:] = (end_frame - start_frame) / 3.0
+    edges.in_y[:] = edges.out_y[:] = slopes * edges.in_x
+    edges.in_types[:] = 'fixed'
+    edges.out_types[:] = 'fixed'
+    edges.tangents_locked[:] = True
+    edges.breakdowns[:] = False
+    return edges
+
+def _insert_keys(keys, frames):
+    '''
+    Add keys at frames without changing the curve shape, like
+    setKeyframe(insert=True). Evaluated from the arrays - see curveEvaluator.
+    The neighbours' handles facing the new key are fixed (and split, on
+    weighted curves) so Maya doesn't recompute them.
+    '''
+    frames = [f for f in frames
+              if keys.times[0] < f < keys.times[-1]
+              and not np.any(np.abs(keys.times - f) < TIME_TOLERANCE)]
+    for frame in sorted(frames):
+        keys = keys.copy()
+        j = int(np.searchsorted(keys.times, frame))
+        i = j - 1
+        inserted = keyData.CurveKeys(keys.name, 1)
+        inserted.times[0] = frame
+        if keys.weighted:
+            _split_weighted(keys, i, j, inserted)
+            keys.weights_locked[[i, j]] = False
+        else:
+            inserted.values[0] = curveEvaluator.evaluate(keys, frame)
+            slope = curveEvaluator.evaluate(keys, frame, derivative=True)
+            inserted.in_x[0] = (frame - keys.times[i]) / 3.0
+            inserted.out_x[0] = (keys.times[j] - frame) / 3.0
+            inserted.in_y[0] = slope * inserted.in_x[0]
+            inserted.out_y[0] = slope * inserted.out_x[0]
+        inserted.in_types[0] = 'fixed'
+        inserted.out_types[0] = keys.out_types[i] \
+            if keys.out_types[i] in keyData.STEPPED else 'fixed'
+        inserted.tangents_locked[0] = False
+        if keys.out_types[i] not in keyData.STEPPED:
+            keys.out_types[i] = 'fixed'
+        if keys.in_types[j] not in keyData.STEPPED:
+            keys.in_types[j] = 'fixed'
+        keys = keyData.CurveKeys.concatenate(keys.name, [keys, inserted])
+    return keys
+
+def _split_weighted(keys, i, j, inserted):
+    '''
+    De Casteljau split of the weighted segment i -> j at inserted.times[0].
+    Scales the out handle of i and the in handle of j to their half and
+    fills in the value and handles of inserted.
+    '''
+    t0, t1 = keys.times[i], keys.times[j]
+    v0, v1 = keys.values[i], keys.values[j]
+    x1, y1, x2, y2 = curveEvaluator.control_points(
+        t0, t1, v0, v1, keys.out_x[i], keys.out_y[i], keys.in_x[j], keys.in_y[j])
+    u = float(curveEvaluator.bezier_parameter(inserted.times[0], t0, x1, x2, t1))
+    points = [np.array([t0, v0]), np.array([x1, y1]),
+              np.array([x2, y2]), np.array([t1, v1])]
+    lerp_points = lambda a, b: a + (b - a) * u
+    p01, p12, p23 = [lerp_points(a, b) for a, b in zip(points, points[1:])]
+    p012, p123 = lerp_points(p01, p12), lerp_points(p12, p23)
+    middle = lerp_points(p012, p123)
+
+    keys.out_x[i], keys.out_y[i] = 3.0 * (p01 - points[0])
+    keys.in_x[j], keys.in_y[j] = 3.0 * (points[3] - p23)
+    inserted.values[0] = middle[1]
+    inserted.in_x[0], inserted.in_y[0] = 3.0 * (middle - p012)
+    inserted.out_x[0], inserted.out_y[0] = 3.0 * (p123 - middle)
+
+def _values_at(keys, frames):
+    ''' Value of the keys at frames, None where there is no key. '''
+    values = []
+    for frame in frames:
+        match = np.flatnonzero(np.abs(keys.times - frame) < TIME_TOLERANCE)
+        values.append(keys.values[match[0]] if len(match) else None)
+    return values
 
 # --------------------------------------------------------------------------- #
 # Based on ack_SliceCurves
 @undo
 def slice_curves():
-    sel = cmds.ls(sl=1, long=True) # full paths
+    '''
+    Key the selection at the current time. Unkeyed controls (and unkeyed
+    shapes with animatable attributes) get a first key, then keys are
+    inserted on the selected curves, the channel box selection or
+    everything else keyed. Plugs are resolved in one pass and keyed with
+    at most two setKeyframe calls.
+    '''
+    plugs = channelPlugs.resolve()
+    sel = plugs.objects
     if not sel: return None
 
-    objects_to_skip = []
+    to_key = []
+    objects_to_skip = set()
     # Does the object have a key on it to begin with?
     for obj in sel:
-        shape_keyables = []
-        shapes = cmds.listRelatives(obj, shapes=True, fullPath=True) or [] # full paths
-        for shape in shapes:
-            # shape = 'ARCT_WelderBot_01_rig:backFoot_01FK_L_CTRLShape1'
-            keyCountShape = cmds.keyframe(shape, q=True, kc=True, shape=True)
-            found = cmds.listAnimatable(shape) or []
-            if found and not keyCountShape:
-                shape_keyables.append(shape)
-
-        keyCountCtrl = cmds.keyframe(obj, q=True, kc=True, shape=False)
-        if shape_keyables:
-            keyCountShape = cmds.keyframe(shape_keyables, q=True, kc=True, shape=True)
-            if keyCountCtrl == 0 and keyCountShape > 0: # Keys on the shape node but not on the ctrl
-                cmds.setKeyframe(obj, breakdown=False, hierarchy='none', controlPoints=False, shape=False)
-                objects_to_skip.append(obj)
-            if keyCountCtrl == 0 and keyCountShape == 0:
-                cmds.setKeyframe(obj, breakdown=False, hierarchy='none', controlPoints=False, shape=True)
-                objects_to_skip.append(obj)
-            if keyCountCtrl > 0 and keyCountShape == 0:
-                for shape in shape_keyables:
-                    cmds.setKeyframe(shape, breakdown=False, hierarchy='none', controlPoints=False, shape=True)
-        else:
-            keyCountCtrl = cmds.keyframe(obj, q=True, kc=True, shape=False)
-            if not keyCountCtrl:
-                cmds.setKeyframe(obj, breakdown=False, hierarchy='none', controlPoints=False, shape=False)
-
+        obj_plugs = plugs.on_node(obj)
+        shape_plugs = [plugs.on_node(shape) for shape in plugs.shapes[obj]]
+        unkeyed_shapes = [p for p in shape_plugs
+                          if p and not any(channelPlugs.is_keyed(name) for name in p)]
+        ctrl_keyed = any(channelPlugs.is_keyed(name) for name in obj_plugs)
+        if unkeyed_shapes and not ctrl_keyed:
+            to_key += obj_plugs + [name for p in shape_plugs for name in p]
+            objects_to_skip.add(obj)
+        elif unkeyed_shapes:
+            to_key += [name for p in unkeyed_shapes for name in p]
+        elif not ctrl_keyed:
+            to_key += obj_plugs
+    new_keys = [name for name in to_key if not channelPlugs.is_keyed(name)]
 
     # Get selected curves in GE
     selectedCurves = cmds.keyframe(selected=True, q=True, name=True) or [] # return curves of selected keys
     if selectedCurves:
-        cmds.setKeyframe(selectedCurves, insert=True)
+        _set_keys(new_keys, selectedCurves)
         return True
 
-    # Get selection from GE_outliner
-    # ge_outliner_selection = mel.eval("string $temp[] = `selectionConnection -q -object graphEditor1FromOutliner`;")
-    # if ge_outliner_selection:
-    #     cmds.setKeyframe(ge_outliner_selection, insert=True)
-    #     return True
-
     # Get selection from channelbox
-    channelbox_selection = []
-    cb_attr_main, cb_attr_shapes = _get_selected_channels()
-    if cb_attr_main:
-        for obj in sel:
-            for attr in cb_attr_main:
-                if cmds.objExists(obj + "." + attr):
-                    channelbox_selection.append(obj + "." + attr)
-    if cb_attr_shapes:
-        for obj in sel:
-            shape_nodes = cmds.listRelatives(obj, shapes=True, fullPath=True)
-            for shape_node in shape_nodes:
-                for attr in cb_attr_shapes:
-                    if cmds.objExists(shape_node + "." + attr):
-                        channelbox_selection.append(shape_node + "." + attr)
-
+    channelbox_selection = [name for name, _ in plugs.channel_box]
     if channelbox_selection:
-        for attr in channelbox_selection:
-            if cmds.keyframe(attr, q=True, kc=True):
-                cmds.setKeyframe(channelbox_selection, insert=True)
-            else:
-                cmds.setKeyframe(channelbox_selection)
+        keyed = [channelPlugs.is_keyed(name) for name in channelbox_selection]
+        pending = set(new_keys)
+        _set_keys(new_keys + [name for name, k in zip(channelbox_selection, keyed)
+                              if not k and name not in pending],
+                  [name for name, k in zip(channelbox_selection, keyed) if k])
         return True
 
     # Ok, maybe no selection. Just insert all the ones we didn't initially do a setkey
-    for obj in sel:
-        if obj not in objects_to_skip:
-            cmds.setKeyframe(obj, insert=True, shape=True)
+    inserts = [name for obj in sel if obj not in objects_to_skip
+               for node in [obj] + plugs.shapes[obj]
+               for name in plugs.on_node(node) if channelPlugs.is_keyed(name)]
+    _set_keys(new_keys, inserts)
     '''
     # We need a way of accounting for MMB drag set-key override. Comparing these two values will do it.
     # Refer to Guppy canInsert() for more into
@@ -702,81 +966,42 @@ def slice_curves():
     # # tuples ex: [(0, 0, 0)]
     newValue = cmds.getAttr(obj + '.tx')
     '''
+    return True
+
+def _set_keys(new_keys, inserts):
+    ''' New keys on unkeyed plugs, inserted keys on curves - one call each. '''
+    if new_keys:
+        cmds.setKeyframe(new_keys, breakdown=False, hierarchy='none',
+                         controlPoints=False)
+    if inserts:
+        cmds.setKeyframe(inserts, insert=True)
+
+def _toggle_plugs():
+    ''' Channel box selection, else every animatable plug on the objects. '''
+    plugs = channelPlugs.resolve()
+    if plugs.channel_box:
+        return [name for name, _ in plugs.channel_box], True
+    return plugs.object_plugs(), False
 
-def _get_selected_channels():
-
-    attrs_main = cmds.channelBox(CHANNELBOX, q=True, sma=True) or []
-    attrs_shape = cmds.channelBox(CHANNELBOX, q=True, ssa=True) or []
-    return attrs_main, attrs_shape
-
+@undo
 def toggle_lock_selected_channels():
-    selection = cmds.ls(sl=1)
-    if not selection: return
-    channelbox_selection = []
-    cb_attr_main, cb_attr_shapes = _get_selected_channels()
-    if cb_attr_main:
-        for obj in selection:
-            for attr in cb_attr_main:
-                if cmds.objExists(obj + "." + attr):
-                    channelbox_selection.append(obj + "." + attr)
-    if cb_attr_shapes:
-        for obj in selection:
-            shape_nodes = cmds.listRelatives(obj, shapes=True)
-            for shape_node in shape_nodes:
-                for attr in cb_attr_shapes:
-                    if cmds.objExists(shape_node + "." + attr):
-                        channelbox_selection.append(shape_node + "." + attr)
-
-    if channelbox_selection:
-        lock_state = cmds.getAttr(channelbox_selection[0], lock=True)
-        for attr in channelbox_selection:
-            cmds.setAttr(attr, e=True, lock=not lock_state)
+    plugs, highlighted = _toggle_plugs()
+    if not plugs: return
+    if highlighted: # Follow the first channel
+        lock = not keyData.get_plug(plugs[0]).isLocked
     else:
-        is_locked = False
-        for obj in selection:
-            attributes = cmds.listAttr(obj, keyable=True) or []
-            locked_attributes = cmds.listAttr(obj, locked=True) or []
-            if locked_attributes: is_locked = True
-        for obj in selection:
-            for attribute in attributes:
-                if is_locked:
-                    cmds.setAttr(obj + '.' + attribute, e=True, lock=False)
-                else:
-                    cmds.setAttr(obj + '.' + attribute, e=True, lock=True)
-
+        lock = not any(keyData.get_plug(name).isLocked for name in plugs)
+    channelPlugs.set_locked(plugs, lock)
 
+@undo
 def toggle_mute_selected_channels():
-    selection = cmds.ls(sl=1)
-    if not selection: return
-    channelbox_selection = []
-    cb_attr_main, cb_attr_shapes = _get_selected_channels()
-    if cb_attr_main:
-        for obj in selection:
-            for attr in cb_attr_main:
-                if cmds.objExists(obj + "." + attr):
-                    channelbox_selection.append(obj + "." + attr)
-    if cb_attr_shapes:
-        for obj in selection:
-            shape_nodes = cmds.listRelatives(obj, shapes=True)
-            for shape_node in shape_nodes:
-                for attr in cb_attr_shapes:
-                    if cmds.objExists(shape_node + "." + attr):
-                        channelbox_selection.append(shape_node + "." + attr)
-
-    if channelbox_selection:
-        is_muted = cmds.mute(channelbox_selection[0], q=True)
-        for attr in channelbox_selection:
-            if is_muted:
-                cmds.mute(attr, disable=True)
-            else:
-                cmds.mute(attr)
+    plugs, highlighted = _toggle_plugs()
+    if not plugs: return
+    if highlighted: # Follow the first channel
+        mute = not channelPlugs.is_muted(plugs[0])
     else:
-        for obj in selection:
-            attributes = cmds.listAttr(obj, keyable=True) or []
-        if any([cmds.mute(obj + '.' + attr, q=True) for attr in attributes]):
-            cmds.mute(obj, disable=True)
-        else:
-            cmds.mute(obj)
+        mute = not any(channelPlugs.is_muted(name) for name in plugs)
+    channelPlugs.set_muted(plugs, mute)
 
 
 # EoF
@@ -1,11 +1,24 @@
 # =+-----------------------------------------------------------------------+= #
 # Imports
 
-from Qt import QtWidgets, QtGui, QtCompat # pylint:disable=E0611
-import maya.OpenMaya as om
+from Qt import QtCore, QtWidgets, QtGui, QtCompat # pylint:disable=E0611
 import maya.OpenMayaUI as omui
+import maya.api.OpenMaya as om2
+import maya.api.OpenMayaUI as omui2
 from maya import cmds
 
+import frameIntervals
+
+
+# =+-----------------------------------------------------------------------+= #
+# Private methods
+
+def _remove_callbacks(callbacks):
+    ''' Empties the list in place so the widget and its closures agree. '''
+    if callbacks:
+        om2.MMessage.removeCallbacks(callbacks)
+    del callbacks[:]
+
 
 # =+-----------------------------------------------------------------------+= #
 # Public Class
@@ -19,9 +32,17 @@ class GE_Overlay(QtWidgets.QWidget):
             self.close()
             self.deleteLater()
 
-        self.frame_times = []
+        self.intervals = frameIntervals.FrameIntervals()
         self.active_color = []
         self.alpha = 100.0 # Difficult to screw up color input
+        self.bounds = None # (left, right) frames, None until read
+        self.bands = None # ((width, height, bounds), [QRectF])
+        self.callbacks = [om2.MEventMessage.addEventCallback(
+            'graphEditorChanged', self._viewport_changed)]
+        # Qt can delete us with the Graph Editor without a closeEvent. Don't
+        # hold self here - a bound method would outlive the C++ widget.
+        callbacks = self.callbacks
+        self.destroyed.connect(lambda *args: _remove_callbacks(callbacks))
         self.set_frames(frame_times) # Clean the frame range
         self.set_color(active_color) # Clean up the color input
 
@@ -42,15 +63,51 @@ class GE_Overlay(QtWidgets.QWidget):
     def _clamp(self, n, smallest, largest):
         return max(smallest, min(n, largest))
 
-    def _group(self, L):
-        first = last = L[0]
-        for n in L[1:]:
-            if n - 1 == last: # Part of the group, bump the end
-                last = n
-            else: # Not part of the group, yield current group and start a new
-                yield first, last
-                first = last = n
-        yield first, last # Yield the last group
+    def _viewport_changed(self, *args):
+        self.bounds = None
+        try:
+            self.update()
+        except RuntimeError: # Widget already deleted by Qt
+            _remove_callbacks(self.callbacks)
+
+    def _marks_changed(self):
+        self.bands = None
+        self.update()
+
+    def _get_bounds(self):
+        ''' Visible (left, right) frames, read again after graphEditorChanged. '''
+        if self.bounds is None:
+            left, right = omui2.MGraphEditorInfo().getViewportBounds()[:2]
+            self.bounds = (left, right)
+        return self.bounds
+
+    def _get_bands(self, width, height):
+        '''
+        Rectangles of the marks inside the viewport, kept until the bounds,
+        the widget size or the marks change.
+        '''
+        left, right = self._get_bounds()
+        key = (width, height, left, right)
+        if self.bands is not None and self.bands[0] == key:
+            return self.bands[1]
+
+        visible_frames = (right - left) or 1.0 # It floats!
+        scale = width / visible_frames
+        rects = []
+        for start_frame, end_frame in self.intervals.overlapping(left, right):
+            # Clip to the viewport so huge spans stay sane pixel values
+            left_side = (max(start_frame, left) - left) * scale
+            right_side = (min(end_frame, right) - left) * scale
+            rects.append(QtCore.QRectF(left_side, 0, right_side - left_side, height))
+        self.bands = (key, rects)
+        return rects
+
+    def remove_callbacks(self):
+        _remove_callbacks(self.callbacks)
+
+    def closeEvent(self, event):
+        self.remove_callbacks()
+        super(GE_Overlay, self).closeEvent(event)
 
 
     # ----------------------------------------------------------------------- #
@@ -60,22 +117,26 @@ class GE_Overlay(QtWidgets.QWidget):
         '''
         It's possible to send a list with ranges as 2-item lists.
         For example, [[-10,20],25,39,[50,100]]
+        Frames can be floats - every mark is one frame wide.
         '''
-        new_frame_times = []
-        if not isinstance(frames, list): frames = [frames]
-        for frame in frames:
-            if isinstance(frame, list):
-                frame = frame if frame[0]<frame[1] else [frame[1],frame[0]]
-                frame_range = range(frame[0], frame[1]+1)
-                new_frame_times.extend(frame_range )
-            else:
-                new_frame_times.append(frame)
-        self.frame_times = list(set(new_frame_times))
-        self.frame_times.sort()
-        self.update()
+        self.intervals = frameIntervals.FrameIntervals.from_frames(frames)
+        self._marks_changed()
+
+    def add_frames(self, frames):
+        ''' Mark more frames, same input as set_frames. '''
+        for start, end in frameIntervals.FrameIntervals.from_frames(frames):
+            self.intervals.add(start, end)
+        self._marks_changed()
+
+    def remove_frames(self, frames):
+        ''' Unmark frames, same input as set_frames. '''
+        for start, end in frameIntervals.FrameIntervals.from_frames(frames):
+            self.intervals.remove(start, end)
+        self._marks_changed()
 
     def get_frames(self):
-        return self.frame_times
+        ''' Marked [start, end) spans, end excluded. '''
+        return self.intervals.spans()
 
     def set_color(self, color):
         ''' Set either rgb or rgba (255,255,255,255)'''
@@ -100,32 +161,14 @@ class GE_Overlay(QtWidgets.QWidget):
         if parent:
             # --------------------------------------------------------------- #
             # Basic frame geometry stuff
-            self.setGeometry(parent.geometry())
+            if self.geometry() != parent.geometry():
+                self.setGeometry(parent.geometry())
 
             frame_width  = self.ge_widget.frameSize().width()
             frame_height = self.ge_widget.frameSize().height()
-
-            # Get initial frame range of GE panel
-            # Taken from the maya docs for MGraphEditorInfo()
-            leftSu=om.MScriptUtil(0.0)
-            leftPtr=leftSu.asDoublePtr()
-            rightSu=om.MScriptUtil(0.0)
-            rightPtr=rightSu.asDoublePtr()
-            bottomSu=om.MScriptUtil(0.0)
-            bottomPtr=bottomSu.asDoublePtr()
-            topSu=om.MScriptUtil(0.0)
-            topPtr=topSu.asDoublePtr()
-
-            omui.MGraphEditorInfo().getViewportBounds(leftPtr,
-                                                      rightPtr,
-                                                      bottomPtr,
-                                                      topPtr)
-
-            ge_left_frame = om.MScriptUtil(leftPtr).asDouble()
-            ge_right_frame = om.MScriptUtil(rightPtr).asDouble()
-
-            # Distance in numbers of frames visible in the widget
-            total_visible_frames = ge_right_frame - ge_left_frame # It floats!
+            bands = self._get_bands(frame_width, frame_height)
+            if not bands:
+                return
 
             # --------------------------------------------------------------- #
             # Painter widgets
@@ -142,26 +185,9 @@ class GE_Overlay(QtWidgets.QWidget):
             pen.setColor(pen_color)
             painter.setPen(pen)
 
-            for frame_group in list(self._group(self.frame_times)):
-                # Start frame calculated against the width of the frame
-                ratio_left_side = (frame_group[0] - ge_left_frame)\
-                                   / total_visible_frames
-                left_side_geometry = ratio_left_side * frame_width
-
-                # End frame calculated against the width of the frame
-                ratio_right_side = (frame_group[-1] - ge_left_frame + 1)\
-                                    / total_visible_frames
-                right_side_geometry = ratio_right_side * frame_width
-
-                painter.fillRect(left_side_geometry,
-                                 0, # From the top
-                                 right_side_geometry-left_side_geometry,
-                                 frame_height, # To the bottom
-                                 fill_color)
-                painter.drawRect(left_side_geometry,
-                                 -1, # Watch out for stroke thickness
-                                 right_side_geometry-left_side_geometry,
-                                 frame_height+2)
+            for band in bands:
+                painter.fillRect(band, fill_color)
+                painter.drawRect(band.adjusted(0, -1, 0, 1)) # Stroke off screen
 
 
 # =+----------------------------------------------------------------------+= #
@@ -0,0 +1,527 @@
+# ============================================================================ #
+# Anim curve access through OpenMaya 2.0 ===================================== #
+#
+# Shared helpers for the tools that read or write keys in bulk instead of
+# issuing one cmds.keyframe/keyTangent call per key.
+
+import hashlib
+
+import numpy as np
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+from maya import cmds
+
+import apiUndo
+import performance
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+CURVE_TYPES = { om.MFnUnitAttribute.kDistance : oma.MFnAnimCurve.kAnimCurveTL
+              , om.MFnUnitAttribute.kAngle    : oma.MFnAnimCurve.kAnimCurveTA
+              , om.MFnUnitAttribute.kTime     : oma.MFnAnimCurve.kAnimCurveTT
+              }
+
+# Same names cmds.keyTangent uses
+TANGENT_NAMES = { oma.MFnAnimCurve.kTangentGlobal   : 'global'
+                , oma.MFnAnimCurve.kTangentFixed    : 'fixed'
+                , oma.MFnAnimCurve.kTangentLinear   : 'linear'
+                , oma.MFnAnimCurve.kTangentFlat     : 'flat'
+                , oma.MFnAnimCurve.kTangentSmooth   : 'spline'
+                , oma.MFnAnimCurve.kTangentStep     : 'step'
+                , oma.MFnAnimCurve.kTangentSlow     : 'slow'
+                , oma.MFnAnimCurve.kTangentFast     : 'fast'
+                , oma.MFnAnimCurve.kTangentClamped  : 'clamped'
+                , oma.MFnAnimCurve.kTangentPlateau  : 'plateau'
+                , oma.MFnAnimCurve.kTangentStepNext : 'stepnext'
+                , oma.MFnAnimCurve.kTangentAuto     : 'auto'
+                }
+TANGENT_TYPES = dict((name, enum) for enum, name in TANGENT_NAMES.items())
+
+# Same names cmds.setInfinity uses
+INFINITY_NAMES = { oma.MFnAnimCurve.kConstant       : 'constant'
+                 , oma.MFnAnimCurve.kLinear         : 'linear'
+                 , oma.MFnAnimCurve.kCycle          : 'cycle'
+                 , oma.MFnAnimCurve.kCycleRelative  : 'cycleRelative'
+                 , oma.MFnAnimCurve.kOscillate      : 'oscillate'
+                 }
+INFINITY_TYPES = dict((name, enum) for enum, name in INFINITY_NAMES.items())
+
+CHANNEL_TYPES = { oma.MFnAnimCurve.kAnimCurveTL : 'translate'
+                , oma.MFnAnimCurve.kAnimCurveTA : 'rotate'
+                }
+
+STEPPED = ('step', 'stepnext')
+
+
+# ============================================================================ #
+# Data handlers ============================================================== #
+
+class CurveKeys(object):
+    '''
+    Parallel arrays describing every key on one anim curve.
+
+    times             frames in the UI time unit
+    values            internal units (cm, radians)
+    in_x, in_y        tangent vectors with x in frames and y in internal
+    out_x, out_y      units. Maya stores x in seconds; converted on read/write.
+    in_types          tangent type names, as cmds.keyTangent spells them
+    out_types
+    tangents_locked   bool per key
+    weights_locked    bool per key
+    breakdowns        bool per key
+    '''
+    ARRAYS = ( 'times', 'values', 'in_x', 'in_y', 'out_x', 'out_y'
+             , 'in_types', 'out_types'
+             , 'tangents_locked', 'weights_locked', 'breakdowns'
+             )
+
+    def __init__(self, name, count=0):
+        self.name = name
+        self.channel_type = 'other'
+        self.weighted = False
+        self.pre_infinity = 'constant'
+        self.post_infinity = 'constant'
+        for field in ('times', 'values', 'in_x', 'in_y', 'out_x', 'out_y'):
+            setattr(self, field, np.zeros(count))
+        self.in_x[:] = self.out_x[:] = 1.0
+        self.in_types = np.array(['auto'] * count, dtype=object)
+        self.out_types = np.array(['auto'] * count, dtype=object)
+        self.tangents_locked = np.ones(count, dtype=bool)
+        self.weights_locked = np.zeros(count, dtype=bool)
+        self.breakdowns = np.zeros(count, dtype=bool)
+
+    def __len__(self):
+        return len(self.times)
+
+    def take(self, indices):
+        ''' New CurveKeys holding only the keys at indices (or a mask). '''
+        subset = CurveKeys(self.name)
+        for field in ('channel_type', 'weighted', 'pre_infinity', 'post_infinity'):
+            setattr(subset, field, getattr(self, field))
+        for field in self.ARRAYS:
+            setattr(subset, field, getattr(self, field)[indices].copy())
+        return subset
+
+    def copy(self):
+        return self.take(slice(None))
+
+    def digest(self):
+        ''' Hash of every key and curve setting, channel type included. '''
+        digest = hashlib.md5()
+        for field in self.ARRAYS:
+            values = getattr(self, field)
+            if values.dtype == object: # tangent type names
+                digest.update(' '.join(values).encode('utf-8'))
+            else:
+                digest.update(np.ascontiguousarray(values).tobytes())
+        digest.update('{} {} {} {}'.format(self.channel_type, self.weighted,
+                                           self.pre_infinity,
+                                           self.post_infinity).encode('utf-8'))
+        return digest.hexdigest()
+
+    @classmethod
+    def concatenate(cls, name, parts):
+        ''' Join CurveKeys in time order. Curve settings come from parts[0]. '''
+        joined = parts[0].take(slice(None))
+        joined.name = name
+        for field in cls.ARRAYS:
+            setattr(joined, field, np.concatenate([getattr(p, field) for p in parts]))
+        order = np.argsort(joined.times, kind='mergesort')
+        return joined.take(order)
+
+
+class KeySnapshot(object):
+    '''
+    Parallel arrays describing the selected keys of many curves.
+
+    curves            curve names, curve holds an index into it per key
+    index             key index on its curve
+    time, value       frames in the UI time unit, internal units
+    in_types          tangent type names
+    out_types
+    in_angle          degrees, as cmds.keyTangent reports them
+    out_angle
+    in_weight
+    out_weight
+    locked            tangents locked
+    in_selected       handle is active - both sides when the key itself is
+    out_selected      selected, see detect_handles
+    direction_up      the curve rises from this key to the next
+    '''
+    ARRAYS = ( 'curve', 'index', 'time', 'value', 'in_types', 'out_types'
+             , 'in_angle', 'out_angle', 'in_weight', 'out_weight', 'locked'
+             , 'in_selected', 'out_selected', 'direction_up'
+             )
+
+    def __init__(self, curves=None):
+        self.curves = list(curves or [])
+        self._curve_fns = {}
+        for field in ('curve', 'index'):
+            setattr(self, field, np.zeros(0, dtype=int))
+        for field in ('time', 'value', 'in_angle', 'out_angle',
+                      'in_weight', 'out_weight'):
+            setattr(self, field, np.zeros(0))
+        for field in ('in_types', 'out_types'):
+            setattr(self, field, np.zeros(0, dtype=object))
+        for field in ('locked', 'in_selected', 'out_selected', 'direction_up'):
+            setattr(self, field, np.zeros(0, dtype=bool))
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def from_selection(cls, detect_handles=True):
+        ''' Snapshot of the keys selected in the Graph Editor. '''
+        curves = cmds.keyframe(q=True, selected=True, name=True) or []
+        indices = [cmds.keyframe(c, q=True, selected=True, indexValue=True) or []
+                   for c in curves]
+        snapshot = cls.read(curves, indices)
+        if detect_handles and len(snapshot):
+            snapshot.detect_handles()
+        return snapshot
+
+    @classmethod
+    def read(cls, curves, indices):
+        '''
+        curves:  curve names
+        indices: key indices per curve
+        One API pass per curve. Every handle starts out selected.
+        '''
+        snapshot = cls(curves)
+        rows = []
+        unit = om.MTime.uiUnit()
+        for c, curve_indices in enumerate(indices):
+            curve_fn = snapshot.curve_fn(c)
+            last = curve_fn.numKeys - 1
+            for i in sorted(int(i) for i in curve_indices):
+                in_angle, in_weight = curve_fn.getTangentAngleWeight(i, True)
+                out_angle, out_weight = curve_fn.getTangentAngleWeight(i, False)
+                value = curve_fn.value(i)
+                if i < last:
+                    up = curve_fn.value(i + 1) >= value
+                else: # Last key, look back instead
+                    up = i == 0 or value >= curve_fn.value(i - 1)
+                rows.append(( c, i, curve_fn.input(i).asUnits(unit), value
+                            , TANGENT_NAMES[curve_fn.inTangentType(i)]
+                            , TANGENT_NAMES[curve_fn.outTangentType(i)]
+                            , in_angle.asDegrees(), out_angle.asDegrees()
+                            , in_weight, out_weight
+                            , curve_fn.tangentsLocked(i), True, True, up
+                            ))
+        if rows:
+            for field, column in zip(cls.ARRAYS, zip(*rows)):
+                setattr(snapshot, field,
+                        np.array(column, dtype=getattr(snapshot, field).dtype))
+        return snapshot
+
+    def copy(self):
+        snapshot = KeySnapshot(self.curves)
+        snapshot._curve_fns = self._curve_fns
+        for field in self.ARRAYS:
+            setattr(snapshot, field, getattr(self, field).copy())
+        return snapshot
+
+    def curve_fn(self, c):
+        if c not in self._curve_fns:
+            self._curve_fns[c] = get_curve_fn(self.curves[c])
+        return self._curve_fns[c]
+
+    def detect_handles(self):
+        '''
+        Fill in_selected/out_selected from the Graph Editor tangent
+        selection, without touching the curves. selectKey can't be queried
+        per side, so each side is toggled and the key selection read:
+            in only  -> toggling in drops the key
+            out only -> toggling out drops the key
+            both, or the key itself -> the key stays selected either way
+        Every toggle is toggled straight back (undo off), so the selection
+        ends up as it started.
+        '''
+        self.in_selected[:] = True
+        self.out_selected[:] = True
+        with performance.Suspend('detect_handles', viewport=False,
+                                 parallel=False, time_slider=False, undo=True):
+            for c, curve in enumerate(self.curves):
+                keys = np.flatnonzero(self.curve == c)
+                indices = [(int(i), int(i)) for i in self.index[keys]]
+                for side, other in (('inTangent', self.out_selected),
+                                    ('outTangent', self.in_selected)):
+                    flags = {side : True}
+                    cmds.selectKey(curve, index=indices, toggle=True, **flags)
+                    try:
+                        still = set(int(i) for i in cmds.keyframe(
+                            curve, q=True, selected=True, indexValue=True) or [])
+                    finally:
+                        cmds.selectKey(curve, index=indices, toggle=True, **flags)
+                    dropped = np.array([int(i) not in still for i in self.index[keys]],
+                                       dtype=bool)
+                    other[keys[dropped]] = False
+
+    def write(self, mask=None, change=None, in_sides=None, out_sides=None):
+        '''
+        Push types, angles and weights of the keys in mask back onto their
+        curves. in_sides/out_sides default to the selected handles; pass
+        True for both. Pass an MAnimCurveChange to undo later.
+        '''
+        mask = np.ones(len(self), dtype=bool) if mask is None else mask
+        in_sides = self.in_selected if in_sides is None else in_sides
+        out_sides = self.out_selected if out_sides is None else out_sides
+        in_sides = np.broadcast_to(in_sides, mask.shape)
+        out_sides = np.broadcast_to(out_sides, mask.shape)
+        for k in np.flatnonzero(mask & (in_sides | out_sides)):
+            curve_fn = self.curve_fn(self.curve[k])
+            i = int(self.index[k])
+            curve_fn.setTangentsLocked(i, False, change)
+            for is_in, sides, types, angles, weights in (
+                    (True, in_sides, self.in_types, self.in_angle, self.in_weight),
+                    (False, out_sides, self.out_types, self.out_angle, self.out_weight)):
+                if not sides[k]:
+                    continue
+                if types[k] not in STEPPED:
+                    curve_fn.setTangent(i, om.MAngle(angles[k], om.MAngle.kDegrees),
+                                        weights[k], is_in, change)
+                # After the angle - anything but fixed gets recomputed
+                if is_in:
+                    curve_fn.setInTangentType(i, TANGENT_TYPES[types[k]], change)
+                else:
+                    curve_fn.setOutTangentType(i, TANGENT_TYPES[types[k]], change)
+            if self.locked[k]:
+                curve_fn.setTangentsLocked(i, True, change)
+
+    def write_angles(self, change=None):
+        '''
+        Only set the tangent vectors - the cheap per tick path for live
+        edits once write() has made the handles fixed and unlocked.
+        '''
+        for k in range(len(self)):
+            curve_fn = self.curve_fn(self.curve[k])
+            i = int(self.index[k])
+            if self.in_types[k] not in STEPPED:
+                curve_fn.setTangent(i, om.MAngle(self.in_angle[k], om.MAngle.kDegrees),
+                                    self.in_weight[k], True, change)
+            if self.out_types[k] not in STEPPED:
+                curve_fn.setTangent(i, om.MAngle(self.out_angle[k], om.MAngle.kDegrees),
+                                    self.out_weight[k], False, change)
+
+
+class KeySelection(object):
+    '''
+    Graph Editor key selection as runs of neighbouring keys per curve.
+    Curves are held by MObjectHandle and runs by time, so a restore still
+    lands if the curves got renamed or keys were added/removed meanwhile.
+    '''
+    def __init__(self):
+        self.runs = [] # [(MObjectHandle, [(start, end), ...]), ...]
+
+    def __len__(self):
+        return sum(len(ranges) for _, ranges in self.runs)
+
+    @classmethod
+    def capture(cls):
+        selection = cls()
+        unit = om.MTime.uiUnit()
+        for curve in cmds.keyframe(q=True, selected=True, name=True) or []:
+            indices = np.array(sorted(int(i) for i in
+                                      cmds.keyframe(curve, q=True, selected=True,
+                                                    indexValue=True) or []))
+            if not len(indices):
+                continue
+            node = get_node(curve)
+            curve_fn = oma.MFnAnimCurve(node)
+            breaks = np.flatnonzero(np.diff(indices) > 1)
+            starts = indices[np.append(0, breaks + 1)]
+            ends = indices[np.append(breaks, len(indices) - 1)]
+            ranges = [(curve_fn.input(int(a)).asUnits(unit),
+                       curve_fn.input(int(b)).asUnits(unit))
+                      for a, b in zip(starts, ends)]
+            selection.runs.append((om.MObjectHandle(node), ranges))
+        return selection
+
+    def mirror(self, first_frame, last_frame):
+        ''' Follow keys flipped in time between first_frame and last_frame. '''
+        pivot = first_frame + last_frame
+        tolerance = 1e-6
+        for n, (handle, ranges) in enumerate(self.runs):
+            self.runs[n] = (handle, [(pivot - end, pivot - start)
+                                     if start >= first_frame - tolerance
+                                     and end <= last_frame + tolerance
+                                     else (start, end)
+                                     for start, end in ranges])
+
+    def restore(self, clear=True):
+        ''' One selectKey call per curve. Deleted curves are skipped. '''
+        if clear:
+            cmds.selectKey(clear=True)
+        for handle, ranges in self.runs:
+            if not handle.isValid():
+                continue
+            name = om.MFnDependencyNode(handle.object()).name()
+            cmds.selectKey(name, add=True, time=ranges)
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def frames_per_second():
+    return om.MTime(1.0, om.MTime.kSeconds).asUnits(om.MTime.uiUnit())
+
+def ui_time_unit():
+    return om.MTime.uiUnit()
+
+def to_mtime(frame, unit=None):
+    return om.MTime(frame, unit or om.MTime.uiUnit())
+
+def time_array(frames, unit=None):
+    unit = unit or om.MTime.uiUnit()
+    return om.MTimeArray([om.MTime(float(f), unit) for f in frames])
+
+def get_plug(plug_name):
+    selection = om.MSelectionList()
+    selection.add(plug_name)
+    return selection.getPlug(0)
+
+def get_node(node_name):
+    selection = om.MSelectionList()
+    selection.add(node_name)
+    return selection.getDependNode(0)
+
+def get_curve_fn(curve_name):
+    return oma.MFnAnimCurve(get_node(curve_name))
+
+def curve_type_for_plug(plug):
+    attribute = plug.attribute()
+    if attribute.hasFn(om.MFn.kUnitAttribute):
+        unit_type = om.MFnUnitAttribute(attribute).unitType()
+        return CURVE_TYPES.get(unit_type, oma.MFnAnimCurve.kAnimCurveTU)
+    return oma.MFnAnimCurve.kAnimCurveTU
+
+def plug_source(plug):
+    ''' Return the plug driving this one, or None. '''
+    sources = plug.connectedTo(True, False)
+    return sources[0] if sources else None
+
+def is_time_curve(node):
+    ''' Anim curves driven by time, not set driven keys. '''
+    return node.hasFn(om.MFn.kAnimCurveTimeToAngular) \
+        or node.hasFn(om.MFn.kAnimCurveTimeToDistance) \
+        or node.hasFn(om.MFn.kAnimCurveTimeToUnitless) \
+        or node.hasFn(om.MFn.kAnimCurveTimeToTime)
+
+def curve_for_plug(plug, modifier=None):
+    '''
+    Return an MFnAnimCurve keying plug. If something else drives the plug
+    (constraint, pairBlend...) it is disconnected and a new curve created.
+    Pass an MDGModifier to undo the connection edits later; it is executed
+    here.
+    '''
+    source = plug_source(plug)
+    if source is not None and is_time_curve(source.node()):
+        return oma.MFnAnimCurve(source.node())
+
+    if modifier is None:
+        modifier = om.MDGModifier()
+    if source is not None:
+        modifier.disconnect(source, plug)
+    curve_fn = oma.MFnAnimCurve()
+    curve_fn.create(plug, curve_type_for_plug(plug), modifier)
+    modifier.doIt()
+    return curve_fn
+
+def ui_scale(channel_type):
+    ''' Internal -> UI unit factor for a channel type (eg. radians -> degrees). '''
+    if channel_type == 'rotate':
+        return om.MAngle(1.0, om.MAngle.kRadians).asUnits(om.MAngle.uiUnit())
+    if channel_type == 'translate':
+        return om.MDistance(1.0, om.MDistance.kCentimeters)\
+                 .asUnits(om.MDistance.uiUnit())
+    return 1.0
+
+def selected_curves():
+    ''' Curves with selected keys, or every curve shown in the Graph Editor. '''
+    curves = cmds.keyframe(q=True, selected=True, name=True) or []
+    if not curves:
+        curves = cmds.keyframe(q=True, name=True) or []
+    return curves
+
+def channel_type(curve_fn):
+    ''' 'translate', 'rotate' or 'other' - used to pick tolerances. '''
+    return CHANNEL_TYPES.get(curve_fn.animCurveType, 'other')
+
+def read_curve(curve_name):
+    ''' One API pass over a curve. Returns CurveKeys. '''
+    curve_fn = get_curve_fn(curve_name)
+    unit = om.MTime.uiUnit()
+    fps = frames_per_second()
+    count = curve_fn.numKeys
+
+    keys = CurveKeys(curve_name, count)
+    keys.channel_type = channel_type(curve_fn)
+    keys.weighted = curve_fn.isWeighted
+    keys.pre_infinity = INFINITY_NAMES[curve_fn.preInfinityType]
+    keys.post_infinity = INFINITY_NAMES[curve_fn.postInfinityType]
+    for i in range(count):
+        keys.times[i] = curve_fn.input(i).asUnits(unit)
+        keys.values[i] = curve_fn.value(i)
+        keys.in_types[i] = TANGENT_NAMES[curve_fn.inTangentType(i)]
+        keys.out_types[i] = TANGENT_NAMES[curve_fn.outTangentType(i)]
+        keys.in_x[i], keys.in_y[i] = curve_fn.getTangentXY(i, True)
+        keys.out_x[i], keys.out_y[i] = curve_fn.getTangentXY(i, False)
+        keys.tangents_locked[i] = curve_fn.tangentsLocked(i)
+        keys.weights_locked[i] = curve_fn.weightsLocked(i)
+        keys.breakdowns[i] = curve_fn.isBreakdown(i)
+    keys.in_x *= fps
+    keys.out_x *= fps
+    return keys
+
+def read_curves(curve_names):
+    return [read_curve(name) for name in curve_names]
+
+def write_curve(keys, change=None):
+    '''
+    Replace every key on keys.name with the arrays in keys.
+    Fixed tangents are written as vectors, everything else by type so
+    Maya recomputes them. Pass an MAnimCurveChange to undo later.
+    '''
+    curve_fn = get_curve_fn(keys.name)
+    fps = frames_per_second()
+    if change is None:
+        change = oma.MAnimCurveChange()
+
+    curve_fn.addKeys( time_array(keys.times)
+                    , om.MDoubleArray(np.asarray(keys.values, dtype=float).tolist())
+                    , oma.MFnAnimCurve.kTangentAuto
+                    , oma.MFnAnimCurve.kTangentAuto
+                    , False # replace every existing key
+                    , change
+                    )
+    curve_fn.setIsWeighted(bool(keys.weighted), change)
+    curve_fn.setPreInfinityType(INFINITY_TYPES[keys.pre_infinity], change)
+    curve_fn.setPostInfinityType(INFINITY_TYPES[keys.post_infinity], change)
+
+    for i in range(len(keys)):
+        curve_fn.setTangentsLocked(i, False, change)
+        if keys.weighted:
+            curve_fn.setWeightsLocked(i, False, change)
+        curve_fn.setInTangentType(i, TANGENT_TYPES[keys.in_types[i]], change)
+        curve_fn.setOutTangentType(i, TANGENT_TYPES[keys.out_types[i]], change)
+        if keys.in_types[i] == 'fixed':
+            curve_fn.setTangent(i, keys.in_x[i] / fps, keys.in_y[i],
+                                True, change, False)
+        if keys.out_types[i] == 'fixed':
+            curve_fn.setTangent(i, keys.out_x[i] / fps, keys.out_y[i],
+                                False, change, False)
+        if keys.tangents_locked[i]:
+            curve_fn.setTangentsLocked(i, True, change)
+        if keys.weighted and keys.weights_locked[i]:
+            curve_fn.setWeightsLocked(i, True, change)
+        if keys.breakdowns[i]:
+            curve_fn.setIsBreakdown(i, True, change)
+    return change
+
+def write_curves(curves):
+    ''' Write many CurveKeys as a single undo step. '''
+    change = oma.MAnimCurveChange()
+    for keys in curves:
+        write_curve(keys, change)
+    apiUndo.commit(change.undoIt, change.redoIt)
+    return change
@@ -0,0 +1,214 @@
+# ============================================================================ #
+# Key reduction for dense (baked) curves
+#
+# Fits hermite segments through a subset of the keys so every dropped key is
+# within tolerance of the curve that remains. All curves that share the same
+# key times are fitted together as one (curves, frames) array.
+
+from __future__ import division
+
+from collections import defaultdict
+
+import numpy as np
+
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+# Max deviation in UI units (eg. cm and degrees) per channel type
+TOLERANCES = { 'translate' : 0.01
+             , 'rotate'    : 0.05
+             , 'other'     : 0.001
+             }
+MIN_KEYS = 3 # Curves with fewer keys in range are left alone
+SEED_REACH = 4 # Frames either side an extreme must stand out over
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _neighbours(kept):
+    ''' Index of the kept key at or before/after every frame. '''
+    count = kept.shape[1]
+    frames = np.arange(count)
+    left = np.maximum.accumulate(np.where(kept, frames, 0), axis=1)
+    right = np.minimum.accumulate(np.where(kept, frames, count - 1)[:, ::-1],
+                                  axis=1)[:, ::-1]
+    return left, right
+
+def _hermite(times, values, slopes, left, right):
+    offset = (np.arange(values.shape[0]) * values.shape[1])[:, None]
+    left_flat = left + offset
+    right_flat = right + offset
+    t0 = times[left]
+    span = times[right] - t0
+    span[span == 0.0] = 1.0
+    s = (times[None, :] - t0) / span
+    s2 = s * s
+    s3 = s2 * s
+    h01 = 3 * s2 - 2 * s3
+    v0 = values.take(left_flat)
+    return ( v0 + h01 * (values.take(right_flat) - v0)
+           + ((s3 - 2 * s2 + s) * slopes.take(left_flat)
+              + (s3 - s2) * slopes.take(right_flat)) * span
+           )
+
+def _in_range(keys, start_frame, end_frame):
+    mask = np.ones(len(keys), dtype=bool)
+    if start_frame is not None:
+        mask &= keys.times >= start_frame - 1e-6
+    if end_frame is not None:
+        mask &= keys.times <= end_frame + 1e-6
+    return mask
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def fit_dense(times, values, tolerance):
+    '''
+    times:     (frames,) shared key times
+    values:    (curves, frames)
+    tolerance: (curves,) max deviation, same units as values
+    Returns kept (curves, frames) bool, slopes (curves, frames) per frame and
+    the max error (curves,) of the reduced curves.
+
+    Keys are inserted at the worst frame of every failing segment until all
+    segments fit, for every curve at once.
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    tolerance = np.asarray(tolerance, dtype=np.float64)
+    curve_count, frame_count = values.shape
+
+    slopes = np.gradient(values, times, axis=1) if frame_count > 1 \
+        else np.zeros(values.shape)
+    # Seed with the extremes - where an animator would put keys anyway.
+    # Wiggles smaller than the tolerance don't count.
+    kept = np.zeros(values.shape, dtype=bool)
+    kept[:, 1:-1] = np.diff(np.sign(np.diff(values, axis=1)), axis=1) != 0
+    frames = np.arange(frame_count)
+    for reach in (-SEED_REACH, SEED_REACH):
+        neighbour = values[:, np.clip(frames + reach, 0, frame_count - 1)]
+        kept &= np.abs(values - neighbour) > tolerance[:, None]
+    kept[:, 0] = kept[:, -1] = True
+    max_error = np.zeros(curve_count)
+
+    active = np.arange(curve_count) # curves that still have failing segments
+    while len(active) and frame_count > 2:
+        sub_kept = kept[active]
+        left, right = _neighbours(sub_kept)
+        error = np.abs(_hermite(times, values[active], slopes[active],
+                                left, right) - values[active])
+        error[sub_kept] = 0.0
+        max_error[active] = error.max(axis=1)
+        failing = error > tolerance[active, None]
+
+        # Segments are contiguous runs of the flattened array starting at
+        # every kept key. Insert the worst frame of each failing one.
+        flat_error = error.ravel()
+        starts = np.flatnonzero(sub_kept.ravel())
+        worst = np.maximum.reduceat(flat_error, starts)
+        lengths = np.diff(np.append(starts, flat_error.size))
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        candidates = np.flatnonzero((flat_error == worst[segment])
+                                    & failing.ravel())
+        if not len(candidates):
+            break
+        _, first = np.unique(segment[candidates], return_index=True)
+        inserts = candidates[first]
+        kept[active[inserts // frame_count], inserts % frame_count] = True
+        active = active[failing.any(axis=1)]
+
+    return kept, slopes, max_error
+
+def reduce_keys(keys, kept, slopes):
+    '''
+    Build a CurveKeys from the kept frames of a dense CurveKeys, with fixed
+    tangents sized to the neighbouring segments (exact for weighted curves).
+    '''
+    reduced = keys.take(kept)
+    slopes = slopes[kept]
+    gaps = np.diff(reduced.times)
+    reduced.in_x = np.append(gaps[:1], gaps) if len(gaps) else np.ones(1)
+    reduced.out_x = np.append(gaps, gaps[-1:]) if len(gaps) else np.ones(1)
+    reduced.in_y = slopes * reduced.in_x
+    reduced.out_y = slopes * reduced.out_x
+    reduced.in_types[:] = 'fixed'
+    reduced.out_types[:] = 'fixed'
+    reduced.tangents_locked[:] = True
+    reduced.weights_locked[:] = False
+    reduced.breakdowns[:] = False
+    return reduced
+
+def reduce_curves(curves, tolerances=None, start_frame=None, end_frame=None):
+    '''
+    Reduce anim curves (names) within an optional frame range.
+    tolerances: dict overriding TOLERANCES, in UI units
+    Keys outside the range are untouched. Writes back as one undo step and
+    returns a report dict.
+    '''
+    limits = dict(TOLERANCES)
+    limits.update(tolerances or {})
+
+    # Group by key times so each group fits as one array
+    groups = defaultdict(list)
+    curve_data = {}
+    for keys in keyData.read_curves(curves):
+        mask = _in_range(keys, start_frame, end_frame)
+        if mask.sum() < MIN_KEYS:
+            continue
+        curve_data[keys.name] = (keys, mask)
+        groups[keys.times[mask].tobytes()].append(keys.name)
+
+    report = { 'curves'    : len(curve_data)
+             , 'keys_in'   : 0
+             , 'keys_out'  : 0
+             , 'max_error' : dict((channel, 0.0) for channel in limits)
+             }
+    to_write = []
+    for names in groups.values():
+        first_keys, first_mask = curve_data[names[0]]
+        times = first_keys.times[first_mask]
+        scales = np.array([keyData.ui_scale(curve_data[n][0].channel_type)
+                           for n in names])
+        values = np.array([curve_data[n][0].values[curve_data[n][1]]
+                           for n in names])
+        tolerance = np.array([limits.get(curve_data[n][0].channel_type,
+                                         limits['other'])
+                              for n in names]) / scales
+
+        kept, slopes, error = fit_dense(times, values, tolerance)
+
+        for row, name in enumerate(names):
+            keys, mask = curve_data[name]
+            inside = keys.take(mask)
+            reduced = reduce_keys(inside, kept[row], slopes[row])
+            outside = keys.take(~mask)
+            to_write.append(keyData.CurveKeys.concatenate(name,
+                                                          [reduced, outside]))
+
+            channel = keys.channel_type if keys.channel_type in limits else 'other'
+            report['keys_in'] += len(inside)
+            report['keys_out'] += len(reduced)
+            report['max_error'][channel] = max(report['max_error'][channel],
+                                               error[row] * scales[row])
+
+    if to_write:
+        keyData.write_curves(to_write)
+    return report
+
+def reduce_selected(tolerances=None):
+    '''
+    Graph Editor entry point - reduces the selected curves (or the shown
+    ones) and prints the report.
+    '''
+    curves = keyData.selected_curves()
+    if not curves:
+        print("Only works on selected keys/curves"); return None
+    report = reduce_curves(curves, tolerances)
+    print("Reduced {curves} curves: {keys_in} -> {keys_out} keys".format(**report))
+    for channel, error in sorted(report['max_error'].items()):
+        print("    max {} error: {:.6f}".format(channel, error))
+    return report
@@ -0,0 +1,176 @@
+# ============================================================================ #
+# Sorted key times of the time slider objects
+#
+# cmds.findKeyframe(timeSlider=True) walks every curve of the selection on
+# each call. KeyTimeIndex keeps the key times of those curves in one sorted,
+# de-duplicated list instead, so next/previous key is a bisect. Key times are
+# reference counted per curve: an edited curve only swaps its own times in
+# and out, a new selection only adds and drops the curves that changed.
+#
+#   index = keyTimeIndex.KeyTimeIndex().install()
+#   frame = index.next_time(cmds.currentTime(q=True))
+
+from bisect import bisect_left, bisect_right
+
+from maya import cmds
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+DECIMALS = 6 # Key times closer than this are the same time
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _curve_times(curve_fn, breakdowns_only=False):
+    unit = om.MTime.uiUnit()
+    return [round(curve_fn.input(i).asUnits(unit), DECIMALS)
+            for i in range(curve_fn.numKeys)
+            if not breakdowns_only or curve_fn.isBreakdown(i)]
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class KeyTimeIndex(object):
+    '''
+    breakdowns_only: only index breakdown keys
+    graph_editor:    only curves with keys selected in the Graph Editor,
+                     instead of every curve on the selected objects
+
+    curves: {MObjectHandle hashCode: (MObjectHandle, [times])}
+    counts: {time: number of curves keyed there}
+    times:  sorted counts keys, rebuilt lazily after edits
+    '''
+    def __init__(self, breakdowns_only=False, graph_editor=False):
+        self.breakdowns_only = breakdowns_only
+        self.graph_editor = graph_editor
+        self.curves = {}
+        self.counts = {}
+        self.times = []
+        self.sorted = True
+        self.stale = True # Curve membership needs a resolve
+        self.dirty = set()
+        self.callbacks = []
+
+    def install(self):
+        if not self.callbacks:
+            self.callbacks.append(om.MEventMessage.addEventCallback(
+                'SelectionChanged', self._selection_changed))
+            self.callbacks.append(
+                oma.MAnimMessage.addAnimCurveEditedCallback(self._edited))
+        return self
+
+    def uninstall(self):
+        if self.callbacks:
+            om.MMessage.removeCallbacks(self.callbacks)
+        self.callbacks = []
+        self.clear()
+
+    def clear(self):
+        self.curves.clear()
+        self.counts.clear()
+        self.times = []
+        self.sorted = True
+        self.stale = True
+        self.dirty.clear()
+
+    def configure(self, breakdowns_only=None, graph_editor=None):
+        ''' Change the filters, rebuilding on the next query if they differ. '''
+        changed = False
+        for name, value in (('breakdowns_only', breakdowns_only),
+                            ('graph_editor', graph_editor)):
+            if value is not None and value != getattr(self, name):
+                setattr(self, name, value)
+                changed = True
+        if changed:
+            self.clear()
+
+    def _selection_changed(self, *args):
+        self.stale = True
+
+    def _edited(self, curves, *args):
+        for i in range(len(curves)):
+            key = om.MObjectHandle(curves[i]).hashCode()
+            if key in self.curves:
+                self.dirty.add(key)
+            else: # Maybe a new curve on the selection - resolve membership
+                self.stale = True
+
+    def _count(self, times, step):
+        for time in times:
+            count = self.counts.get(time, 0) + step
+            if count:
+                self.counts[time] = count
+            else:
+                del self.counts[time]
+        self.sorted = False
+
+    def _add(self, key, handle):
+        times = _curve_times(oma.MFnAnimCurve(handle.object()), self.breakdowns_only)
+        self.curves[key] = (handle, times)
+        self._count(times, 1)
+
+    def _drop(self, key):
+        handle, times = self.curves.pop(key)
+        self._count(times, -1)
+
+    def _curve_names(self):
+        if self.graph_editor:
+            return cmds.keyframe(q=True, selected=True, name=True) or []
+        selection = cmds.ls(sl=True)
+        if not selection:
+            return []
+        return cmds.keyframe(selection, q=True, name=True) or []
+
+    def _sync(self):
+        ''' Patch the index up to the current curves and their edits. '''
+        # Graph Editor key selection has no event, so resolve it every time
+        if self.stale or self.graph_editor or not self.callbacks:
+            handles = {}
+            for name in set(self._curve_names()):
+                handle = om.MObjectHandle(keyData.get_node(name))
+                handles[handle.hashCode()] = handle
+            for key in [key for key in self.curves if key not in handles]:
+                self._drop(key)
+            for key, handle in handles.items():
+                if key not in self.curves:
+                    self._add(key, handle)
+            self.stale = False
+            if not self.callbacks: # No edit events either
+                self.dirty.update(handles)
+
+        for key in self.dirty:
+            if key not in self.curves:
+                continue
+            handle = self.curves[key][0]
+            self._drop(key)
+            if handle.isValid():
+                self._add(key, handle)
+        self.dirty.clear()
+
+        if not self.sorted:
+            self.times = sorted(self.counts)
+            self.sorted = True
+        return self.times
+
+    def next_time(self, frame):
+        ''' First key time after frame, wrapping to the first key. None without keys. '''
+        times = self._sync()
+        if not times:
+            return None
+        i = bisect_right(times, round(frame, DECIMALS))
+        return times[i] if i < len(times) else times[0]
+
+    def previous_time(self, frame):
+        ''' Last key time before frame, wrapping to the last key. None without keys. '''
+        times = self._sync()
+        if not times:
+            return None
+        i = bisect_left(times, round(frame, DECIMALS))
+        return times[i - 1] if i > 0 else times[-1]
@@ -1,50 +1,114 @@
 from maya import cmds
 import maya.api.OpenMaya as mapi
+import maya.api.OpenMayaAnim as oma
+
+import apiUndo
+import keyData
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+PIVOTS = ('first', 'last', 'both')
+STEPPED = (oma.MFnAnimCurve.kTangentStep, oma.MFnAnimCurve.kTangentStepNext)
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _read_key(curve_fn, index):
+    ''' Everything matchKeys copies off one key, in API units. '''
+    return { 'value'  : curve_fn.value(index)
+           , 'types'  : ( curve_fn.inTangentType(index)
+                        , curve_fn.outTangentType(index) )
+           , 'xy'     : ( tuple(curve_fn.getTangentXY(index, True))
+                        , tuple(curve_fn.getTangentXY(index, False)) )
+           , 'locked' : curve_fn.tangentsLocked(index)
+           }
+
+def _average(first, last):
+    '''
+    Meet in the middle for loops - same value, averaged slopes (and
+    weights) on each side. Tangent types survive where both keys agree.
+    '''
+    xy = []
+    types = []
+    for side in (0, 1):
+        (x0, y0), (x1, y1) = first['xy'][side], last['xy'][side]
+        x = (x0 + x1) * 0.5
+        slope = ((y0 / x0 if x0 else 0.0) + (y1 / x1 if x1 else 0.0)) * 0.5
+        xy.append((x, slope * x))
+        same = first['types'][side] == last['types'][side]
+        types.append(first['types'][side] if same
+                     else oma.MFnAnimCurve.kTangentFixed)
+    return { 'value'  : (first['value'] + last['value']) * 0.5
+           , 'types'  : tuple(types)
+           , 'xy'     : tuple(xy)
+           , 'locked' : first['locked'] and last['locked']
+           }
+
+def _write_key(curve_fn, index, key, change):
+    curve_fn.setTangentsLocked(index, False, change)
+    curve_fn.setValue(index, key['value'], change)
+    for side, is_in in ((0, True), (1, False)):
+        tangent_type = key['types'][side]
+        if is_in:
+            curve_fn.setInTangentType(index, tangent_type, change)
+        else:
+            curve_fn.setOutTangentType(index, tangent_type, change)
+        if tangent_type not in STEPPED:
+            x, y = key['xy'][side]
+            curve_fn.setTangent(index, x, y, is_in, change, False)
+    if key['locked']:
+        curve_fn.setTangentsLocked(index, True, change)
+
+def _match_curve(curve_fn, pivot, change):
+    last_key = curve_fn.numKeys - 1 # count starts at 0
+    if last_key < 1:
+        return False
+    first = _read_key(curve_fn, 0)
+    last = _read_key(curve_fn, last_key)
+
+    if pivot == 'first':
+        _write_key(curve_fn, last_key, first, change)
+    elif pivot == 'last':
+        _write_key(curve_fn, 0, last, change)
+    else:
+        both = _average(first, last)
+        _write_key(curve_fn, 0, both, change)
+        _write_key(curve_fn, last_key, both, change)
+    return True
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
 
 def matchKeys(pivot=None):
     # Feed it a string
-    # 'first' to pivot first key 
+    # 'first' to pivot first key
     # 'last' to pivot from last
-    # hur dur
+    # 'both' to meet in the middle - for loops
+    # Every curve is read and edited through the API and undoes as one step.
     if not pivot:
         pivot = 'first'
-    if not pivot == 'first':
-        if not pivot == 'last':
-            mapi.MGlobal.displayError(\
-                'Check the spelling of your matchKeys call. '\
-                'It should either be calling "first" or "last"')
-            return None
+    if pivot not in PIVOTS:
+        mapi.MGlobal.displayError(\
+            'Check the spelling of your matchKeys call. '\
+            'It should either be calling "first", "last" or "both"')
+        return None
 
     selectedAttrs = cmds.keyframe(q=True, sl=True, shape=True, name=True)
     if not selectedAttrs:
         shownCurves = cmds.animCurveEditor('graphEditor1GraphEd', q=True, cs=True)
         selectedAttrs = shownCurves
+    if not selectedAttrs:
+        return None
 
-    for attr in selectedAttrs:
-        firstKey = 0
-        lastKey = cmds.keyframe(attr, q=True, keyframeCount=True) -1 # count starts at 0
-
-        if pivot == 'first':
-            pivotKey = 0 # indexth key, not frame
-            targetKey = lastKey
-        elif pivot == 'last':
-            pivotKey = lastKey
-            targetKey = firstKey
-
-        keyValue = cmds.keyframe(attr, q=True, index=(pivotKey, ), valueChange=True)
-
-        itt = cmds.keyTangent(attr, index=(pivotKey, ), q=True, inTangentType=True)
-        ott = cmds.keyTangent(attr, index=(pivotKey, ), q=True, outTangentType=True)
-        ia = cmds.keyTangent(attr, index=(pivotKey, ), q=True, inAngle=True)    
-        oa = cmds.keyTangent(attr, index=(pivotKey, ), q=True, outAngle=True)
-        
-        cmds.keyframe(attr, edit=True, index=(targetKey, ), valueChange=keyValue[0])
-
-        isWeighted = cmds.keyTangent(attr, index=(pivotKey, ), q=True, weightedTangents=True)
-        if isWeighted:
-            iw = cmds.keyTangent(attr, index=(pivotKey, ), q=True, inWeight=True)
-            ow = cmds.keyTangent(attr, index=(pivotKey, ), q=True, outWeight=True)
-            cmds.keyTangent(attr, index=(targetKey, ), edit=True, itt=itt[0], ott=ott[0], ia=ia[0], oa=oa[0], iw=iw[0], ow=ow[0])
-        else:
-            cmds.keyTangent(attr, index=(targetKey, ), edit=True, itt=itt[0], ott=ott[0], ia=ia[0], oa=oa[0])
-
+    curves = cmds.keyframe(selectedAttrs, q=True, name=True) or []
+    change = oma.MAnimCurveChange()
+    matched = 0
+    for curve in set(curves):
+        if _match_curve(keyData.get_curve_fn(curve), pivot, change):
+            matched += 1
+    if matched:
+        apiUndo.commit(change.undoIt, change.redoIt)
+    return matched
@@ -0,0 +1,192 @@
+# ============================================================================ #
+# Scoped performance switches
+#
+# Suspend turns off the expensive parts of Maya while a batch tool runs and
+# puts them back afterwards. It works as a context manager or a decorator
+# and nests: every feature is reference counted, so only the outermost scope
+# that asked for a feature switches it off and back on.
+#
+#   with performance.Suspend('crop_cycle', undo=True, autokey=True):
+#       ...
+#
+#   @performance.Suspend(cycle_check=True)
+#   def bake_everything(): ...
+#
+# Each scope records how long it took in TIMINGS. Call report() to see where
+# time goes.
+
+import time
+from collections import defaultdict
+from functools import wraps
+
+from maya import cmds, mel
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+FEATURES = ( 'viewport'
+           , 'parallel'
+           , 'time_slider'
+           , 'undo'
+           , 'autokey'
+           , 'cycle_check'
+           , 'eval_cache'
+           )
+DEFAULTS = { 'viewport'    : True
+           , 'parallel'    : True
+           , 'time_slider' : True
+           , 'undo'        : False
+           , 'autokey'     : False
+           , 'cycle_check' : False
+           , 'eval_cache'  : False
+           }
+
+TIMINGS = defaultdict(list) # scope name: [seconds, ...]
+
+_depth = dict((feature, 0) for feature in FEATURES)
+_saved = {}
+
+
+# ============================================================================ #
+# Suspend / restore pairs ==================================================== #
+# Each suspend returns whatever its restore needs.
+
+def _suspend_viewport():
+    mel.eval("paneLayout -e -manage false $gMainPane")
+    cmds.refresh(suspend=True)
+
+def _restore_viewport(state):
+    cmds.refresh(suspend=False)
+    mel.eval("paneLayout -e -manage true $gMainPane")
+    cmds.refresh()
+
+def _suspend_parallel():
+    parallel = 'parallel' in cmds.evaluationManager(q=True, mode=True)
+    if parallel:
+        cmds.evaluationManager(mode='off')
+    return parallel
+
+def _restore_parallel(parallel):
+    if parallel:
+        cmds.evaluationManager(mode='parallel')
+
+def _suspend_time_slider():
+    visible = mel.eval('isUIComponentVisible("Time Slider")')
+    mel.eval("setTimeSliderVisible 0;")
+    return visible
+
+def _restore_time_slider(visible):
+    if visible:
+        mel.eval("setTimeSliderVisible 1;")
+
+def _suspend_undo():
+    state = cmds.undoInfo(q=True, state=True)
+    cmds.undoInfo(stateWithoutFlush=False)
+    return state
+
+def _restore_undo(state):
+    cmds.undoInfo(stateWithoutFlush=state)
+
+def _suspend_autokey():
+    state = cmds.autoKeyframe(q=True, state=True)
+    cmds.autoKeyframe(state=False)
+    return state
+
+def _restore_autokey(state):
+    cmds.autoKeyframe(state=state)
+
+def _suspend_cycle_check():
+    state = cmds.cycleCheck(q=True, evaluation=True)
+    cmds.cycleCheck(evaluation=False)
+    return state
+
+def _restore_cycle_check(state):
+    cmds.cycleCheck(evaluation=state)
+
+def _suspend_eval_cache():
+    try: # No cached playback before 2019
+        state = cmds.evaluator(name='cache', q=True, enable=True)
+    except RuntimeError:
+        return None
+    if state:
+        cmds.evaluator(name='cache', enable=False)
+    return state
+
+def _restore_eval_cache(state):
+    if state:
+        cmds.evaluator(name='cache', enable=True)
+
+_SUSPEND = dict((f, globals()['_suspend_' + f]) for f in FEATURES)
+_RESTORE = dict((f, globals()['_restore_' + f]) for f in FEATURES)
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class Suspend(object):
+    '''
+    name: label for TIMINGS. Decorators default to the function name.
+    Keyword flags switch features on/off, see DEFAULTS.
+    '''
+    def __init__(self, name=None, **features):
+        unknown = set(features) - set(FEATURES)
+        if unknown:
+            raise ValueError('Unknown features: {}'.format(sorted(unknown)))
+        self.name = name
+        self.features = [f for f in FEATURES if features.get(f, DEFAULTS[f])]
+        self._starts = [] # One per active entry, so the same scope can recurse
+
+    def __enter__(self):
+        entered = []
+        try:
+            for feature in self.features:
+                if _depth[feature] == 0:
+                    _saved[feature] = _SUSPEND[feature]()
+                _depth[feature] += 1
+                entered.append(feature)
+        except:
+            # Resume what was already suspended before passing the error on
+            self._resume(entered)
+            raise
+        self._starts.append(time.time())
+        return self
+
+    def __exit__(self, *exc_info):
+        TIMINGS[self.name or 'unnamed'].append(time.time() - self._starts.pop())
+        self._resume(self.features)
+        return False # will raise original error
+
+    def _resume(self, features):
+        for feature in reversed(features):
+            _depth[feature] -= 1
+            if _depth[feature] == 0:
+                _RESTORE[feature](_saved.pop(feature))
+
+    def __call__(self, func):
+        if self.name is None:
+            self.name = func.__name__
+
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrap
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def is_suspended(feature):
+    return _depth[feature] > 0
+
+def reset_timings():
+    TIMINGS.clear()
+
+def report():
+    ''' Print total/average time per scope, slowest first. '''
+    rows = sorted(TIMINGS.items(), key=lambda item: -sum(item[1]))
+    for name, durations in rows:
+        print("{:<40} {:>4} calls {:>9.3f}s total {:>8.3f}s avg".format(
+            name, len(durations), sum(durations),
+            sum(durations) / len(durations)))
+    return rows
@@ -0,0 +1,187 @@
+# ============================================================================ #
+# Vectorized rotation helpers - no Maya required
+#
+# Maya conventions: row vectors, angles in radians, rotate orders named by the
+# order the axes are applied ('xyz' rotates X first). Every function works on
+# arrays of any leading shape, eg. (frames, nodes, 3) or (frames, nodes, 3, 3).
+
+from __future__ import division
+
+import numpy as np
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+ROTATE_ORDERS = ['xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx'] # rotateOrder enum
+AXIS_INDEX    = {'x': 0, 'y': 1, 'z': 2}
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _order_indices(order):
+    if not isinstance(order, str):
+        order = ROTATE_ORDERS[int(order)]
+    i, j, k = [AXIS_INDEX[axis] for axis in order]
+    # Cyclic orders (xyz, yzx, zxy) are even permutations
+    parity = 1.0 if (j - i) % 3 == 1 else -1.0
+    return i, j, k, parity
+
+def _axis_matrices(angles, axis):
+    ''' Row-vector rotation matrices about a single axis. '''
+    c = np.cos(angles)
+    s = np.sin(angles)
+    m = np.zeros(angles.shape + (3, 3))
+    a, b = (axis + 1) % 3, (axis + 2) % 3
+    m[..., axis, axis] = 1.0
+    m[..., a, a] = c
+    m[..., b, b] = c
+    m[..., a, b] = s
+    m[..., b, a] = -s
+    return m
+
+
+# ============================================================================ #
+# Public methods ============================================================= #
+
+def euler_to_matrix(euler, order='xyz'):
+    '''
+    euler: (..., 3) radians in x, y, z slots
+    Returns (..., 3, 3) row-vector rotation matrices.
+    '''
+    euler = np.asarray(euler, dtype=np.float64)
+    i, j, k, _ = _order_indices(order)
+    first  = _axis_matrices(euler[..., i], i)
+    second = _axis_matrices(euler[..., j], j)
+    third  = _axis_matrices(euler[..., k], k)
+    return np.matmul(np.matmul(first, second), third)
+
+def matrix_to_euler(matrix, order='xyz'):
+    '''
+    matrix: (..., 3, 3) orthonormal row-vector rotation matrices
+    Returns (..., 3) radians in x, y, z slots.
+    '''
+    matrix = np.asarray(matrix, dtype=np.float64)
+    i, j, k, parity = _order_indices(order)
+    # Column-vector form is the transpose: C = Rk * Rj * Ri
+    c = np.swapaxes(matrix, -1, -2)
+    euler = np.empty(matrix.shape[:-2] + (3,))
+    euler[..., j] = np.arcsin(np.clip(-parity * c[..., k, i], -1.0, 1.0))
+    euler[..., i] = np.arctan2(parity * c[..., k, j], c[..., k, k])
+    euler[..., k] = np.arctan2(parity * c[..., j, i], c[..., i, i])
+
+    # Gimbal lock - fold everything into the first axis
+    locked = np.abs(c[..., k, i]) > 1.0 - 1e-12
+    if np.any(locked):
+        euler[..., k] = np.where(locked, 0.0, euler[..., k])
+        flipped = np.arctan2(-parity * c[..., j, k], c[..., j, j])
+        euler[..., i] = np.where(locked, flipped, euler[..., i])
+    return euler
+
+def orthonormalize(matrix):
+    '''
+    Split (..., 3, 3) matrices into row scales and pure rotations.
+    Shear is ignored, negative determinants flip the x scale.
+    '''
+    matrix = np.asarray(matrix, dtype=np.float64)
+    scale = np.linalg.norm(matrix, axis=-1)
+    rotation = matrix / np.where(scale == 0.0, 1.0, scale)[..., None]
+    negative = np.linalg.det(rotation) < 0.0
+    if np.any(negative):
+        scale[..., 0] = np.where(negative, -scale[..., 0], scale[..., 0])
+        rotation[..., 0, :] = np.where(negative[..., None],
+                                       -rotation[..., 0, :],
+                                       rotation[..., 0, :])
+    return scale, rotation
+
+def matrix_to_quaternion(matrix):
+    '''
+    matrix: (..., 3, 3) row-vector rotation matrices
+    Returns (..., 4) unit quaternions as w, x, y, z.
+    '''
+    c = np.swapaxes(np.asarray(matrix, dtype=np.float64), -1, -2)
+    trace = c[..., 0, 0] + c[..., 1, 1] + c[..., 2, 2]
+    # One candidate per largest component keeps the square root away from 0
+    candidates = np.stack([
+        np.stack([1.0 + trace, c[..., 2, 1] - c[..., 1, 2],
+                  c[..., 0, 2] - c[..., 2, 0], c[..., 1, 0] - c[..., 0, 1]], -1),
+        np.stack([c[..., 2, 1] - c[..., 1, 2], 1.0 + c[..., 0, 0] - c[..., 1, 1] - c[..., 2, 2],
+                  c[..., 0, 1] + c[..., 1, 0], c[..., 0, 2] + c[..., 2, 0]], -1),
+        np.stack([c[..., 0, 2] - c[..., 2, 0], c[..., 0, 1] + c[..., 1, 0],
+                  1.0 - c[..., 0, 0] + c[..., 1, 1] - c[..., 2, 2], c[..., 1, 2] + c[..., 2, 1]], -1),
+        np.stack([c[..., 1, 0] - c[..., 0, 1], c[..., 0, 2] + c[..., 2, 0],
+                  c[..., 1, 2] + c[..., 2, 1], 1.0 - c[..., 0, 0] - c[..., 1, 1] + c[..., 2, 2]], -1),
+    ], -2)
+    diagonal = np.stack([trace, c[..., 0, 0], c[..., 1, 1], c[..., 2, 2]], -1)
+    best = np.argmax(diagonal, axis=-1)
+    quaternion = np.take_along_axis(candidates, best[..., None, None], -2)[..., 0, :]
+    return quaternion / np.linalg.norm(quaternion, axis=-1)[..., None]
+
+def quaternion_to_matrix(quaternion):
+    '''
+    quaternion: (..., 4) as w, x, y, z - normalized here
+    Returns (..., 3, 3) row-vector rotation matrices.
+    '''
+    q = np.asarray(quaternion, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1)[..., None]
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    c = np.empty(q.shape[:-1] + (3, 3))
+    c[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    c[..., 0, 1] = 2 * (x * y - w * z)
+    c[..., 0, 2] = 2 * (x * z + w * y)
+    c[..., 1, 0] = 2 * (x * y + w * z)
+    c[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    c[..., 1, 2] = 2 * (y * z - w * x)
+    c[..., 2, 0] = 2 * (x * z - w * y)
+    c[..., 2, 1] = 2 * (y * z + w * x)
+    c[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return np.swapaxes(c, -1, -2)
+
+def unroll_quaternions(quaternions, axis=0):
+    ''' Flip signs along axis so neighbouring quaternions never point apart. '''
+    q = np.moveaxis(np.array(quaternions, dtype=np.float64), axis, 0)
+    dots = np.sum(q[1:] * q[:-1], axis=-1)
+    flips = np.cumsum(dots < 0.0, axis=0) % 2 == 1
+    q[1:][flips] *= -1.0
+    return np.moveaxis(q, 0, axis)
+
+def alternate_euler(euler, order='xyz'):
+    ''' The other euler triple giving the same rotation - middle axis mirrored. '''
+    euler = np.array(euler, dtype=np.float64)
+    i, j, k, _ = _order_indices(order)
+    euler[..., i] += np.pi
+    euler[..., j] = np.pi - euler[..., j]
+    euler[..., k] += np.pi
+    return euler
+
+def filter_euler(euler, order='xyz'):
+    '''
+    euler: (frames, ..., 3) radians - whole rotation tracks
+    Returns the filtered track and a (frames, ...) mask of frames that
+    switched to the alternate solution (their middle axis runs backwards).
+
+    Tracks go through quaternions, are unrolled, and every frame picks
+    whichever of the two euler solutions - shifted by whole turns - lands
+    closest to the frame before. The first frame is kept as is.
+    '''
+    euler = np.asarray(euler, dtype=np.float64)
+    quaternions = unroll_quaternions(
+        matrix_to_quaternion(euler_to_matrix(euler, order)))
+    base = matrix_to_euler(quaternion_to_matrix(quaternions), order)
+    candidates = np.stack([base, alternate_euler(base, order)]) # (2, frames, ..., 3)
+    turn = 2.0 * np.pi
+
+    filtered = np.empty(euler.shape)
+    filtered[0] = euler[0]
+    for f in range(1, len(euler)):
+        shifted = candidates[:, f] + turn * np.round(
+            (filtered[f - 1] - candidates[:, f]) / turn)
+        distance = np.abs(shifted - filtered[f - 1]).sum(axis=-1)
+        choice = np.argmin(distance, axis=0)
+        filtered[f] = np.where((choice == 0)[..., None], shifted[0], shifted[1])
+
+    # Compare with the input: same solution means every axis differs by
+    # whole turns only
+    offset = (filtered - euler) / turn
+    switched = np.abs(offset - np.round(offset)).max(axis=-1) > 1e-6
+    return filtered, switched
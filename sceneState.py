@@ -0,0 +1,125 @@
+# ============================================================================ #
+# Scene state kept up to date by Maya events
+#
+# Playback range, animation range, current time, fps and the time slider
+# control, read through the API once and then only again after the event
+# that changes them. Tools read attributes off STATE on their hot path
+# instead of querying cmds.playbackOptions every call.
+#
+#   sceneState.STATE.install()
+#   sceneState.STATE.min_time, sceneState.STATE.current_time
+#
+# Without install() every read queries Maya (a miss); hits and misses are
+# counted so report() shows whether the cache is doing its job.
+
+from maya import mel
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+# ============================================================================ #
+# Globals ==================================================================== #
+
+GROUPS = { 'playback' : ('min_time', 'max_time', 'start_time', 'end_time')
+         , 'time'     : ('current_time',)
+         , 'unit'     : ('fps',)
+         , 'ui'       : ('time_control',)
+         }
+FIELDS = dict((field, group) for group, fields in GROUPS.items() for field in fields)
+
+# Event: groups it makes stale
+EVENTS = { 'playbackRangeChanged'       : ('playback',)
+         , 'playbackRangeSliderChanged' : ('playback',)
+         , 'timeChanged'                : ('time',)
+         , 'timeUnitChanged'            : ('playback', 'time', 'unit')
+         , 'SceneOpened'                : tuple(GROUPS)
+         , 'NewSceneOpened'             : tuple(GROUPS)
+         }
+
+
+# ============================================================================ #
+# Private methods ============================================================ #
+
+def _frames(mtime):
+    return mtime.asUnits(om.MTime.uiUnit())
+
+def _read(group):
+    if group == 'playback':
+        return { 'min_time'   : _frames(oma.MAnimControl.minTime())
+               , 'max_time'   : _frames(oma.MAnimControl.maxTime())
+               , 'start_time' : _frames(oma.MAnimControl.animationStartTime())
+               , 'end_time'   : _frames(oma.MAnimControl.animationEndTime())
+               }
+    if group == 'time':
+        return {'current_time' : _frames(oma.MAnimControl.currentTime())}
+    if group == 'unit':
+        return {'fps' : om.MTime(1.0, om.MTime.kSeconds).asUnits(om.MTime.uiUnit())}
+    return {'time_control' : mel.eval('$tmpVar=$gPlayBackSlider')}
+
+
+# ============================================================================ #
+# Public Class =============================================================== #
+
+class SceneState(object):
+    '''
+    min_time, max_time     playback range
+    start_time, end_time   animation range
+    current_time, fps      in the UI time unit
+    time_control           the time slider's control name
+    '''
+    def __init__(self):
+        self.values = {}
+        self.stale = set(GROUPS)
+        self.callbacks = []
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        group = FIELDS.get(name)
+        if group is None:
+            raise AttributeError(name)
+        return self.read(group)[name]
+
+    def install(self):
+        if not self.callbacks:
+            for event, groups in EVENTS.items():
+                self.callbacks.append(om.MEventMessage.addEventCallback(
+                    event, self._changed, groups))
+            self.stale = set(GROUPS)
+        return self
+
+    def uninstall(self):
+        if self.callbacks:
+            om.MMessage.removeCallbacks(self.callbacks)
+        self.callbacks = []
+        self.stale = set(GROUPS)
+
+    def _changed(self, groups):
+        self.stale.update(groups)
+
+    def read(self, group):
+        ''' The fields of one group, from the cache while it's fresh. '''
+        if self.callbacks and group not in self.stale:
+            self.hits += 1
+            return self.values
+        self.misses += 1
+        self.values.update(_read(group))
+        if self.callbacks:
+            self.stale.discard(group)
+        return self.values
+
+    def playback_range(self):
+        values = self.read('playback')
+        return values['min_time'], values['max_time']
+
+    def animation_range(self):
+        values = self.read('playback')
+        return values['start_time'], values['end_time']
+
+    def report(self):
+        total = self.hits + self.misses
+        print('Scene state: {} hits, {} misses ({:.0%} cached), callbacks {}'.format(
+            self.hits, self.misses, float(self.hits) / total if total else 0.0,
+            'on' if self.callbacks else 'off'))
+
+
+STATE = SceneState()
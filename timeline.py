@@ -3,10 +3,13 @@
 
 from maya import cmds, mel
 
+import keyTimeIndex
+import sceneState
+
 # ============================================================================ #
 # Flexible Globals
 
-timeline_control = mel.eval('$tmpVar=$gPlayBackSlider')
+timeline_control = sceneState.STATE.time_control
 start_time       = None
 end_time         = None
 min_time         = None
@@ -17,6 +20,10 @@ bounds           = True
 audio_scrub      = True
 audio            = True
 
+breakdowns_only  = False # next/previous key only stop on breakdowns
+ge_keys_only     = False # ... only on curves with keys selected in the GE
+key_index        = keyTimeIndex.KeyTimeIndex()
+
 # ============================================================================ #
 
 def toggle_audio():
@@ -35,30 +42,40 @@ def toggle_bounds():
     global bounds
     bounds = not bounds
 
+def toggle_breakdowns_only():
+    global breakdowns_only
+    breakdowns_only = not breakdowns_only
+
+def toggle_ge_keys_only():
+    global ge_keys_only
+    ge_keys_only = not ge_keys_only
+
 def set_increment(new_increment = 1):
     global increment
     increment = new_increment
 
 def updateVars():
+    # Plain reads - sceneState refreshes them from Maya's events
     global start_time, end_time, min_time, max_time
-    start_time = cmds.playbackOptions(animationStartTime=1,q=1)
-    end_time   = cmds.playbackOptions(animationEndTime=1,q=1)
-    min_time   = cmds.playbackOptions(minTime=1,q=1)
-    max_time   = cmds.playbackOptions(maxTime=1,q=1)
+    state = sceneState.STATE.install()
+    start_time, end_time = state.animation_range()
+    min_time, max_time   = state.playback_range()
 
 # ---------------------------------------------------------------------------- #
 
 def set_in():
     updateVars()
+    current_time = sceneState.STATE.current_time
     cmds.playbackOptions(min = start_time \
-        if cmds.currentTime(q=1) == min_time \
-        else cmds.currentTime(q=1))
+        if current_time == min_time \
+        else current_time)
 
 def set_out():
     updateVars()
+    current_time = sceneState.STATE.current_time
     cmds.playbackOptions(max = end_time \
-        if cmds.currentTime(q=1) == max_time \
-        else cmds.currentTime(q=1))
+        if current_time == max_time \
+        else current_time)
 
 def set_in_and_out():
     updateVars()
@@ -74,23 +91,31 @@ def set_in_and_out():
 def next_frame():
     updateVars()
     cmds.undoInfo(swf=False)
-    frame = cmds.currentTime(q=True) + increment
+    frame = sceneState.STATE.current_time + increment
     cmds.currentTime(min_time if bounds and frame > max_time else frame)
     cmds.undoInfo(swf=True)
 
 def previous_frame():
     updateVars()
     cmds.undoInfo(swf=False)
-    frame = cmds.currentTime(q=True) - increment
+    frame = sceneState.STATE.current_time - increment
     cmds.currentTime(max_time if bounds and frame < min_time else frame)
     cmds.undoInfo(swf=True)
 
+def _key_time(which):
+    key_index.install()
+    key_index.configure(breakdowns_only, ge_keys_only)
+    current = sceneState.STATE.current_time
+    if which == 'next':
+        return current, key_index.next_time(current)
+    return current, key_index.previous_time(current)
+
 def next_key():
     updateVars()
     cmds.undoInfo(swf=False)
-    frame = cmds.findKeyframe(timeSlider=True, which="next")
-    # Returns current frame if it can't find a key
-    if frame == cmds.currentTime(q=True):
+    current, frame = _key_time('next')
+    # None, or the current frame, when there is nowhere else to go
+    if frame is None or frame == round(current, keyTimeIndex.DECIMALS):
         cmds.currentTime(max_time, e=1) # Just go to the end
     else:
         cmds.currentTime(frame, e=1)
@@ -99,9 +124,8 @@ def next_key():
 def previous_key():
     updateVars()
     cmds.undoInfo(swf=False)
-    frame = cmds.findKeyframe(timeSlider=True, which="previous")
-    # Returns current frame if it can't find a key
-    if frame == cmds.currentTime(q=True):
+    current, frame = _key_time('previous')
+    if frame is None or frame == round(current, keyTimeIndex.DECIMALS):
         cmds.currentTime(min_time, e=1) # Go to the beginning
     else:
         cmds.currentTime(frame, e=1)
@@ -1,11 +1,16 @@
 # =+------------------------------------------------------------------------+= #
 # Imports
 
-from Qt import QtWidgets, QtGui, QtCompat # pylint:disable=E0611
+import time
+
+from Qt import QtCore, QtWidgets, QtGui, QtCompat # pylint:disable=E0611
 import maya.OpenMaya as om
 import maya.OpenMayaUI as omui
 from maya import cmds, mel
 
+import frameIntervals
+import sceneState
+
 
 # =+------------------------------------------------------------------------+= #
 # Public Class
@@ -13,6 +18,7 @@ from maya import cmds, mel
 class Timeline_Overlay(QtWidgets.QWidget):
     def __init__(self, frame_times=[0.0], active_color=(150, 150, 150, 100)):
 
+        self.state = sceneState.STATE.install()
         self.time_control_widget = self._get_time_widget()
 
         if self.time_control_widget:
@@ -21,9 +27,14 @@ class Timeline_Overlay(QtWidgets.QWidget):
             self.close()
             self.deleteLater()
 
-        self.frame_times = []
+        self.intervals = frameIntervals.FrameIntervals()
         self.active_color = []
         self.alpha = 100.0 # Difficult to screw up color input
+        self.pixmap = None # Rendered marks, see _get_pixmap
+        self.pixmap_key = None
+        self.profile = False # Opt in paint timing, see set_profiling
+        self.paint_count = 0
+        self.paint_time = 0.0
         self.set_frames(frame_times) # Clean the frame range
         self.set_color(active_color) # Clean up the color input
 
@@ -38,20 +49,80 @@ class Timeline_Overlay(QtWidgets.QWidget):
         return QtCompat.wrapInstance(long(widget), QtWidgets.QWidget)
 
     def _get_time_control(self):
-        return mel.eval('$tmpVar = $gPlayBackSlider')
+        return self.state.time_control
 
     def _clamp(self, n, smallest, largest):
         return max(smallest, min(n, largest))
 
-    def _group(self, L):
-        first = last = L[0]
-        for n in L[1:]:
-            if n - 1 == last: # Part of the group, bump the end
-                last = n
-            else: # Not part of the group, yield current group and start a new
-                yield first, last
-                first = last = n
-        yield first, last # Yield the last group
+    def _layout(self):
+        ''' (range_start, range_end, frame_width, padding, height) '''
+        range_start, range_end = self.state.playback_range()
+        displayed_frame_count = range_end - range_start + 1
+        padding = self.width() * 0.005
+        frame_width = (self.width() * 0.99) / displayed_frame_count
+        return range_start, range_end, frame_width, padding, self.height()
+
+    def _span_rect(self, start_frame, end_frame, layout):
+        range_start, _, frame_width, padding, height = layout
+        start_width = frame_width * (start_frame-range_start) + 1
+        end_width = frame_width * (end_frame - start_frame)
+        return QtCore.QRectF(padding + start_width, 0, end_width-2, height)
+
+    def _marks_changed(self, spans):
+        ''' Rebuild the pixmap, repaint only where spans (old or new) are. '''
+        self.pixmap = None
+        layout = self._layout()
+        dirty = QtCore.QRectF()
+        for span in spans:
+            if span:
+                dirty = dirty.united(self._span_rect(span[0], span[1], layout))
+        if not dirty.isEmpty():
+            self.update(dirty.toAlignedRect().adjusted(-2, -2, 2, 2))
+
+    def _colors_changed(self):
+        self.pixmap = None
+        self.update()
+
+    def _render(self, layout):
+        ratio = self.devicePixelRatioF() if hasattr(self, 'devicePixelRatioF') else 1.0
+        pixmap = QtGui.QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(QtCore.Qt.transparent)
+
+        # -------------------------------------------------------------------- #
+        # Painter widgets
+        painter = QtGui.QPainter(pixmap)
+        fill_color = QtGui.QColor(*self.active_color)
+        fill_color.setAlpha(self.alpha)
+
+        pen = painter.pen()
+        pen.setWidth(1)
+        highlight_color = \
+            [self._clamp(x + 10, 0, 255) for x in self.active_color]
+        pen_color = QtGui.QColor(*highlight_color)
+        pen_color.setAlpha(self._clamp(self.alpha * 2, 0, 255))
+        pen.setColor(pen_color)
+        painter.setPen(pen)
+
+        # -------------------------------------------------------------------- #
+        # Can support individual frames with groups, etc..
+        range_start, range_end = layout[:2]
+        for start_frame, end_frame in self.intervals.overlapping(
+                range_start, range_end + 1):
+            rect = self._span_rect(start_frame, end_frame, layout)
+            painter.fillRect(rect, fill_color)
+            painter.drawRect(rect.adjusted(0, 1, 0, -1)) # Watch out for stroke thickness
+        painter.end()
+        return pixmap
+
+    def _get_pixmap(self):
+        ''' The marks drawn once per playback range, size, marks and colours. '''
+        layout = self._layout()
+        key = (self.width(), self.height(), layout[0], layout[1])
+        if self.pixmap is None or self.pixmap_key != key:
+            self.pixmap = self._render(layout)
+            self.pixmap_key = key
+        return self.pixmap
 
 
     # ------------------------------------------------------------------------ #
@@ -61,22 +132,29 @@ class Timeline_Overlay(QtWidgets.QWidget):
         '''
         It's possible to send a list with ranges as 2-item lists.
         For example, [[-10,20],25,39,[50,100]]
+        Frames can be floats - every mark is one frame wide.
         '''
-        new_frame_times = []
-        if not isinstance(frames, list): frames = [frames]
-        for frame in frames:
-            if isinstance(frame, list):
-                frame = frame if frame[0]<frame[1] else [frame[1],frame[0]]
-                frame_range = range(frame[0], frame[1]+1)
-                new_frame_times.extend(frame_range )
-            else:
-                new_frame_times.append(frame)
-        self.frame_times = list(set(new_frame_times))
-        self.frame_times.sort()
-        self.update()
+        old_bounds = self.intervals.bounds()
+        self.intervals = frameIntervals.FrameIntervals.from_frames(frames)
+        self._marks_changed([old_bounds, self.intervals.bounds()])
+
+    def add_frames(self, frames):
+        ''' Mark more frames, same input as set_frames. '''
+        added = frameIntervals.FrameIntervals.from_frames(frames)
+        for start, end in added:
+            self.intervals.add(start, end)
+        self._marks_changed([added.bounds()])
+
+    def remove_frames(self, frames):
+        ''' Unmark frames, same input as set_frames. '''
+        removed = frameIntervals.FrameIntervals.from_frames(frames)
+        for start, end in removed:
+            self.intervals.remove(start, end)
+        self._marks_changed([removed.bounds()])
 
     def get_frames(self):
-        return self.frame_times
+        ''' Marked [start, end) spans, end excluded. '''
+        return self.intervals.spans()
 
     def set_color(self, color):
         ''' Set either rgb or rgba (255,255,255,255)'''
@@ -86,64 +164,50 @@ class Timeline_Overlay(QtWidgets.QWidget):
         elif len(color) == 4:
             self.active_color = color[:3] # Assuming the 4th is alpha
             self.alpha = color[-1]
-        self.update()
+        self._colors_changed()
 
     def set_alpha(self, alpha):
         ''' Set alpha 0-255 '''
         if not isinstance(alpha, float): alpha = float(alpha)
         self.alpha = alpha
-        self.update()
+        self._colors_changed()
+
+    def set_profiling(self, enabled=True):
+        ''' Time every paint from now on, eg. during playback. '''
+        self.profile = enabled
+        self.paint_count = 0
+        self.paint_time = 0.0
+
+    def paint_report(self):
+        average = self.paint_time / self.paint_count if self.paint_count else 0.0
+        print('Timeline overlay: {} paints, {:.3f} ms average, {:.1f} ms total'.format(
+            self.paint_count, average * 1000.0, self.paint_time * 1000.0))
 
 
     # ------------------------------------------------------------------------ #
     def paintEvent(self, paint_event):
         parent = self.parentWidget()
         if parent:
+            if self.profile:
+                start = time.time()
             # ---------------------------------------------------------------- #
             # Basic frame geometry stuff
-            self.setGeometry(parent.geometry()) # Make it the same size
-
-            range_start = cmds.playbackOptions(query=True, minTime=True)
-            range_end   = cmds.playbackOptions(query=True, maxTime=True)
-            displayed_frame_count = range_end - range_start + 1
-
-            height = self.parent().height()
-            padding = self.width() * 0.005
-            frame_width = (self.width() * 0.99) / displayed_frame_count
-
-            # ---------------------------------------------------------------- #
-            # Painter widgets
+            if self.geometry() != parent.geometry():
+                self.setGeometry(parent.geometry()) # Make it the same size
+
+            # Playback repaints only blit the part Qt asked for
+            rect = QtCore.QRectF(paint_event.rect())
+            pixmap = self._get_pixmap()
+            ratio = pixmap.devicePixelRatio()
+            source = QtCore.QRectF(rect.x() * ratio, rect.y() * ratio,
+                                   rect.width() * ratio, rect.height() * ratio)
             painter = QtGui.QPainter(self)
-            fill_color = QtGui.QColor(*self.active_color)
-            fill_color.setAlpha(self.alpha)
-
-            pen = painter.pen()
-            pen.setWidth(1)
-            highlight_color = \
-                [self._clamp(x + 10, 0, 255) for x in self.active_color]
-            pen_color = QtGui.QColor(*highlight_color)
-            pen_color.setAlpha(self._clamp(self.alpha * 2, 0, 255))
-            pen.setColor(pen_color)
-            painter.setPen(pen)
+            painter.drawPixmap(rect, pixmap, source)
+            painter.end()
 
-            # ---------------------------------------------------------------- #
-            # Can support individual frames with groups, etc..
-            for frame_group in list(self._group(self.frame_times)):
-
-                range_frame_times = max(frame_group) - min(frame_group) + 1
-                start_frame = frame_group[0]
-                start_width = frame_width * (start_frame-range_start) + 1
-                end_width = frame_width * range_frame_times
-
-                painter.fillRect(padding + start_width,
-                                 0,
-                                 end_width-2,
-                                 height,
-                                 fill_color)
-                painter.drawRect(padding + start_width,
-                                 1, # Watch out for stroke thickness
-                                 end_width-2,
-                                 height-2)
+            if self.profile:
+                self.paint_count += 1
+                self.paint_time += time.time() - start
 
 
 # =+------------------------------------------------------------------------+= #
@@ -0,0 +1,104 @@
+# ==================================================================== #
+'''
+- Tangent Angle Slider -
+Drag to swing the tangents of the selected keys towards straight
+up/down. The selection is captured when the window opens, drag ticks
+are coalesced to the display refresh rate and every release is one
+undo step.
+
+- How to use -
+Select keys in the Graph Editor, then run this PYTHON code:
+
+import ui_tangentAngleSlider
+ui_tangentAngleSlider.show()
+
+'''
+# ==================================================================== #
+
+
+from Qt import QtCore, QtGui # pylint:disable=E0611
+import maya.api.OpenMayaAnim as oma
+from maya import cmds
+
+import apiUndo
+import graphEditorTools
+
+
+WINDOW = 'tangentAngleSliderWindow'
+FALLBACK_FPS = 60.0
+SLIDER = None # Keeps the timer alive while the window is open
+
+
+def _tick_interval():
+    screen = QtGui.QGuiApplication.primaryScreen()
+    fps = screen.refreshRate() if screen else 0.0
+    return int(1000.0 / (fps or FALLBACK_FPS))
+
+
+class TangentAngleSlider(object):
+    '''
+    base:    KeySnapshot captured once, every value is relative to it
+    applied: the state the undo queue knows about
+    '''
+    def __init__(self, keys):
+        self.base = keys
+        self.applied = keys
+        self.pending = None
+        self.dragging = False
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(_tick_interval())
+        self.timer.timeout.connect(self._tick)
+
+    def _drag(self, value):
+        self.pending = value
+        if not self.dragging:
+            # Make the handles fixed once, ticks after that only move vectors
+            self.dragging = True
+            graphEditorTools.angled_keys(self.base, value)\
+                            .write(in_sides=True, out_sides=True)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def _tick(self):
+        if self.pending is None:
+            return
+        graphEditorTools.angled_keys(self.base, self.pending).write_angles()
+        self.pending = None
+
+    def _release(self, value):
+        self.timer.stop()
+        self.pending = None
+        self.dragging = False
+        # Live ticks never reached the undo queue. Put back what it knows,
+        # then make the real edit once.
+        self.applied.write(in_sides=True, out_sides=True)
+        final = graphEditorTools.angled_keys(self.base, value)
+        change = oma.MAnimCurveChange()
+        final.write(change=change, in_sides=True, out_sides=True)
+        apiUndo.commit(change.undoIt, change.redoIt)
+        self.applied = final
+
+    def show(self):
+        if cmds.window(WINDOW, q=True, exists=True):
+            cmds.deleteUI(WINDOW)
+        cmds.window(WINDOW, title='Tangent Angle')
+        cmds.columnLayout(adjustableColumn=True)
+        cmds.floatSlider( min=-90, max=90, value=0, step=1, width=500
+                        , dragCommand=self._drag
+                        , changeCommand=self._release
+                        )
+        cmds.showWindow(WINDOW)
+
+
+def show():
+    global SLIDER
+    keys = graphEditorTools.get_anim_data()
+    if not keys:
+        return None
+    SLIDER = TangentAngleSlider(keys)
+    SLIDER.show()
+    return SLIDER
+
+if __name__ == '__main__':
+    show()